@@ -0,0 +1,78 @@
+"""
+    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+    Copyright (C) 2024 Ole Richter - University of Groningen
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys, logging
+
+sys.path.append('..')
+sys.path.append('.')
+
+from uC_api import *
+from uC_api.acknowledge import AckTracker, STATE_NAMES
+
+logging.basicConfig(level=logging.INFO)
+
+# the matching of the AckTracker is checked with packets made up here, no uC needed
+
+def data_packet(value, time=0, header=Data32bitHeader.IN_ASYNC_TO_CHIP0):
+    return Data32bitPacket(header, value=value, time=time).to_bytearray()
+
+def states(tracker):
+    return [STATE_NAMES[state] for state in tracker.states()[1]]
+
+# 1. instant and timed packets of one header: a confirmation belongs to the oldest instant packet,
+#    or to the oldest timed one if its time has come, the one with the same value if both fit
+
+tracker = AckTracker("instant and timed")
+tracker.sent(data_packet(1, time=500) + data_packet(2) + data_packet(3, time=800) + data_packet(4))
+tracker.received(data_packet(2, time=100))  # before 500, only the instant packet can be executed
+tracker.received(data_packet(1, time=500))  # both fit, the value decides
+tracker.received(data_packet(4, time=600))
+tracker.received(data_packet(3, time=800))
+assert states(tracker) == ["executed"] * 4, states(tracker)
+tracker.received(data_packet(5, time=900))  # nothing was send for it
+assert tracker.summary()["unexpected"] == 1
+print("instant and timed: ", tracker.summary())
+
+# 2. a timed packet that did not fit in the input queue is rejected with OUT_ERROR_INPUT_FULL and its value,
+#    other errors reject the oldest pending packet of the original header
+
+tracker = AckTracker("input full")
+tracker.sent(data_packet(10, time=100) + data_packet(11, time=200) + data_packet(12, time=300))
+tracker.received(ErrorPacket(ErrorHeader.OUT_ERROR_INPUT_FULL, Data32bitHeader.IN_ASYNC_TO_CHIP0, value=11, print_errors=False).to_bytearray())
+tracker.received(data_packet(10, time=100))
+tracker.received(ErrorPacket(ErrorHeader.OUT_ERROR_ASYNC_HS_TIMEOUT, Data32bitHeader.IN_ASYNC_TO_CHIP0, print_errors=False).to_bytearray())
+assert states(tracker) == ["executed", "rejected", "rejected"], states(tracker)
+assert tracker.summary()["errors"] == {"OUT_ERROR_INPUT_FULL": 1, "OUT_ERROR_ASYNC_HS_TIMEOUT": 1}
+print("input full: ", tracker.summary())
+
+# 3. a stop flushes the timed packets due after it, the ones due before it without confirmation are lost (pending)
+
+tracker = AckTracker("flush")
+tracker.sent(data_packet(20, time=1000) + data_packet(21, time=2000) + data_packet(22, time=3000) +
+    data_packet(23, time=4000, header=Data32bitHeader.IN_ASYNC_TO_CHIP1) + Data32bitPacket(Data32bitHeader.IN_SET_TIME, value=0).to_bytearray())
+tracker.received(data_packet(20, time=1000))
+tracker.received(Data32bitPacket(Data32bitHeader.IN_SET_TIME, value=0, time=2500).to_bytearray())
+assert states(tracker) == ["executed", "pending", "flushed", "flushed", "executed"], states(tracker)
+assert tracker.unacknowledged() == [(1, Data32bitHeader.IN_ASYNC_TO_CHIP0, 2000, 21)], tracker.unacknowledged()
+# packets send after the stop belong to the next experiment
+tracker.sent(data_packet(24, time=100))
+tracker.received(data_packet(24, time=100))
+assert states(tracker)[-1] == "executed"
+print("flush: ", tracker.summary())
+
+print("all checks passed")
@@ -0,0 +1,128 @@
+"""
+    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+    Copyright (C) 2024 Ole Richter - University of Groningen
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys, time, struct, threading, logging
+
+sys.path.append('..')
+sys.path.append('.')
+
+from uC_api import *
+from uC_api.uC import FIRMWARE_VERSION
+
+logging.basicConfig(level=logging.INFO)
+
+# the replies to IN_READ_TIME requests are checked with a connection answering like the firmware, no uC needed
+
+
+class FirmwareTimeConnection:
+    """answers the alignment, free input spot and instant IN_READ_TIME requests like the firmware,
+    read_time in core_instruction_exec.cpp replies with the IN_READ_TIME header, the time since the start of the experiment
+    as time stamp and the raw micros() as value
+    """
+    def __init__(self):
+        self.timeout = None
+        self.requests = 0
+        self.__received = bytearray()
+        self.__to_host = bytearray()
+        self.__lock = threading.Lock()
+        self.__boot = time.monotonic() - 10.0
+        self.__offset_time = 0
+
+    def __micros(self):
+        return int((time.monotonic() - self.__boot) * 1e6) & 0xffffffff
+
+    @property
+    def in_waiting(self):
+        return len(self.__to_host)
+
+    def read(self, size=1):
+        with self.__lock:
+            data = bytes(self.__to_host[:size])
+            del self.__to_host[:size]
+        return data
+
+    def write(self, data):
+        self.__received += data
+        while True:
+            # alignment bytes
+            while self.__received[:1] == b"\xff":
+                del self.__received[:1]
+            if len(self.__received) < 9:
+                return len(data)
+            packet = bytes(self.__received[:9])
+            del self.__received[:9]
+            micros = self.__micros()
+            if packet[0] == ErrorHeader.OUT_ALIGN_SUCCESS_VERSION:
+                reply = struct.pack("<BBIBBB", ErrorHeader.OUT_ALIGN_SUCCESS_VERSION, FIRMWARE_VERSION.FIRMWARE_VERSION_MAJOR,
+                    FIRMWARE_VERSION.FIRMWARE_VERSION_PATCH, FIRMWARE_VERSION.FIRMWARE_VERSION_MINOR, 0, 0)
+            elif packet[0] == Data32bitHeader.IN_FREE_INSTRUCTION_SPOTS:
+                reply = struct.pack("<BII", Data32bitHeader.OUT_FREE_INSTRUCTION_SPOTS, micros - self.__offset_time, 64)
+            elif packet[0] == Data32bitHeader.IN_SET_TIME:
+                self.__offset_time = micros - struct.unpack("<I", packet[5:9])[0]
+                reply = struct.pack("<BI", Data32bitHeader.IN_SET_TIME, micros - self.__offset_time) + packet[5:9]
+            elif packet[0] == Data32bitHeader.IN_READ_TIME:
+                self.requests += 1
+                reply = struct.pack("<BII", Data32bitHeader.IN_READ_TIME, (micros - self.__offset_time) & 0xffffffff, micros)
+            else:
+                continue
+            with self.__lock:
+                self.__to_host += reply
+
+    def close(self):
+        pass
+
+
+# 1. a requested time arrives in the read buffer with the IN_READ_TIME header, the raw micros() as value
+
+connection = FirmwareTimeConnection()
+uc = uC_api("firmware time", 1, connection=connection)
+uc.send_packet(Data32bitPacket(Data32bitHeader.IN_READ_TIME))
+reply = uc.read_packet()
+assert reply.header() == Data32bitHeader.IN_READ_TIME, reply
+assert reply.value() >= reply.time(), reply
+print("requested time: ", reply)
+
+# 2. the replies to the latency probe are consumed by the API, they neither reach the read buffer nor the errors
+
+probe = uc.latency_probe(interval=0.002)
+time.sleep(0.5)
+probe.close()
+time.sleep(0.05)
+statistics = probe.statistics()
+samples = statistics["idle"]["count"] + statistics["loaded"]["count"]
+assert samples > 0 and samples >= connection.requests - 2, (samples, connection.requests)
+assert not uc.has_packet()
+print("latency probe: ", statistics)
+uc.close_connection()
+
+# 3. the clock model is fed with the time field of the replies (the experiment time), the uC clock runs with the host clock here
+
+connection = FirmwareTimeConnection()
+uc = uC_api("firmware time", 2, connection=connection)
+uc.start_experiment()
+clock = uc.clock_model(interval=0.002)
+time.sleep(0.5)
+uc.update_state()
+assert uc.errors == [], uc.errors
+fit = clock.fit()
+assert fit is not None and fit["samples"] > 10, fit
+assert abs(fit["slope"] - 1000.0) < 10.0 and fit["last"] < 1e6, fit
+print("clock model: ", fit)
+uc.close_connection()
+
+print("all checks passed")
@@ -0,0 +1,66 @@
+"""
+    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+    Copyright (C) 2024 Ole Richter - University of Groningen
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys, time, logging
+
+sys.path.append('..')
+sys.path.append('.')
+
+from uC_api import *
+
+logging.basicConfig(level=logging.INFO)
+
+# 1. raw throughput and latency of the transports, no uC needed
+
+for name, (sender, receiver) in [("pipe", transport.PipeTransport.pair()), ("tcp loopback", transport.TcpTransport.pair())]:
+    result = transport.benchmark_transport(sender, receiver)
+    print(name, ": ", round(result["packets_per_second"]), "packets/s, latency median", round(result["latency_median"]*1e6, 1), "us, max", round(result["latency_max"]*1e6, 1), "us")
+    sender.close()
+    receiver.close()
+
+# 2. round trip through the full API and the uC, the path can be a serial port or tcp://host:port
+
+path = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyACM0'
+uc = uC_api(path, 1)
+if uc.wait_connected(5):
+    # latency: one time request at a time
+    latencies = []
+    for i in range(1000):
+        start = time.perf_counter()
+        uc.send_packet(Data32bitPacket(Data32bitHeader.IN_READ_TIME))
+        uc.read_packet()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    # throughput: many requests at once
+    start = time.perf_counter()
+    for i in range(10000):
+        uc.send_packet(Data32bitPacket(Data32bitHeader.IN_READ_TIME))
+    for i in range(10000):
+        uc.read_packet()
+    duration = time.perf_counter() - start
+    print(path, ": ", round(10000/duration), "round trips/s, latency median", round(latencies[500]*1e6, 1), "us, max", round(latencies[-1]*1e6, 1), "us")
+    # 3. latency probe, idle and while the uC is busy with other requests
+    probe = uc.latency_probe(interval=0.001)
+    time.sleep(1)
+    for i in range(10000):
+        uc.send_packet(Data32bitPacket(Data32bitHeader.IN_FREE_INSTRUCTION_SPOTS))
+    time.sleep(1)
+    for load, result in probe.statistics().items():
+        print(load, ": ", result["count"], "samples, latency median", round((result["p50"] or 0)*1e6, 1), "us, p99.9", round((result["p99.9"] or 0)*1e6, 1), "us")
+    probe.close()
+uc.close_connection()
@@ -0,0 +1,38 @@
+import sys, time, logging
+
+sys.path.append('../')
+sys.path.append('./')
+
+from uC_api import *
+
+logging.basicConfig(level=logging.INFO)
+
+# record a short experiment to a capture file
+uc = uC_api('/dev/ttyACM0', 2, capture_path='capture_test.uccap')
+
+uc.async_to_chip[0].activate( req_pin=8, ack_pin=10, data_width=2, data_pins=[0,1], mode="4Phase_Chigh_Dhigh", req_delay = 0)
+uc.async_from_chip[0].activate( req_pin=9, ack_pin=11, data_width=2, data_pins=[4,5], mode="4Phase_Chigh_Dhigh", req_delay = 0)
+
+uc.start_experiment()
+for word in range(100):
+    uc.async_to_chip[0].send(word % 4, time=1000 + word * 1000)
+time.sleep(1)
+uc.update_state()
+print(uc.async_from_chip[0])
+
+uc.close_connection()
+capture_files = uc.stop_capture()
+
+# look at the capture without loading it into memory
+with capture.CaptureReader(capture_files[0]) as reader:
+    print(reader.select(uc.async_from_chip[0], t0=1000, t1=50000))
+
+# replay the capture through the API, as fast as possible
+start = time.time()
+capture_replay = replay.CaptureReplay(capture_files)
+uc_replay = uC_api('replay', 2, connection=capture_replay)
+capture_replay.replay_finished.wait()
+uc_replay.update_state()
+print("replayed "+str(capture_replay.replayed())+" packets in "+str(time.time()-start)+"s")
+print(uc_replay.async_from_chip[0])
+uc_replay.close_connection()
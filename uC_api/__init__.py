@@ -5,3 +5,23 @@ from . import interface_async
 from . import interface_pin
 from . import interface_spi
 from . import interface_i2c
+from . import capture
+from . import replay
+from . import capture_processing
+from . import export
+from . import device_manager
+from . import device_process
+from . import daemon
+from . import transport
+from . import event_server
+from . import reaction
+from . import latency
+from . import clock
+from . import run_index
+from . import sweep
+from . import stimulus
+from . import vectors
+from . import experiment_setup
+from . import schedule
+from . import jitter
+from . import acknowledge
@@ -0,0 +1,257 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import threading
+from array import array
+from collections import Counter
+from .header import Data32bitHeader, PinHeader, DataI2CHeader, ConfigMainHeader, ErrorHeader
+
+"""
+acknowledgement of the packets send to the uC
+
+the uC confirms every executed instruction by sending it back with the same header (data, pin, I2C, configuration and IN_SET_TIME packets),
+or reports an ErrorPacket with the header of the instruction that failed. the AckTracker of a uC_api (uc.track_acknowledgements())
+keeps every sent packet of these types in a table and matches the confirmations and errors that come back, every packet ends in one state:
+ - pending: no confirmation yet, at the end these are lost (or their confirmation was, eg. OUT_ERROR_OUTPUT_FULL)
+ - executed: confirmed
+ - rejected: an error was reported for it (OUT_ERROR_INPUT_FULL for a timed packet that did not fit, or an error during execution)
+ - flushed: a timed packet due after the stop of the experiment that was still waiting in the uC (IN_SET_TIME 0 clears the input queue)
+
+the confirmations of one header arrive in the order of execution: the packets send instantly in the order they were send,
+the timed ones in the order of their time. so every header has a queue for instant and one for timed packets and a confirmation belongs
+to the oldest pending packet of one of them (the timed one only when its time has come, the one with the same value if both fit).
+requests answered with another header (IN_READ_TIME, IN_FREE_INSTRUCTION_SPOTS, IN_READ...) are not tracked.
+
+the table is compact: the 9 bytes of the packet, one byte of state and an index in a queue (array) per packet, no objects per packet.
+a summary is logged when a stop of the experiment is confirmed and when the connection is closed:
+
+.. code-block:: python
+
+    tracker = uc.track_acknowledgements()
+    ... experiment ...
+    print(tracker.summary())
+    for index, header, time, value in tracker.unacknowledged(): ...
+"""
+
+PENDING = 1
+EXECUTED = 2
+REJECTED = 3
+FLUSHED = 4
+STATE_NAMES = {PENDING: "pending", EXECUTED: "executed", REJECTED: "rejected", FLUSHED: "flushed"}
+
+# the headers the uC sends back with the instruction when it is executed
+_CONFIRMED_HEADERS = frozenset([int(Data32bitHeader.IN_SET_TIME)] +
+    [int(header) for header in Data32bitHeader if header.name.startswith("IN_SPI") or header.name.startswith("IN_ASYNC_TO_CHIP")] +
+    [int(PinHeader.IN_PIN), int(PinHeader.IN_PIN_READ)] +
+    [int(header) for header in DataI2CHeader if header.name.startswith("IN_I2C")] +
+    [int(header) for header in ConfigMainHeader if header.name.startswith("IN_CONF_") and header != ConfigMainHeader.IN_CONF_READ_ON_REQUEST])
+_ERROR_HEADERS = frozenset(int(header) for header in ErrorHeader if header != ErrorHeader.OUT_ALIGN_SUCCESS_VERSION)
+
+# the queues are shortened when this many packets at their start are done
+_COMPACT = 65536
+
+
+class AckTracker:
+    """
+    AckTracker is the table of sent packets and their acknowledgement state, see the description at the top of acknowledge.py
+    """
+    def __init__(self, name="uC"):
+        """__init__ creates an empty table
+
+        :param name: name of the uC for the summary log, defaults to "uC"
+        :type name: string, optional
+        """
+        self.__name = name
+        self.__packets = bytearray()
+        self.__states = bytearray()
+        # (header, timed): [array of table indices in order, position of the first that may be pending]
+        self.__queues = {}
+        self.__unexpected = 0
+        self.__errors = Counter()
+        self.__lock = threading.Lock()
+
+    def sent(self, data):
+        """sent adds the packets written to the uC (called by the communication loop)
+
+        :param data: the written packets, 9 bytes each
+        :type data: bytes or bytearray
+        """
+        with self.__lock:
+            for offset in range(0, len(data) - 8, 9):
+                header = data[offset]
+                if header not in _CONFIRMED_HEADERS:
+                    continue
+                timed = data[offset + 1:offset + 5] != b"\x00\x00\x00\x00"
+                queue = self.__queues.get((header, timed))
+                if queue is None:
+                    queue = self.__queues[(header, timed)] = [array("I"), 0]
+                queue[0].append(len(self.__states))
+                self.__packets += data[offset:offset + 9]
+                self.__states.append(PENDING)
+
+    def __head(self, key):
+        """the table index of the oldest pending packet of a queue, None if there is none, lock has to be held
+        """
+        queue = self.__queues.get(key)
+        if queue is None:
+            return None
+        indices, position = queue
+        while position < len(indices) and self.__states[indices[position]] != PENDING:
+            position += 1
+        if position >= _COMPACT and position * 2 > len(indices):
+            del indices[:position]
+            position = 0
+        queue[1] = position
+        return indices[position] if position < len(indices) else None
+
+    def __time(self, index):
+        return int.from_bytes(self.__packets[9 * index + 1:9 * index + 5], "little")
+
+    def __value(self, index):
+        return int.from_bytes(self.__packets[9 * index + 5:9 * index + 9], "little")
+
+    def __next(self, header, time, value):
+        """the table index of the pending packet a confirmation (or error) with this header belongs to, lock has to be held
+        """
+        instant = self.__head((header, False))
+        timed = self.__head((header, True))
+        if timed is not None and time is not None and self.__time(timed) > time:
+            # a timed packet is not executed before its time
+            timed = None
+        if instant is None or timed is None:
+            return timed if instant is None else instant
+        if value is not None and (self.__value(instant) == value) != (self.__value(timed) == value):
+            return instant if self.__value(instant) == value else timed
+        return min(instant, timed)
+
+    def received(self, byte_packet):
+        """received matches a packet from the uC (called by the communication loop)
+
+        :param byte_packet: the 9 bytes of the packet
+        :type byte_packet: bytes
+        """
+        header = byte_packet[0]
+        if header in _ERROR_HEADERS:
+            self.__error(header, byte_packet[1], int.from_bytes(byte_packet[2:6], "little"))
+            return
+        if header not in _CONFIRMED_HEADERS:
+            return
+        time = int.from_bytes(byte_packet[1:5], "little")
+        value = int.from_bytes(byte_packet[5:9], "little")
+        with self.__lock:
+            index = self.__next(header, time, value)
+            if index is None:
+                self.__unexpected += 1
+                return
+            self.__states[index] = EXECUTED
+            stopped = header == Data32bitHeader.IN_SET_TIME and value == 0
+            if stopped:
+                self.__flush(index, time)
+        if stopped:
+            self.__log_summary("experiment stopped")
+
+    def __error(self, error_header, original_header, value):
+        """marks the packet an error was reported for as rejected
+        """
+        with self.__lock:
+            self.__errors[error_header] += 1
+            if original_header not in _CONFIRMED_HEADERS:
+                return
+            if error_header == ErrorHeader.OUT_ERROR_INPUT_FULL:
+                # a timed packet that did not fit in the input queue, the error carries its value
+                queue = self.__queues.get((original_header, True))
+                if queue is None:
+                    return
+                indices, position = queue
+                for index in indices[position:]:
+                    if self.__states[index] == PENDING and self.__value(index) == value:
+                        self.__states[index] = REJECTED
+                        return
+                return
+            index = self.__next(original_header, None, None)
+            if index is not None:
+                self.__states[index] = REJECTED
+
+    def __flush(self, stop_index, stop_time):
+        """marks the timed packets send before a confirmed stop, still pending and due after it as flushed,
+        the ones due before the stop stay pending (their confirmation is lost) but are not matched anymore, lock has to be held
+        """
+        for (header, timed), queue in self.__queues.items():
+            indices, position = queue
+            while position < len(indices) and indices[position] < stop_index:
+                index = indices[position]
+                if timed and self.__states[index] == PENDING and self.__time(index) > stop_time:
+                    self.__states[index] = FLUSHED
+                position += 1
+            queue[1] = position
+
+    def summary(self):
+        """summary returns the number of packets in every state
+
+        :return: dict with the keys sent, pending, executed, rejected, flushed, unexpected (confirmations without a sent packet),
+            errors (dict of error header name to count) and pending_by_header (dict of header to number of pending packets)
+        :rtype: dict
+        """
+        with self.__lock:
+            states = bytes(self.__states)
+            pending_headers = Counter(self.__packets[9 * index] for index, state in enumerate(states) if state == PENDING)
+            result = {"sent": len(states), "unexpected": self.__unexpected,
+                "errors": {ErrorHeader(header).name: count for header, count in self.__errors.items()}}
+        for state, name in STATE_NAMES.items():
+            result[name] = states.count(state)
+        result["pending_by_header"] = dict(pending_headers)
+        return result
+
+    def unacknowledged(self, limit=None):
+        """unacknowledged returns the pending packets
+
+        :param limit: maximal number of packets returned, defaults to None (all)
+        :type limit: int, optional
+        :return: (index in the table, header, time, value) of every pending packet in the order they were send
+        :rtype: [(int, int, int, int)]
+        """
+        result = []
+        with self.__lock:
+            index = self.__states.find(PENDING)
+            while index >= 0 and (limit is None or len(result) < limit):
+                result.append((index, self.__packets[9 * index], self.__time(index), self.__value(index)))
+                index = self.__states.find(PENDING, index + 1)
+        return result
+
+    def states(self):
+        """states returns the table, eg. to analyse it with numpy
+
+        :return: the sent packets (9 bytes each) and their state (one byte each, see STATE_NAMES)
+        :rtype: (bytes, bytes)
+        """
+        with self.__lock:
+            return (bytes(self.__packets), bytes(self.__states))
+
+    def __log_summary(self, reason):
+        summary = self.summary()
+        text = (self.__name+" "+reason+": "+str(summary["sent"])+" packets send, "+str(summary["executed"])+" executed, "+
+            str(summary["rejected"])+" rejected, "+str(summary["flushed"])+" flushed, "+str(summary["pending"])+" not acknowledged")
+        if summary["pending"] > 0 or summary["rejected"] > 0:
+            logging.warning(text+", pending by header: "+str(summary["pending_by_header"]))
+        else:
+            logging.info(text)
+
+    def close(self):
+        """close logs the summary when the connection is closed (called by uC_api.close_connection)
+        """
+        self.__log_summary("connection closed")
@@ -0,0 +1,474 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import mmap
+import os
+import struct
+import threading
+from time import monotonic_ns
+from .header import Data32bitHeader, ErrorHeader
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+the capture file stores every 9 byte packet exchanged with the uC as a fixed size record
+
+file layout (version 2):
+ - file header: magic (5 bytes), format version (uint8), record size (uint16)
+ - records: direction (uint8), host monotonic time in ns (uint64), raw packet (9 bytes)
+   the records are written in blocks, one block per batched write
+ - block index: one entry per block, see CAPTURE_INDEX_ENTRY
+ - experiment state transitions: one entry per IN_SET_TIME packet reported by the uC, see CAPTURE_TRANSITION
+ - trailer: offset of the block index, number of blocks, number of transitions, magic
+
+the index and trailer are written when the file is closed or rotated, 
+files without trailer (e.g. after a crash) and version 1 files are indexed on opening by CaptureReader
+"""
+CAPTURE_MAGIC = b"UCCAP"
+CAPTURE_VERSION = 2
+CAPTURE_FILE_HEADER = struct.Struct("<5sBH")
+CAPTURE_RECORD = struct.Struct("<BQ9s")
+
+"""
+block index entry: 
+file offset of the first record (uint64), number of records (uint32), number of experiment starts before the block (uint32), 
+smallest and largest uC time of packets from the uC (uint32 each), host time of the first and last record (uint64 each),
+bitmap of all headers in the block (256 bit)
+"""
+CAPTURE_INDEX_ENTRY = struct.Struct("<QIIIIQQ32s")
+
+"""
+experiment state transition: record number (uint64), uC time (uint32), experiment state (uint32), host time (uint64)
+"""
+CAPTURE_TRANSITION = struct.Struct("<QIIQ")
+CAPTURE_TRAILER = struct.Struct("<QQQ8s")
+CAPTURE_TRAILER_MAGIC = b"UCCAPIDX"
+
+"""
+direction of a captured packet
+"""
+CAPTURE_FROM_UC = 0
+CAPTURE_TO_UC = 1
+
+"""
+error packets carry no uC time in the time field, they are not used for the time index
+"""
+_ERROR_HEADERS = frozenset(int(header) for header in ErrorHeader)
+
+if np is not None:
+    """
+    numpy view of a capture record, the packet is split in the fields of a Data32bitPacket
+    for other packet types use the raw bytes or decode the record with Packet.from_bytearray
+    """
+    CAPTURE_DTYPE = np.dtype([("direction", "u1"), ("host_time", "<u8"), ("header", "u1"), ("time", "<u4"), ("value", "<u4")])
+
+
+class CaptureWriter:
+    """
+    CaptureWriter appends the raw packets exchanged with the uC to a compact binary capture file.
+
+    it is called by the communication thread of the uC_api for every packet that is read or written,
+    records are collected in memory and written in blocks of buffer_size bytes to keep the overhead in the thread low.
+    for every block the writer keeps an index entry (uC time range, experiment run and headers contained),
+    which is written together with the experiment state transitions at the end of the file, see CaptureReader.
+    once a file reaches max_file_size a new file is started (rotation), the files are numbered <name>_0000<ext>, <name>_0001<ext>, ...
+    """
+    def __init__(self, path, max_file_size=2**30, buffer_size=2**16):
+        """__init__ creates the capture writer and opens the first capture file
+
+        :param path: the path of the capture file, the file index is added in front of the extension
+        :type path: string
+        :param max_file_size: the size in bytes after which a new capture file is started, defaults to 1GiB
+        :type max_file_size: int, optional
+        :param buffer_size: the number of bytes collected in memory before they are written to disk as one block, defaults to 64KiB
+        :type buffer_size: int, optional
+        """
+        self.__path_root, self.__path_ext = os.path.splitext(path)
+        self.__max_file_size = max_file_size
+        self.__buffer_size = buffer_size
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__file_size = 0
+        self.__file_records = 0
+        self.__files = []
+        self.__records = 0
+        # experiment starts seen so far
+        self.__starts = 0
+        # index of the current file
+        self.__index = []
+        self.__transitions = []
+        self.__new_block()
+        self.__open_next_file()
+
+    def __new_block(self):
+        """__new_block resets the buffer and the index information of the block that is collected in memory
+        """
+        self.__buffer = bytearray()
+        self.__block_records = 0
+        self.__block_starts = self.__starts
+        self.__block_min_time = 2**32 - 1
+        self.__block_max_time = 0
+        self.__block_host_first = 0
+        self.__block_host_last = 0
+        self.__block_headers = 0
+        self.__block_transitions = []
+
+    def __open_next_file(self):
+        """__open_next_file closes the current capture file and starts the next one with a fresh file header
+        """
+        if self.__file is not None:
+            self.__close_file()
+        path = self.__path_root + "_" + str(len(self.__files)).zfill(4) + self.__path_ext
+        # the writer batches itself, so no extra buffering by python is needed
+        self.__file = open(path, "wb", buffering=0)
+        self.__file.write(CAPTURE_FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, CAPTURE_RECORD.size))
+        self.__file_size = CAPTURE_FILE_HEADER.size
+        self.__file_records = 0
+        self.__index = []
+        self.__transitions = []
+        self.__files.append(path)
+        logging.info("capture: writing to "+path)
+
+    def __close_file(self):
+        """__close_file writes the block index, the transitions and the trailer and closes the current file
+        """
+        footer = bytearray()
+        for entry in self.__index:
+            footer += entry
+        for transition in self.__transitions:
+            footer += transition
+        footer += CAPTURE_TRAILER.pack(self.__file_size, len(self.__index), len(self.__transitions), CAPTURE_TRAILER_MAGIC)
+        self.__file.write(footer)
+        self.__file.close()
+        self.__file = None
+
+    def record(self, direction, byte_packet, host_time=None):
+        """record adds one or more 9 byte packets to the capture
+
+        :param direction: CAPTURE_FROM_UC or CAPTURE_TO_UC
+        :type direction: int
+        :param byte_packet: the raw bytes exchanged, a multiple of 9 bytes
+        :type byte_packet: bytes or bytearray
+        :param host_time: host monotonic time in ns, defaults to None (now)
+        :type host_time: int, optional
+        """
+        if host_time is None:
+            host_time = monotonic_ns()
+        with self.__lock:
+            if self.__file is None:
+                return
+            if self.__block_records == 0:
+                self.__block_host_first = host_time
+            self.__block_host_last = host_time
+            for start in range(0, len(byte_packet), 9):
+                packet = bytes(byte_packet[start:start+9])
+                self.__buffer += CAPTURE_RECORD.pack(direction, host_time, packet)
+                header = packet[0]
+                self.__block_headers |= 1 << header
+                # only packets from the uC carry the uC time of the event
+                if direction == CAPTURE_FROM_UC and header not in _ERROR_HEADERS:
+                    uc_time = int.from_bytes(packet[1:5], "little")
+                    if uc_time < self.__block_min_time:
+                        self.__block_min_time = uc_time
+                    if uc_time > self.__block_max_time:
+                        self.__block_max_time = uc_time
+                    if header == Data32bitHeader.IN_SET_TIME:
+                        state = int.from_bytes(packet[5:9], "little")
+                        self.__block_transitions.append((self.__block_records, uc_time, state, host_time))
+                        if state > 0:
+                            self.__starts += 1
+                self.__block_records += 1
+                self.__records += 1
+            if len(self.__buffer) >= self.__buffer_size:
+                self.__flush()
+
+    def __flush(self):
+        """__flush writes the collected block to disk and adds it to the index, 
+        rotates the file if it would grow over the maximum size
+        needs to be called with the lock held
+        """
+        if self.__block_records == 0:
+            return
+        if self.__file_size + len(self.__buffer) > self.__max_file_size and self.__file_records > 0:
+            self.__open_next_file()
+        self.__index.append(CAPTURE_INDEX_ENTRY.pack(self.__file_size, self.__block_records, self.__block_starts,
+            self.__block_min_time, self.__block_max_time, self.__block_host_first, self.__block_host_last,
+            self.__block_headers.to_bytes(32, "little")))
+        for record, uc_time, state, host_time in self.__block_transitions:
+            self.__transitions.append(CAPTURE_TRANSITION.pack(self.__file_records + record, uc_time, state, host_time))
+        self.__file.write(self.__buffer)
+        self.__file_size += len(self.__buffer)
+        self.__file_records += self.__block_records
+        self.__new_block()
+
+    def flush(self):
+        """flush writes all records collected so far to disk
+        """
+        with self.__lock:
+            if self.__file is not None:
+                self.__flush()
+
+    def close(self):
+        """close writes the remaining records and the index and closes the capture file, further records are ignored
+        """
+        with self.__lock:
+            if self.__file is not None:
+                self.__flush()
+                self.__close_file()
+                logging.info("capture: closed after "+str(self.__records)+" packets in "+str(len(self.__files))+" file(s)")
+
+    def files(self):
+        """files returns the paths of all capture files written so far in order
+
+        :return: list of file paths
+        :rtype: [string]
+        """
+        return list(self.__files)
+
+    def records(self):
+        """records returns the number of packets captured so far
+
+        :return: number of captured packets
+        :rtype: int
+        """
+        return self.__records
+
+
+def _record_range(capture_file):
+    """_record_range finds the byte range of the records in an open capture file
+
+    :param capture_file: capture file opened in binary mode
+    :type capture_file: file
+    :return: (file version, offset of the first record, offset after the last record, trailer or None if not indexed)
+    :rtype: (int, int, int, tuple)
+    """
+    capture_file.seek(0, os.SEEK_END)
+    file_size = capture_file.tell()
+    capture_file.seek(0)
+    magic, version, record_size = CAPTURE_FILE_HEADER.unpack(capture_file.read(CAPTURE_FILE_HEADER.size))
+    if magic != CAPTURE_MAGIC or record_size != CAPTURE_RECORD.size:
+        raise ValueError(str(capture_file.name)+" is not a uC_api capture file")
+    if version >= 2 and file_size >= CAPTURE_FILE_HEADER.size + CAPTURE_TRAILER.size:
+        capture_file.seek(file_size - CAPTURE_TRAILER.size)
+        trailer = CAPTURE_TRAILER.unpack(capture_file.read(CAPTURE_TRAILER.size))
+        if trailer[3] == CAPTURE_TRAILER_MAGIC:
+            return (version, CAPTURE_FILE_HEADER.size, trailer[0], trailer)
+    # not indexed, use every complete record
+    records = (file_size - CAPTURE_FILE_HEADER.size) // CAPTURE_RECORD.size
+    return (version, CAPTURE_FILE_HEADER.size, CAPTURE_FILE_HEADER.size + records * CAPTURE_RECORD.size, None)
+
+
+def read_capture(path):
+    """read_capture iterates over all records of a capture file without loading it into memory
+
+    :param path: the path of one capture file
+    :type path: string
+    :return: generator of (direction, host time in ns, raw 9 byte packet)
+    :rtype: generator of (int, int, bytes)
+    """
+    with open(path, "rb") as capture_file:
+        version, first, last, trailer = _record_range(capture_file)
+        capture_file.seek(first)
+        for i in range((last - first) // CAPTURE_RECORD.size):
+            yield CAPTURE_RECORD.unpack(capture_file.read(CAPTURE_RECORD.size))
+
+
+class CaptureReader:
+    """
+    CaptureReader gives random access to a capture file via a memory map, only the parts that are accessed are read from disk.
+
+    all records are exposed as one numpy structured array (see CAPTURE_DTYPE) which is a view on the file,
+    select uses the block index to only touch the blocks that can contain the requested packets.
+    this makes it possible to analyse captures that are larger than the RAM.
+
+    needs numpy
+    """
+    def __init__(self, path):
+        """__init__ opens and memory maps the capture file and loads its index
+
+        :param path: the path of one capture file
+        :type path: string
+        """
+        if np is None:
+            raise ImportError("CaptureReader needs numpy")
+        self.__path = path
+        self.__file = open(path, "rb")
+        version, first, last, trailer = _record_range(self.__file)
+        self.__version = version
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__records = np.frombuffer(self.__mmap, dtype=CAPTURE_DTYPE, count=(last - first) // CAPTURE_RECORD.size, offset=first)
+        index_dtype = np.dtype([("offset", "<u8"), ("count", "<u4"), ("starts", "<u4"), ("min_time", "<u4"), ("max_time", "<u4"),
+            ("host_first", "<u8"), ("host_last", "<u8"), ("headers", "u1", (32,))])
+        transition_dtype = np.dtype([("record", "<u8"), ("time", "<u4"), ("state", "<u4"), ("host_time", "<u8")])
+        if trailer is not None:
+            index_offset, block_count, transition_count, magic = trailer
+            self.__blocks = np.frombuffer(self.__mmap, dtype=index_dtype, count=block_count, offset=index_offset)
+            self.__transitions = np.frombuffer(self.__mmap, dtype=transition_dtype, count=transition_count,
+                offset=index_offset + block_count * CAPTURE_INDEX_ENTRY.size)
+        else:
+            # unindexed file, one block spanning all records and transitions found by a full scan
+            logging.warning("capture: "+path+" has no index, falling back to a full scan")
+            self.__blocks = np.zeros(1, dtype=index_dtype)
+            self.__blocks["offset"] = first
+            self.__blocks["count"] = len(self.__records)
+            self.__blocks["max_time"] = 2**32 - 1
+            self.__blocks["headers"] = 0xff
+            positions = np.flatnonzero((self.__records["direction"] == CAPTURE_FROM_UC) & (self.__records["header"] == Data32bitHeader.IN_SET_TIME))
+            self.__transitions = np.zeros(len(positions), dtype=transition_dtype)
+            self.__transitions["record"] = positions
+            self.__transitions["time"] = self.__records["time"][positions]
+            self.__transitions["state"] = self.__records["value"][positions]
+            self.__transitions["host_time"] = self.__records["host_time"][positions]
+        # record number of the first record of every block
+        self.__block_first = (self.__blocks["offset"].astype(np.int64) - first) // CAPTURE_RECORD.size
+        self.__block_last = self.__block_first + self.__blocks["count"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """close releases the memory map, all views returned by this reader have to be released before
+        """
+        self.__records = None
+        self.__blocks = None
+        self.__transitions = None
+        self.__mmap.close()
+        self.__file.close()
+
+    def records(self):
+        """records returns all records of the file as a numpy view, no data is copied
+
+        :return: array with the fields direction, host_time, header, time and value
+        :rtype: numpy.ndarray
+        """
+        return self.__records
+
+    def blocks(self):
+        """blocks returns the block index of the file
+
+        :return: array with the fields offset, count, starts, min_time, max_time, host_first, host_last and headers (bitmap)
+        :rtype: numpy.ndarray
+        """
+        return self.__blocks
+
+    def transitions(self):
+        """transitions returns all experiment state changes (IN_SET_TIME reported by the uC) in the file
+
+        :return: array with the fields record (record number), time (uC time), state and host_time
+        :rtype: numpy.ndarray
+        """
+        return self.__transitions
+
+    def __run_segments(self):
+        """__run_segments splits the records at the experiment starts
+
+        :return: the bounds of the segments and the run of each segment
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        starts = self.__transitions["record"][self.__transitions["state"] > 0].astype(np.int64)
+        bounds = np.concatenate(([0], starts, [len(self.__records)]))
+        # experiment starts before this file, counted over all rotated files of the capture
+        previous_starts = int(self.__blocks["starts"][0]) if len(self.__blocks) > 0 else 0
+        # the records before the first experiment start belong to the first run
+        runs = np.maximum(previous_starts + np.arange(len(bounds) - 1) - 1, 0)
+        return (bounds, runs)
+
+    def runs(self):
+        """runs returns the experiment runs contained in this file, 
+        every experiment start (state 1 or larger) begins a new run, the records before the first start belong to run 0.
+        runs are counted over all files of a rotated capture
+
+        :return: the run numbers
+        :rtype: [int]
+        """
+        bounds, runs = self.__run_segments()
+        return sorted(set(int(run) for run in runs))
+
+    def run_range(self, run):
+        """run_range returns the records belonging to one experiment run see runs
+
+        :param run: the number of the run
+        :type run: int
+        :return: the first record number and the record number after the last record of the run
+        :rtype: (int, int)
+        """
+        bounds, runs = self.__run_segments()
+        segments = np.flatnonzero(runs == run)
+        if len(segments) == 0:
+            raise IndexError("run "+str(run)+" is not in this capture file")
+        return (int(bounds[segments[0]]), int(bounds[segments[-1] + 1]))
+
+    def select(self, headers=None, t0=None, t1=None, run=None, direction=CAPTURE_FROM_UC):
+        """select returns all records of the given headers in a uC time window, 
+        only the blocks which according to the index can contain matching records are read
+
+        the time window is applied to the time field, error packets carry no time there.
+        the uC time restarts with every experiment, so for files with several runs select the run too.
+
+        :param headers: header, list of headers or an interface object (all its headers are used), defaults to None (all headers)
+        :type headers: int, [int] or Interface_*, optional
+        :param t0: first uC time in us to include, defaults to None (no limit)
+        :type t0: int, optional
+        :param t1: last uC time in us to include, defaults to None (no limit)
+        :type t1: int, optional
+        :param run: only select records of this run see run_range, defaults to None (all runs)
+        :type run: int, optional
+        :param direction: CAPTURE_FROM_UC, CAPTURE_TO_UC or None for both, defaults to CAPTURE_FROM_UC
+        :type direction: int, optional
+        :return: the matching records (copy)
+        :rtype: numpy.ndarray
+        """
+        if headers is not None:
+            if hasattr(headers, "header"):
+                headers = headers.header()
+            elif isinstance(headers, int):
+                headers = [headers]
+            headers = np.array([int(header) for header in headers], dtype=np.uint8)
+        first, last = (0, len(self.__records)) if run is None else self.run_range(run)
+        # find the candidate blocks from the index
+        candidates = (self.__block_last > first) & (self.__block_first < last)
+        if headers is not None:
+            bitmap_bytes = self.__blocks["headers"][:, headers // 8]
+            candidates &= np.any(bitmap_bytes & (1 << (headers % 8)).astype(np.uint8), axis=1)
+        if direction == CAPTURE_FROM_UC:
+            if t0 is not None:
+                candidates &= self.__blocks["max_time"] >= t0
+            if t1 is not None:
+                candidates &= self.__blocks["min_time"] <= t1
+        selected = []
+        for block in np.flatnonzero(candidates):
+            records = self.__records[max(self.__block_first[block], first):min(self.__block_last[block], last)]
+            mask = np.ones(len(records), dtype=bool)
+            if direction is not None:
+                mask &= records["direction"] == direction
+            if headers is not None:
+                mask &= np.isin(records["header"], headers)
+            if t0 is not None:
+                mask &= records["time"] >= t0
+            if t1 is not None:
+                mask &= records["time"] <= t1
+            selected.append(records[mask])
+        if len(selected) == 0:
+            return np.zeros(0, dtype=CAPTURE_DTYPE)
+        return np.concatenate(selected)
@@ -0,0 +1,293 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import ctypes
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+from .capture import CaptureReader, CAPTURE_FROM_UC, CAPTURE_FILE_HEADER, CAPTURE_RECORD
+from .header import Data32bitHeader, DataI2CHeader, PinHeader, ConfigMainHeader, ErrorHeader, from_chip_headers
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+offline processing of (large) capture files on all cores
+
+the capture is split along its block index into chunks of roughly equal size,
+the chunks are decoded in a process pool in two passes:
+ 1. every worker counts the packets per header in its chunk
+ 2. the parent allocates shared memory for the output columns and every worker writes
+    its packets, split per header, directly to the position given by the counts
+the output is therefore merged in order without copying data between the processes,
+the result keeps the shared memory, it is freed when the last array using it is deleted.
+the columns hold the 8 bytes after the header as two 32bit words, data decodes them per header family.
+"""
+
+"""
+output columns, name and numpy type
+"""
+_COLUMNS = (("time", "<u4"), ("value", "<u4"), ("host_time", "<u8"))
+
+"""
+packet family of every header, in the order Packet.from_bytearray checks them
+"""
+_FAMILIES = {int(header): family for family, headers in reversed((("data32", Data32bitHeader), ("i2c", DataI2CHeader),
+    ("pin", PinHeader), ("config", ConfigMainHeader), ("error", ErrorHeader))) for header in headers}
+
+
+class _SharedColumn:
+    """
+    _SharedColumn is an output column in a shared memory block, numpy arrays made from it keep it alive
+    and the block is closed when the last of them is deleted
+    """
+    def __init__(self, block, length, column_type):
+        self.__block = block
+        self.__pointer = ctypes.c_char.from_buffer(block.buf)
+        self.__array_interface__ = {"shape": (length,), "typestr": np.dtype(column_type).str,
+            "data": (ctypes.addressof(self.__pointer), False), "version": 3}
+
+    def __del__(self):
+        self.__pointer = None
+        self.__block.close()
+
+
+def _count_chunk(path, first, last, direction):
+    """_count_chunk counts the packets per header in one chunk (runs in a worker process)
+
+    :return: count per header
+    :rtype: numpy.ndarray of 256 ints
+    """
+    with CaptureReader(path) as reader:
+        records = reader.records()[first:last]
+        if direction is not None:
+            records = records[records["direction"] == direction]
+        counts = np.bincount(records["header"], minlength=256)
+        records = None
+    return counts
+
+
+def _split_chunk(path, first, last, direction, shared_names, total, offsets):
+    """_split_chunk writes the packets of one chunk split per header into the shared output columns (runs in a worker process)
+
+    :param shared_names: names of the shared memory blocks of the output columns
+    :type shared_names: [string]
+    :param total: number of packets in the output columns
+    :type total: int
+    :param offsets: position in the output columns of the first packet of this chunk for every header
+    :type offsets: numpy.ndarray of 256 ints
+    """
+    shared = [shared_memory.SharedMemory(name=name) for name in shared_names]
+    try:
+        columns = [np.ndarray((total,), dtype=column_type, buffer=block.buf) for (column, column_type), block in zip(_COLUMNS, shared)]
+        with CaptureReader(path) as reader:
+            records = reader.records()[first:last]
+            if direction is not None:
+                records = records[records["direction"] == direction]
+            # group by header, the stable sort keeps the time order inside a header
+            order = np.argsort(records["header"], kind="stable")
+            headers = records["header"][order]
+            counts = np.bincount(headers, minlength=256)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            # destination of every sorted packet
+            destination = offsets[headers] + (np.arange(len(headers)) - starts[headers])
+            for (column, column_type), output in zip(_COLUMNS, columns):
+                output[destination] = records[column][order]
+            records = None
+        columns = None
+    finally:
+        for block in shared:
+            block.close()
+
+
+class CaptureSplit:
+    """
+    CaptureSplit holds the result of process_capture: the packets of a capture split per header,
+    with time, value and host_time as numpy arrays, and rate statistics per header.
+    """
+    def __init__(self, columns, bounds, statistics):
+        self.__columns = columns
+        self.__bounds = bounds
+        self.__statistics = statistics
+
+    def headers(self):
+        """headers returns all headers that occured in the processed capture
+
+        :return: list of headers
+        :rtype: [int]
+        """
+        return [header for header in range(256) if self.__bounds[header + 1] > self.__bounds[header]]
+
+    def data(self, header):
+        """data returns the packets with the given header in the order they were recorded, decoded by the family of the header:
+         - data 32bit: time (uC time), value
+         - pin and configuration: time, pin_id or config_header, value
+         - I2C: time, device_address, read, register_address, value
+         - error (no time): original_header, value, original_sub_header
+        and host_time (host monotonic ns) for all. time, value of data 32bit packets and host_time are views of the result,
+        the other keys are decoded into new arrays
+
+        an interface object selects its data from the chip (see header.from_chip_headers), for a pin the OUT_PIN_LOW and OUT_PIN_HIGH
+        packets of its pin id, merged in the order they were recorded with the additional key header
+
+        :param header: the header, or an interface object
+        :type header: int or Interface_*
+        :return: dict of key to array
+        :rtype: {string: numpy.ndarray}
+        :raises ValueError: if the interface receives no data from the chip
+        """
+        if not hasattr(header, "header"):
+            return self.__decode(int(header))
+        headers = from_chip_headers(header)
+        if len(headers) == 0:
+            raise ValueError("the interface receives no data from the chip, its headers are "+str(header.header()))
+        if not hasattr(header, "pin_id"):
+            return self.__decode(int(headers[0]))
+        parts = [self.__decode(int(pin_header)) for pin_header in headers]
+        result = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        result["header"] = np.concatenate([np.full(len(part["time"]), int(pin_header), dtype=np.uint8) for part, pin_header in zip(parts, headers)])
+        order = np.lexsort((result["time"], result["host_time"]))
+        order = order[result["pin_id"][order] == header.pin_id()]
+        return {key: column[order] for key, column in result.items()}
+
+    def __decode(self, header):
+        """__decode returns the packets of one header decoded by its family, see data
+        """
+        first, last = self.__bounds[header], self.__bounds[header + 1]
+        time = self.__columns["time"][first:last]
+        value = self.__columns["value"][first:last]
+        result = {"host_time": self.__columns["host_time"][first:last]}
+        family = _FAMILIES.get(header, "data32")
+        if family == "data32":
+            result["time"] = time
+            result["value"] = value
+        elif family == "pin" or family == "config":
+            result["time"] = time
+            result["pin_id" if family == "pin" else "config_header"] = (value & 0xff).astype(np.uint8)
+            result["value"] = ((value >> 8) & 0xff).astype(np.uint8)
+        elif family == "i2c":
+            result["time"] = time
+            result["device_address"] = ((value >> 1) & 0x7f).astype(np.uint8)
+            result["read"] = (value & 0x1).astype(np.uint8)
+            result["register_address"] = ((value >> 8) & 0xff).astype(np.uint8)
+            result["value"] = (((value >> 16) & 0xff) << 8 | (value >> 24)).astype(np.uint16)
+        else:
+            result["original_header"] = (time & 0xff).astype(np.uint8)
+            result["value"] = (time >> 8) | ((value & 0xff) << 24)
+            result["original_sub_header"] = ((value >> 8) & 0xff).astype(np.uint8)
+        return result
+
+    def statistics(self):
+        """statistics returns for every header: number of packets, first and last uC time and host time and the average rate in packets per second
+
+        :return: dict of header to dict with the keys count, first_time, last_time (None for errors), first_host_time, last_host_time and rate
+        :rtype: {int: {string: number}}
+        """
+        return self.__statistics
+
+
+def process_capture(paths, chunks=None, workers=None, direction=CAPTURE_FROM_UC):
+    """process_capture decodes (large) capture files in parallel and splits the packets per header,
+    see the description at the top of capture_processing.py
+
+    needs numpy and indexed capture files for a good split, unindexed files are processed as one chunk
+
+    :param paths: a capture file or the list of files of a rotated capture
+    :type paths: string or [string]
+    :param chunks: number of chunks the capture is split into, defaults to None (4 per worker)
+    :type chunks: int, optional
+    :param workers: number of worker processes, defaults to None (number of cores)
+    :type workers: int, optional
+    :param direction: CAPTURE_FROM_UC, CAPTURE_TO_UC or None for both, defaults to CAPTURE_FROM_UC
+    :type direction: int, optional
+    :return: the split packets and their statistics
+    :rtype: CaptureSplit
+    """
+    if np is None:
+        raise ImportError("process_capture needs numpy")
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunks is None:
+        chunks = 4 * workers
+    # split every file along its block index in chunks of roughly equal size
+    total_records = 0
+    file_blocks = []
+    for path in paths:
+        with CaptureReader(path) as reader:
+            blocks = reader.blocks()
+            first_record = (blocks["offset"].astype(np.int64) - CAPTURE_FILE_HEADER.size) // CAPTURE_RECORD.size
+            file_blocks.append((path, first_record, first_record + blocks["count"]))
+            total_records += len(reader.records())
+            blocks = None
+    records_per_chunk = max(total_records // chunks, 1)
+    work = []
+    for path, block_first, block_last in file_blocks:
+        chunk_start = 0
+        for block in range(len(block_first)):
+            if block_last[block] - chunk_start >= records_per_chunk or block == len(block_first) - 1:
+                work.append((path, int(chunk_start), int(block_last[block])))
+                chunk_start = int(block_last[block])
+    if len(work) == 0:
+        return CaptureSplit({column: np.zeros(0, dtype=column_type) for column, column_type in _COLUMNS}, np.zeros(257, dtype=np.int64), {})
+    logging.info("process_capture: "+str(total_records)+" records in "+str(len(work))+" chunks on "+str(workers)+" workers")
+
+    if os.name == "posix":
+        # the workers have to share the resource tracker of this process, else they report the shared outputs as leaked
+        resource_tracker.ensure_running()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # first pass: count the packets per header in every chunk
+        counts = np.array(list(pool.map(_count_chunk, *zip(*[(path, first, last, direction) for path, first, last in work]))), dtype=np.int64).reshape(len(work), 256)
+        # output position of every header and chunk: headers one after the other, inside a header chunk by chunk
+        per_header = counts.sum(axis=0)
+        bounds = np.concatenate(([0], np.cumsum(per_header)))
+        offsets = bounds[:-1] + np.concatenate((np.zeros((1, 256), dtype=np.int64), np.cumsum(counts, axis=0)[:-1]), axis=0)
+        total = int(bounds[-1])
+        shared = [shared_memory.SharedMemory(create=True, size=max(total * np.dtype(column_type).itemsize, 1)) for column, column_type in _COLUMNS]
+        try:
+            # second pass: every worker writes its packets directly to the shared output
+            list(pool.map(_split_chunk, *zip(*[(path, first, last, direction, [block.name for block in shared], total, offsets[chunk])
+                for chunk, (path, first, last) in enumerate(work)])))
+        except BaseException:
+            for block in shared:
+                block.close()
+            raise
+        finally:
+            # the result keeps the shared memory, only its name is removed
+            for block in shared:
+                block.unlink()
+    columns = {column: np.asarray(_SharedColumn(block, total, column_type)) for (column, column_type), block in zip(_COLUMNS, shared)}
+
+    statistics = {}
+    for header in range(256):
+        first, last = int(bounds[header]), int(bounds[header + 1])
+        if last == first:
+            continue
+        host_span = int(columns["host_time"][last - 1]) - int(columns["host_time"][first])
+        # error packets have no time
+        timed = _FAMILIES.get(header) != "error"
+        statistics[header] = {
+            "count": last - first,
+            "first_time": int(columns["time"][first]) if timed else None,
+            "last_time": int(columns["time"][last - 1]) if timed else None,
+            "first_host_time": int(columns["host_time"][first]),
+            "last_host_time": int(columns["host_time"][last - 1]),
+            "rate": (last - first) / (host_span * 1e-9) if host_span > 0 else 0.0}
+    return CaptureSplit(columns, bounds, statistics)
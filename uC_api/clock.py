@@ -0,0 +1,295 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import threading
+from collections import deque
+from time import monotonic_ns, perf_counter_ns, time_ns
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+model of the uC clock in host time
+
+the uC stamps every packet with its own time in us, counted from the last IN_SET_TIME (start_experiment).
+the ClockModel of a uC_api relates this time to the host clock, it is fed by the communication loop with:
+ - round trips: every reply to an instant IN_READ_TIME request, the uC time was taken between writing the request and
+   reading the reply, so the middle of both is the estimate and half the round trip its uncertainty.
+   the reply carries the IN_READ_TIME header, its time field (the time since the start of the experiment, as every packet)
+   is used, not its value (the raw micros() of the uC, which does not restart with the experiment)
+ - arrivals: the time the packets of every round were read, a packet can not arrive before the uC stamped it,
+   so the model is never later than the arrivals
+
+the model is a line host_time = offset + slope * uc_time, fitted robustly (Theil-Sen: the median of the slopes between all pairs
+of the latest round trips, then the median offset) so single delayed replies (USB, scheduling) do not move it.
+the slope is the drift of the uC crystal against the host clock.
+
+every run (the time between two start_experiment, see uC_api.experiment_state) has its own line, as the uC clock is set to 1
+at the start. the fit of a run is kept when the next run starts, a new run starts with the drift of the last one.
+
+.. code-block:: python
+
+    clock = uc.clock_model(interval=0.1)
+    ... run the experiment ...
+    host_times, error = clock.to_host(uc_times)
+    wall_times, error = clock.to_host(uc_times, clock="wall")
+
+the conversion needs numpy, the round trips are generated by a LatencyProbe (see latency.py) or any IN_READ_TIME request.
+
+with uC_api(unwrap_time=True) the received packets carry 64bit times on one continuous timeline (see TimeUnwrapper),
+the model is then fitted on this timeline and does not start a new run with every start_experiment.
+"""
+
+
+class ClockModel:
+    """
+    ClockModel estimates offset and drift of the uC clock against the host clock, see the description at the top of clock.py
+    """
+    def __init__(self, window=256):
+        """__init__ creates an empty model
+
+        :param window: number of latest round trips (and arrivals) used for the fit, defaults to 256
+        :type window: int, optional
+        """
+        self.__window = window
+        # (uC time in us, write ns, read ns) and (uC time in us, read ns), host times are perf_counter_ns
+        self.__round_trips = deque(maxlen=window)
+        self.__arrivals = deque(maxlen=window)
+        self.__run = -1
+        self.__fits = {}
+        self.__fit = None
+        self.__last_slope = None
+        self.__lock = threading.Lock()
+        # perf_counter_ns (used by the communication loop) to monotonic_ns
+        self.__monotonic_offset = _clock_offset(monotonic_ns)
+
+    def add_round_trip(self, uc_time, write_time, read_time):
+        """add_round_trip adds the reply to a time request (called by the communication loop)
+
+        :param uc_time: the time field of the reply in us (experiment time, not the raw micros() in its value)
+        :type uc_time: int
+        :param write_time: perf_counter_ns when the request was written
+        :type write_time: int
+        :param read_time: perf_counter_ns when the reply was read
+        :type read_time: int
+        """
+        with self.__lock:
+            if len(self.__round_trips) > 0 and uc_time < self.__round_trips[-1][0]:
+                # the uC time went back without a start_experiment (wrap around or reset), the old samples do not fit
+                self.__round_trips.clear()
+                self.__arrivals.clear()
+            self.__round_trips.append((uc_time, write_time, read_time))
+            self.__fit = None
+
+    def add_arrival(self, uc_time, read_time):
+        """add_arrival adds the uC time of the last packet of a round and when it was read (called by the communication loop)
+
+        :param uc_time: the uC time of the packet in us
+        :type uc_time: int
+        :param read_time: perf_counter_ns when it was read
+        :type read_time: int
+        """
+        with self.__lock:
+            self.__arrivals.append((uc_time, read_time))
+            self.__fit = None
+
+    def restart(self):
+        """restart starts a new run, the uC clock was set by IN_SET_TIME (called by the communication loop)
+        """
+        with self.__lock:
+            fit = self.__calculate()
+            if fit is not None:
+                self.__fits[self.__run] = fit
+                self.__last_slope = fit["slope"]
+            self.__run += 1
+            self.__round_trips.clear()
+            self.__arrivals.clear()
+            self.__fit = None
+
+    def run(self):
+        """run returns the number of the current run, -1 before the first start_experiment
+
+        :return: the run
+        :rtype: int
+        """
+        return self.__run
+
+    def __calculate(self):
+        """the fit of the current samples, lock has to be held
+        """
+        if self.__fit is not None:
+            return self.__fit
+        if np is None:
+            raise ImportError("ClockModel needs numpy")
+        if len(self.__round_trips) == 0:
+            return None
+        samples = np.array(self.__round_trips, dtype=np.int64)
+        uc_times = samples[:, 0].astype(np.float64)
+        # host times relative to the first sample for the precision of the fit
+        reference = int(samples[0, 1])
+        middles = ((samples[:, 1] - reference) + (samples[:, 2] - samples[:, 1]) / 2.0)
+        half_round_trips = (samples[:, 2] - samples[:, 1]) / 2.0
+        first, second = np.triu_indices(len(samples), 1)
+        distinct = uc_times[second] != uc_times[first]
+        if np.any(distinct):
+            slopes = (middles[second] - middles[first])[distinct] / (uc_times[second] - uc_times[first])[distinct]
+            slope = float(np.median(slopes))
+        elif self.__last_slope is not None:
+            slope = self.__last_slope
+        else:
+            # one sample and no earlier run: nominal clock, 1 us is 1000 ns
+            slope = 1000.0
+        offsets = middles - slope * uc_times
+        offset = float(np.median(offsets))
+        residuals = offsets - offset
+        error = float(np.median(half_round_trips) + 3 * 1.4826 * np.median(np.abs(residuals)))
+        if len(self.__arrivals) > 0:
+            arrivals = np.array(self.__arrivals, dtype=np.int64)
+            # the packets can not have been read before the uC stamped them
+            latest = float(np.min((arrivals[:, 1] - reference) - slope * arrivals[:, 0].astype(np.float64)))
+            offset = min(offset, latest)
+        self.__fit = {"slope": slope, "offset": offset + reference, "error": error,
+            "first": float(uc_times[0]), "last": float(uc_times[-1]), "samples": len(samples)}
+        return self.__fit
+
+    def fit(self, run=None):
+        """fit returns the current line of a run
+
+        :param run: the run, defaults to None (the current run)
+        :type run: int, optional
+        :return: dict with the keys drift (ppm of the uC clock against the host), slope (host ns per uC us),
+            offset (perf_counter_ns at uC time 0), error (ns at the samples), first and last (uC time of the samples in us) and samples,
+            None if there are no samples
+        :rtype: dict
+        """
+        with self.__lock:
+            if run is None or run == self.__run:
+                fit = self.__calculate()
+            else:
+                fit = self.__fits.get(run)
+        if fit is None:
+            return None
+        result = dict(fit)
+        result["drift"] = (fit["slope"] / 1000.0 - 1.0) * 1e6
+        return result
+
+    def to_host(self, uc_times, run=None, clock="monotonic"):
+        """to_host converts uC times to host times
+
+        the error is the uncertainty of the fit at the samples (half the typical round trip plus the spread of the replies),
+        it grows linearly with the distance from the middle of the samples (extrapolation)
+
+        :param uc_times: the uC times in us
+        :type uc_times: array like
+        :param run: the run the times belong to, defaults to None (the current run)
+        :type run: int, optional
+        :param clock: "monotonic" for time.monotonic, "perf_counter" for time.perf_counter or "wall" for time.time, defaults to "monotonic"
+        :type clock: string, optional
+        :return: the host times and their error in s
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        if np is None:
+            raise ImportError("ClockModel needs numpy")
+        fit = self.fit(run)
+        if fit is None:
+            raise ValueError("the clock model has no samples for run "+str(self.__run if run is None else run))
+        uc_times = np.asarray(uc_times, dtype=np.float64)
+        host_times = fit["offset"] + fit["slope"] * uc_times
+        if clock == "monotonic":
+            host_times += self.__monotonic_offset
+        elif clock == "wall":
+            host_times += self.__monotonic_offset + _clock_offset(time_ns, monotonic_ns)
+        elif clock != "perf_counter":
+            raise ValueError("clock has to be monotonic, perf_counter or wall, not "+str(clock))
+        center = (fit["first"] + fit["last"]) / 2.0
+        span = max(fit["last"] - fit["first"], 1.0)
+        error = fit["error"] * (1.0 + 2.0 * np.abs(uc_times - center) / span)
+        return (host_times * 1e-9, error * 1e-9)
+
+
+class TimeUnwrapper:
+    """
+    TimeUnwrapper maps the 32bit uC times of the received packets on one continuous 64bit timeline in us,
+    across wrap arounds (every 71.6 min) and IN_SET_TIME (start_experiment) restarts, used by uC_api(unwrap_time=True)
+
+    a restart continues the timeline at the last time plus the host time elapsed since the last packet,
+    a wrap around is detected by the uC time jumping back by more than half the 32bit range
+    """
+    def __init__(self):
+        self.__base = 0
+        self.__last_raw = None
+        self.__last_time = 0
+        self.__last_host = None
+
+    def unwrap(self, uc_time, host_time):
+        """unwrap returns the time of a received packet on the continuous timeline
+
+        :param uc_time: the 32bit uC time in us
+        :type uc_time: int
+        :param host_time: perf_counter_ns when the packet was read
+        :type host_time: int
+        :return: the unwrapped time in us
+        :rtype: int
+        """
+        if self.__last_raw is not None and uc_time + 2**31 < self.__last_raw:
+            self.__base += 2**32
+        self.__last_raw = uc_time
+        time = self.__base + uc_time
+        self.__last_time = max(self.__last_time, time)
+        self.__last_host = host_time
+        return time
+
+    def restart(self, uc_time, host_time):
+        """restart continues the timeline after the uC clock was set to uc_time (the IN_SET_TIME reply)
+
+        :param uc_time: the 32bit uC time of the IN_SET_TIME reply in us
+        :type uc_time: int
+        :param host_time: perf_counter_ns when it was read
+        :type host_time: int
+        :return: the unwrapped time of the reply in us
+        :rtype: int
+        """
+        if self.__last_host is not None:
+            # the uC clock kept running while it was set, continue with the time that passed on the host
+            elapsed = max((host_time - self.__last_host) // 1000, 1)
+            self.__base = self.__last_time + elapsed - uc_time
+        self.__last_raw = None
+        return self.unwrap(uc_time, host_time)
+
+
+def _clock_offset(clock, reference=perf_counter_ns, samples=5):
+    """_clock_offset returns clock() - reference() in ns, taken from the closest of some back to back readings
+
+    :param clock: the clock function (ns)
+    :type clock: callable
+    :param reference: the reference clock function (ns), defaults to perf_counter_ns
+    :type reference: callable, optional
+    :param samples: number of readings, defaults to 5
+    :type samples: int, optional
+    :return: the offset in ns
+    :rtype: int
+    """
+    best = None
+    for i in range(samples):
+        before = reference()
+        value = clock()
+        after = reference()
+        if best is None or after - before < best[0]:
+            best = (after - before, value - (before + after) // 2)
+    return best[1]
@@ -0,0 +1,404 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import os
+import select
+import selectors
+import socket
+import struct
+import threading
+from time import monotonic
+from .header import Data32bitHeader, ErrorHeader, ConfigMainHeader, ALIGN_BYTEARRAY
+from .packet import Packet, Data32bitPacket
+from .uC import uC_api
+
+"""
+a local daemon that keeps the connection to a uC open between scripts
+
+the DeviceDaemon owns the serial connection (a level 1 uC_api) and serves it on a unix domain socket.
+scripts attach with attach(socket_path), which creates a normal uC_api on top of a DaemonConnection,
+so the full API (level 1 and 2) works unchanged, but connecting takes milliseconds and the uC is not reset:
+
+.. code-block:: python
+
+    # once, eg. in a terminal: python -m uC_api.daemon /dev/ttyACM0 /tmp/uc0.sock
+    uc = uC_api.daemon.attach("/tmp/uc0.sock")
+    ...
+    uc.close_connection()  # the daemon keeps the configuration for the next script
+
+protocol: both directions send frames of a 32bit little endian packet count followed by the 9 byte packets.
+the first frame of the daemon holds the alignment answer (firmware version) and the last configuration acknowledgements
+of every interface and the last experiment state, so the interface objects of a new client know the state of the uC.
+the alignment request of a client is answered by its DaemonConnection, the uC is not realigned.
+all clients receive all packets from the uC, the packets of all clients are send to the uC.
+the daemon does the flow control of the timed packets: it answers the free input queue spots request of a client itself
+with _CLIENT_FREE_SPOTS, so the client sends its timed packets right away and the daemon queues them for the uC.
+the uC is shared, so a reset of a client (IN_RESET, eg. by close_connection) is dropped unless the daemon is started with allow_reset.
+"""
+
+_FRAME = struct.Struct("<I")
+_PACKET_SIZE = 9
+_CONFIG_HEADERS = frozenset(int(header) for header in ConfigMainHeader if header != ConfigMainHeader.IN_CONF_READ_ON_REQUEST)
+_ERROR_HEADERS = frozenset(int(header) for header in ErrorHeader)
+
+"""
+maximal number of bytes waiting to be send to one client, a client that does not read is disconnected
+"""
+_MAX_CLIENT_BUFFER = 2**26
+
+"""
+free input queue spots reported to a client, the daemon queues the timed packets of the clients without limit
+"""
+_CLIENT_FREE_SPOTS = 2**31
+
+
+def _split_frames(received):
+    """_split_frames takes all complete frames out of the received bytes
+
+    :param received: the received bytes, complete frames are removed
+    :type received: bytearray
+    :return: the packets of the complete frames
+    :rtype: bytes
+    """
+    packets = []
+    while len(received) >= _FRAME.size:
+        count = _FRAME.unpack_from(received)[0]
+        end = _FRAME.size + count * _PACKET_SIZE
+        if len(received) < end:
+            break
+        packets.append(bytes(received[_FRAME.size:end]))
+        del received[:end]
+    return b"".join(packets)
+
+
+def _frame(packets):
+    """_frame packs packets into one frame
+
+    :param packets: the 9 byte packets
+    :type packets: bytes
+    :return: the frame
+    :rtype: bytes
+    """
+    return _FRAME.pack(len(packets) // _PACKET_SIZE) + packets
+
+
+class DeviceDaemon:
+    """
+    DeviceDaemon owns the connection to one uC and serves it to client processes on a unix domain socket,
+    see the description at the top of daemon.py
+    """
+    def __init__(self, serial_port_path, socket_path, capture_path=None, connection=None, connect_timeout=10.0, allow_reset=False):
+        """__init__ connects to the uC and opens the socket, call serve_forever or start to serve the clients
+
+        :param serial_port_path: the serial port of the uC
+        :type serial_port_path: string
+        :param socket_path: path of the unix domain socket, an existing file is replaced
+        :type socket_path: string
+        :param capture_path: if given all packets are captured, see uC_api.start_capture, defaults to None
+        :type capture_path: string, optional
+        :param connection: an already opened connection, see uC_api, defaults to None
+        :type connection: object, optional
+        :param connect_timeout: time in s to wait for the uC, defaults to 10.0
+        :type connect_timeout: float, optional
+        :param allow_reset: if True a client can reset the uC (eg. with close_connection()), defaults to False
+        :type allow_reset: bool, optional
+        """
+        self.__uc = uC_api(serial_port_path, api_level=1, capture_path=capture_path, connection=connection)
+        if not self.__uc.wait_connected(connect_timeout):
+            self.__uc.close_connection(reset=False)
+            raise ConnectionError("daemon could not connect to "+str(serial_port_path))
+        major, minor, patch = self.__uc.firmware_version()
+        self.__version_packet = struct.pack("<BBIBBB", ErrorHeader.OUT_ALIGN_SUCCESS_VERSION, major, patch, minor, 0, 0)
+        # last configuration acknowledgement per interface setting and last experiment state, replayed to new clients
+        self.__state = {}
+        self.__allow_reset = allow_reset
+        # uC time of the last packet relayed to the clients, used as time of the free input queue spots answers
+        self.__last_time = 0
+        self.__socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.__listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__listener.bind(socket_path)
+        self.__listener.listen()
+        self.__listener.setblocking(False)
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__listener, selectors.EVENT_READ)
+        # per client: received bytes and bytes waiting to be send
+        self.__clients = {}
+        self.__running = True
+        self.__thread = None
+        logging.info("daemon: serving "+str(serial_port_path)+" on "+str(socket_path))
+
+    def __remember(self, byte_packet):
+        """__remember keeps the configuration acknowledgements and the experiment state for new clients
+        """
+        header = byte_packet[0]
+        if header not in _ERROR_HEADERS:
+            self.__last_time = int.from_bytes(byte_packet[1:5], "little")
+        if header in _CONFIG_HEADERS:
+            # pins are configured by their id in the value, all other interfaces by the sub header
+            key = (header, byte_packet[6]) if header == ConfigMainHeader.IN_CONF_PIN else (header, byte_packet[5])
+        elif header == Data32bitHeader.IN_SET_TIME:
+            key = (header,)
+        else:
+            return
+        # move the key to the end, so the state is replayed in the order it was set
+        self.__state.pop(key, None)
+        self.__state[key] = byte_packet
+
+    def __accept(self):
+        client, address = self.__listener.accept()
+        client.setblocking(False)
+        self.__clients[client] = [bytearray(), bytearray(_frame(self.__version_packet + b"".join(self.__state.values())))]
+        self.__selector.register(client, selectors.EVENT_READ)
+        logging.info("daemon: client attached, "+str(len(self.__clients))+" clients")
+
+    def __drop(self, client, reason):
+        self.__selector.unregister(client)
+        del self.__clients[client]
+        client.close()
+        logging.info("daemon: client detached ("+reason+"), "+str(len(self.__clients))+" clients")
+
+    def __receive(self, client):
+        try:
+            data = client.recv(2**16)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as error:
+            self.__drop(client, repr(error))
+            return
+        if len(data) == 0:
+            self.__drop(client, "closed")
+            return
+        received = self.__clients[client][0]
+        received += data
+        packets = _split_frames(received)
+        for offset in range(0, len(packets), _PACKET_SIZE):
+            packet = Packet.from_bytearray(packets[offset:offset + _PACKET_SIZE])
+            if packet is None:
+                logging.error("daemon: malformed packet from client dropped")
+                continue
+            if packet.header() == Data32bitHeader.IN_FREE_INSTRUCTION_SPOTS:
+                # the daemon does the flow control, the answer of the uC is for the daemon's own API
+                answer = Data32bitPacket(Data32bitHeader.OUT_FREE_INSTRUCTION_SPOTS, value=_CLIENT_FREE_SPOTS, time=self.__last_time)
+                self.__clients[client][1] += _frame(answer.to_bytearray())
+                continue
+            if packet.header() == Data32bitHeader.IN_RESET:
+                if not self.__allow_reset:
+                    logging.info("daemon: reset from client ignored, start the daemon with allow_reset to allow it")
+                    continue
+                # the uC forgets its configuration
+                self.__state.clear()
+            self.__uc.send_packet(packet)
+
+    def __send(self):
+        for client, (received, to_send) in list(self.__clients.items()):
+            if len(to_send) == 0:
+                continue
+            if len(to_send) > _MAX_CLIENT_BUFFER:
+                self.__drop(client, "not reading")
+                continue
+            try:
+                sent = client.send(to_send)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError as error:
+                self.__drop(client, repr(error))
+                continue
+            del to_send[:sent]
+
+    def serve_forever(self, idle_wait=0.0005):
+        """serve_forever relays the packets between the uC and the clients until close is called
+
+        :param idle_wait: maximal time in s to wait for client data before checking the uC again, defaults to 0.0005
+        :type idle_wait: float, optional
+        """
+        while self.__running:
+            for key, mask in self.__selector.select(idle_wait):
+                if key.fileobj is self.__listener:
+                    self.__accept()
+                elif key.fileobj in self.__clients:
+                    self.__receive(key.fileobj)
+            packets = []
+            while self.__uc.has_packet():
+                byte_packet = self.__uc.read_packet().to_bytearray()
+                self.__remember(byte_packet)
+                packets.append(byte_packet)
+            if len(packets) > 0:
+                frame = _frame(b"".join(packets))
+                for received, to_send in self.__clients.values():
+                    to_send += frame
+            self.__send()
+
+    def start(self):
+        """start serves the clients in a background thread
+        """
+        self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def clients(self):
+        """clients returns the number of attached clients
+
+        :return: number of clients
+        :rtype: int
+        """
+        return len(self.__clients)
+
+    def close(self, reset=False):
+        """close disconnects all clients, closes the socket and the connection to the uC
+
+        :param reset: if True the uC is reset, defaults to False
+        :type reset: bool, optional
+        """
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+        for client in list(self.__clients):
+            self.__drop(client, "daemon closed")
+        self.__selector.close()
+        self.__listener.close()
+        if os.path.exists(self.__socket_path):
+            os.unlink(self.__socket_path)
+        self.__uc.close_connection(reset=reset)
+
+
+class DaemonConnection:
+    """
+    DaemonConnection connects to a DeviceDaemon and implements the part of the pyserial interface used by uC_api,
+    so a uC_api can be created on top of it, see attach
+    """
+    def __init__(self, socket_path):
+        """__init__ connects to the daemon
+
+        :param socket_path: path of the unix domain socket of the daemon
+        :type socket_path: string
+        """
+        self.port = socket_path
+        self.timeout = None
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.connect(socket_path)
+        self.__received = bytearray()
+        # packets ready to be read by the API
+        self.__buffer = bytearray()
+        # first frame of the daemon: alignment answer and state, delivered when the API aligns
+        self.__hello = None
+        self.__aligned = False
+
+    def fileno(self):
+        return self.__socket.fileno()
+
+    def __receive(self, timeout):
+        """__receive reads what the daemon has send, waiting up to timeout for the first bytes
+        """
+        readable, writable, failed = select.select([self.__socket], [], [], timeout)
+        if len(readable) == 0:
+            return
+        data = self.__socket.recv(2**16)
+        if len(data) == 0:
+            raise ConnectionError("daemon closed the connection")
+        self.__received += data
+        packets = _split_frames(self.__received)
+        if len(packets) == 0:
+            return
+        if self.__hello is None:
+            self.__hello = packets
+            if self.__aligned:
+                self.__buffer += packets
+        else:
+            self.__buffer += packets
+
+    @property
+    def in_waiting(self):
+        """number of bytes ready to be read, like pyserial
+        """
+        self.__receive(0)
+        return len(self.__buffer)
+
+    def read(self, size=1):
+        """read returns up to size bytes, like pyserial it waits up to timeout (None: forever) for them
+
+        :param size: number of bytes to read, defaults to 1
+        :type size: int, optional
+        :return: the bytes
+        :rtype: bytes
+        """
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        self.__receive(0)
+        while len(self.__buffer) < size:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            self.__receive(remaining)
+        data = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return data
+
+    def write(self, data):
+        """write sends the packets to the daemon, alignment requests are answered directly
+
+        :param data: the bytes to send, 9 byte packets or the alignment request
+        :type data: bytes
+        :return: number of bytes written
+        :rtype: int
+        """
+        data = bytes(data)
+        if data == ALIGN_BYTEARRAY:
+            if not self.__aligned:
+                self.__aligned = True
+                if self.__hello is not None:
+                    self.__buffer += self.__hello
+            elif self.__hello is not None:
+                self.__buffer += self.__hello[:_PACKET_SIZE]
+            return len(data)
+        self.__socket.sendall(_frame(data))
+        return len(data)
+
+    def close(self):
+        self.__socket.close()
+
+
+def attach(socket_path, api_level=2, **kwargs):
+    """attach creates a uC_api connected to a DeviceDaemon
+
+    :param socket_path: path of the unix domain socket of the daemon
+    :type socket_path: string
+    :param api_level: see uC_api, defaults to 2
+    :type api_level: int, optional
+    :param kwargs: further parameters passed to uC_api, eg. capture_path
+    :return: the uC
+    :rtype: uC_api
+    """
+    return uC_api(socket_path, api_level, connection=DaemonConnection(socket_path), **kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="serve a uC to client processes on a unix domain socket")
+    parser.add_argument("serial_port_path")
+    parser.add_argument("socket_path")
+    parser.add_argument("--capture", default=None, help="capture all packets to this file")
+    parser.add_argument("--allow-reset", action="store_true", help="let clients reset the uC")
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    daemon = DeviceDaemon(arguments.serial_port_path, arguments.socket_path, capture_path=arguments.capture,
+                          allow_reset=arguments.allow_reset)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    daemon.close()
@@ -0,0 +1,266 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import selectors
+import socket
+import threading
+import time
+from .uC import IO_CLOSED, IO_BUSY
+
+"""
+communication of many uCs on a few shared I/O threads
+
+without a manager every uC_api runs its own thread spinning on the serial port,
+with 16 boards these threads fight over the GIL while mostly doing nothing.
+a DeviceManager runs the communication loop of all its uCs on one (or a small pool of) reactor thread(s):
+
+ - every uC keeps its own protocol state (free input spots, alignment, buffers) in its uC_api object
+ - the reactor does one round of every uC in turn, starting with a different uC every pass so no board is starved
+ - when no uC had anything to do, the reactor sleeps until one of the serial ports has data,
+   a packet is send by the API or idle_wait has passed
+ - the connection handshake runs in a short lived thread per uC, so slow boards do not block the others
+
+.. code-block:: python
+
+    manager = uC_api.device_manager.DeviceManager()
+    boards = [uC_api.uC_api(port, 2, manager=manager) for port in ports]
+    ...
+    manager.close()
+    print(manager.statistics())
+"""
+
+
+class _Reactor:
+    """one I/O thread of the DeviceManager running the communication loop of its uCs
+    """
+    def __init__(self, reactor_id, idle_wait):
+        self.__id = reactor_id
+        self.__idle_wait = idle_wait
+        self.__devices = []
+        self.__lock = threading.Lock()
+        self.__running = True
+        self.__sleeping = False
+        self.__selector = selectors.DefaultSelector()
+        # the API wakes the sleeping reactor by writing to this socket pair (select does not support pipes on windows)
+        self.__wake_receive, self.__wake_send = socket.socketpair()
+        self.__wake_receive.setblocking(False)
+        self.__wake_send.setblocking(False)
+        self.__selector.register(self.__wake_receive, selectors.EVENT_READ)
+        self.__registered = {}
+        # statistics
+        self.__passes = 0
+        self.__busy_passes = 0
+        self.__wakeups = 0
+        self.__steps = {}
+        self.__cpu_time = 0.0
+        self.__start_time = time.monotonic()
+        self.__thread = threading.Thread(target=self.__thread_function, name="uC_api reactor "+str(reactor_id), daemon=True)
+        self.__thread.start()
+
+    def add(self, device):
+        with self.__lock:
+            self.__devices = self.__devices + [device]
+            self.__steps[device.name()] = 0
+        self.wake()
+
+    def remove(self, device):
+        with self.__lock:
+            self.__devices = [other for other in self.__devices if other is not device]
+        fileno = self.__registered.pop(device, None)
+        if fileno is not None:
+            try:
+                self.__selector.unregister(fileno)
+            except (KeyError, ValueError):
+                pass
+
+    def number_of_devices(self):
+        return len(self.__devices)
+
+    def wake(self):
+        # only a sleeping reactor needs the (comparably expensive) socket write
+        if self.__sleeping:
+            try:
+                self.__wake_send.send(b"\x00")
+            except BlockingIOError:
+                pass
+
+    def stop(self):
+        self.__running = False
+        self.__sleeping = True
+        self.wake()
+        self.__thread.join()
+        self.__selector.close()
+        self.__wake_receive.close()
+        self.__wake_send.close()
+
+    def statistics(self):
+        elapsed = time.monotonic() - self.__start_time
+        return {
+            "devices": [device.name() for device in self.__devices],
+            "passes": self.__passes,
+            "busy_passes": self.__busy_passes,
+            "busy_fraction": self.__busy_passes / self.__passes if self.__passes > 0 else 0.0,
+            "wakeups": self.__wakeups,
+            "device_steps": dict(self.__steps),
+            "cpu_time": self.__cpu_time,
+            "cpu_fraction": self.__cpu_time / elapsed if elapsed > 0 else 0.0}
+
+    def __register(self, devices):
+        """__register adds the serial ports of new devices to the selector, devices without file descriptor are polled
+        """
+        for device in devices:
+            if device not in self.__registered:
+                fileno = device._io_fileno()
+                self.__registered[device] = fileno
+                if fileno is not None:
+                    try:
+                        self.__selector.register(fileno, selectors.EVENT_READ)
+                    except (KeyError, ValueError, OSError):
+                        self.__registered[device] = None
+
+    def __thread_function(self):
+        start = 0
+        while self.__running:
+            devices = self.__devices
+            self.__register(devices)
+            busy = False
+            number_of_devices = len(devices)
+            for index in range(number_of_devices):
+                device = devices[(start + index) % number_of_devices]
+                try:
+                    io_state = device._io_step()
+                except Exception as error:
+                    # one broken board must not stop the others
+                    logging.error("device manager: communication with "+device.name()+" failed, removing it: "+repr(error))
+                    device._io_abort()
+                    self.remove(device)
+                    continue
+                if io_state == IO_CLOSED:
+                    self.remove(device)
+                elif io_state == IO_BUSY:
+                    busy = True
+                    self.__steps[device.name()] += 1
+            start = start + 1 if number_of_devices > 0 and start + 1 < number_of_devices else 0
+            self.__passes += 1
+            if busy:
+                self.__busy_passes += 1
+            else:
+                # nothing to do, sleep until data arrives, a packet is send or idle_wait has passed
+                self.__sleeping = True
+                if not self.__running:
+                    break
+                self.__wakeups += 1
+                events = self.__selector.select(self.__idle_wait)
+                self.__sleeping = False
+                for key, mask in events:
+                    if key.fileobj is self.__wake_receive:
+                        try:
+                            while self.__wake_receive.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+            if self.__passes % 1000 == 0:
+                self.__cpu_time = time.thread_time()
+        self.__cpu_time = time.thread_time()
+
+
+class DeviceManager:
+    """
+    DeviceManager runs the communication with many uCs on one or a few shared I/O threads,
+    see the description at the top of device_manager.py
+    """
+    def __init__(self, threads=1, idle_wait=0.001):
+        """__init__ starts the reactor threads
+
+        :param threads: number of reactor threads, the uCs are distributed evenly, defaults to 1
+        :type threads: int, optional
+        :param idle_wait: maximal time in s a reactor sleeps when there is nothing to do,
+        bounds the latency for uCs without file descriptor and of the free input spot requests, defaults to 0.001
+        :type idle_wait: float, optional
+        """
+        self.__reactors = [_Reactor(reactor_id, idle_wait) for reactor_id in range(max(threads, 1))]
+        self.__device_reactor = {}
+        self.__devices = []
+        self.__connect_times = {}
+        self.__lock = threading.Lock()
+
+    def add_device(self, device):
+        """add_device connects a uC in the background and runs its communication on the least used reactor,
+        called by uC_api when it is created with manager=
+
+        :param device: the uC
+        :type device: uC_api
+        """
+        with self.__lock:
+            reactor = min(self.__reactors, key=lambda reactor: sum(1 for other in self.__device_reactor.values() if other is reactor))
+            self.__device_reactor[device] = reactor
+            self.__devices.append(device)
+        threading.Thread(target=self.__connect, args=(device, reactor), daemon=True).start()
+
+    def __connect(self, device, reactor):
+        """__connect runs the connection handshake of one uC and hands it to its reactor
+        """
+        start = time.monotonic()
+        try:
+            connected = device._open_connection()
+        except Exception as error:
+            logging.error("device manager: connecting to "+device.name()+" failed: "+repr(error))
+            device._io_abort()
+            return
+        if connected:
+            self.__connect_times[device.name()] = time.monotonic() - start
+            reactor.add(device)
+        else:
+            logging.error("device manager: could not connect to "+device.name())
+
+    def wake(self, device):
+        """wake tells the reactor of the uC that there is something to send, called by uC_api
+
+        :param device: the uC
+        :type device: uC_api
+        """
+        reactor = self.__device_reactor.get(device)
+        if reactor is not None:
+            reactor.wake()
+
+    def devices(self):
+        """devices returns all uCs added to the manager
+
+        :return: list of uCs
+        :rtype: [uC_api]
+        """
+        return list(self.__devices)
+
+    def statistics(self):
+        """statistics returns the load of every reactor thread: number of loop passes and the fraction with work,
+        the number of times it went to sleep, the busy rounds per uC and the cpu time used by the thread (and its fraction of the wall time),
+        and the connection time per uC
+
+        :return: dict with the keys reactors (list of dicts) and connect_times (dict of uC name to s)
+        :rtype: dict
+        """
+        return {"reactors": [reactor.statistics() for reactor in self.__reactors], "connect_times": dict(self.__connect_times)}
+
+    def close(self):
+        """close closes the connection to all uCs and stops the reactor threads
+        """
+        for device in self.devices():
+            if not device.is_closed():
+                device.close_connection()
+        for reactor in self.__reactors:
+            reactor.stop()
@@ -0,0 +1,314 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import multiprocessing
+import os
+import struct
+from multiprocessing import shared_memory, resource_tracker
+from time import sleep, monotonic
+from .header import Data32bitHeader, DataI2CHeader, PinHeader, ConfigMainHeader, ErrorHeader
+from .packet import Data32bitPacket, DataI2CPacket, PinPacket, ConfigPacket, ErrorPacket, EncodedPacket
+
+"""
+communication of one uC in a child process
+
+with several high rate uCs in one python process the serial reading, alignment and decoding of all of them
+share one GIL. with uC_api(..., process=True) the communication loop of the uC runs in a child process
+(a level 1 uC_api driven by _ProcessPump) and only the validated packets are exchanged with the parent
+through two single producer single consumer rings in shared memory:
+
+ - receive ring (child -> parent): the 9 byte packets as send by the uC, without the ones the communication loop handles itself
+   (free input queue spots, latency probe replies), the child does not build packet objects for them
+ - send ring (parent -> child): the 9 byte packets the API sends, the child sorts them into its instant and timed queue
+   as EncodedPacket without decoding them
+
+the parent keeps the normal uC_api with all interface objects, it decodes every packet once (the packet type is looked up
+by the header in a table, the child only forwards valid packets) and processes them in update_state.
+on platforms that spawn processes (windows, macos) the script creating the uC_api needs a if __name__ == "__main__": guard.
+"""
+
+"""
+packet type of every header, in the same order of precedence as Packet.from_bytearray
+"""
+_PACKET_TYPES = {int(header): packet_type for packet_type, headers in ((ErrorPacket, ErrorHeader), (ConfigPacket, ConfigMainHeader),
+    (PinPacket, PinHeader), (DataI2CPacket, DataI2CHeader), (Data32bitPacket, Data32bitHeader)) for header in headers}
+
+"""
+ring layout: write index at byte 0, read index at byte 64 (own cache line each), records from byte 128
+"""
+_RING_INDEX = struct.Struct("<Q")
+_RING_WRITE = 0
+_RING_READ = 64
+_RING_DATA = 128
+
+RECEIVE_RECORD_SIZE = 9
+SEND_RECORD_SIZE = 9
+
+
+class SharedRing:
+    """
+    SharedRing is a single producer single consumer ring buffer of fixed size records in shared memory,
+    one process only puts, the other only gets.
+    """
+    def __init__(self, capacity, record_size, name=None):
+        """__init__ creates the ring, or attaches to an existing one if name is given
+
+        :param capacity: number of records in the ring
+        :type capacity: int
+        :param record_size: size of one record in bytes
+        :type record_size: int
+        :param name: name of the shared memory of an existing ring, defaults to None (create a new ring)
+        :type name: string, optional
+        """
+        self.__capacity = capacity
+        self.__record_size = record_size
+        self.__created = name is None
+        self.__memory = shared_memory.SharedMemory(name=name, create=self.__created, size=_RING_DATA + capacity * record_size)
+        self.__buffer = self.__memory.buf
+        if self.__created:
+            _RING_INDEX.pack_into(self.__buffer, _RING_WRITE, 0)
+            _RING_INDEX.pack_into(self.__buffer, _RING_READ, 0)
+
+    def name(self):
+        """name returns the name of the shared memory, to attach to the ring from the other process
+
+        :return: the name
+        :rtype: string
+        """
+        return self.__memory.name
+
+    def __len__(self):
+        return _RING_INDEX.unpack_from(self.__buffer, _RING_WRITE)[0] - _RING_INDEX.unpack_from(self.__buffer, _RING_READ)[0]
+
+    def put(self, data):
+        """put writes as many of the records in data as fit into the ring
+
+        :param data: the records, a multiple of record_size bytes
+        :type data: bytes
+        :return: number of records written
+        :rtype: int
+        """
+        write = _RING_INDEX.unpack_from(self.__buffer, _RING_WRITE)[0]
+        read = _RING_INDEX.unpack_from(self.__buffer, _RING_READ)[0]
+        count = min(self.__capacity - (write - read), len(data) // self.__record_size)
+        if count <= 0:
+            return 0
+        position = write % self.__capacity
+        first = min(count, self.__capacity - position)
+        start = _RING_DATA + position * self.__record_size
+        self.__buffer[start:start + first * self.__record_size] = data[:first * self.__record_size]
+        if count > first:
+            # wrap around
+            self.__buffer[_RING_DATA:_RING_DATA + (count - first) * self.__record_size] = data[first * self.__record_size:count * self.__record_size]
+        # publish the records only after they are written
+        _RING_INDEX.pack_into(self.__buffer, _RING_WRITE, write + count)
+        return count
+
+    def get(self, max_records=None):
+        """get takes records out of the ring
+
+        :param max_records: maximal number of records, defaults to None (all)
+        :type max_records: int, optional
+        :return: the records
+        :rtype: bytes
+        """
+        write = _RING_INDEX.unpack_from(self.__buffer, _RING_WRITE)[0]
+        read = _RING_INDEX.unpack_from(self.__buffer, _RING_READ)[0]
+        count = write - read
+        if max_records is not None:
+            count = min(count, max_records)
+        if count <= 0:
+            return b""
+        position = read % self.__capacity
+        first = min(count, self.__capacity - position)
+        start = _RING_DATA + position * self.__record_size
+        data = bytes(self.__buffer[start:start + first * self.__record_size])
+        if count > first:
+            data += bytes(self.__buffer[_RING_DATA:_RING_DATA + (count - first) * self.__record_size])
+        _RING_INDEX.pack_into(self.__buffer, _RING_READ, read + count)
+        return data
+
+    def close(self):
+        """close detaches from the shared memory, the creating side also removes it
+        """
+        if self.__buffer is None:
+            return
+        self.__buffer.release()
+        self.__buffer = None
+        self.__memory.close()
+        if self.__created:
+            self.__memory.unlink()
+
+
+class _ProcessPump:
+    """minimal device manager for the level 1 uC_api in the child process, the child main loop drives it
+    """
+    def add_device(self, device):
+        pass
+
+    def wake(self, device):
+        pass
+
+
+def _device_process(serial_port_path, receive_ring, send_ring, capacity, capture_path, connected):
+    """_device_process is the main function of the child process: connects to the uC and moves packets between the rings and the uC
+
+    :return: exit code 0 if the connection was closed normally, 1 if connecting failed
+    """
+    from .uC import uC_api, IO_CLOSED, IO_IDLE, IO_BUSY
+    receive = SharedRing(capacity, RECEIVE_RECORD_SIZE, name=receive_ring)
+    send = SharedRing(capacity, SEND_RECORD_SIZE, name=send_ring)
+    device = uC_api(serial_port_path, api_level=1, capture_path=capture_path, manager=_ProcessPump())
+    device._forward_raw_packets()
+    if not device._open_connection():
+        device.stop_capture()
+        receive.close()
+        send.close()
+        os._exit(1)
+    connected.set()
+    # records that did not fit into the receive ring yet
+    pending = b""
+    while True:
+        data = send.get()
+        for offset in range(0, len(data), SEND_RECORD_SIZE):
+            device.send_packet(EncodedPacket(data[offset:offset + SEND_RECORD_SIZE]))
+        if len(pending) >= capacity * RECEIVE_RECORD_SIZE:
+            # the parent does not keep up, stop reading from the uC until it has caught up with one ring of packets
+            sleep(0.0001)
+            io_state = IO_BUSY
+        else:
+            io_state = device._io_step()
+            pending += device._take_raw_packets()
+        if len(pending) > 0:
+            pending = pending[receive.put(pending) * RECEIVE_RECORD_SIZE:]
+        if io_state == IO_CLOSED:
+            break
+        if io_state == IO_IDLE and len(pending) == 0:
+            sleep(0.000003)
+    # hand the last packets to the parent, it keeps reading until this process ended
+    while len(pending) > 0:
+        pending = pending[receive.put(pending) * RECEIVE_RECORD_SIZE:]
+        sleep(0.0001)
+    device.stop_capture()
+    receive.close()
+    send.close()
+
+
+class DeviceProcess:
+    """
+    DeviceProcess is the parent side of a uC whose communication runs in a child process,
+    see the description at the top of device_process.py, used by uC_api(..., process=True)
+    """
+    def __init__(self, serial_port_path, capture_path=None, capacity=2**16):
+        """__init__ creates the rings and starts the child process
+
+        :param serial_port_path: the serial port of the uC
+        :type serial_port_path: string
+        :param capture_path: if given the child captures all raw packets to this file, defaults to None
+        :type capture_path: string, optional
+        :param capacity: number of packets each ring can hold, defaults to 2**16
+        :type capacity: int, optional
+        """
+        if os.name == "posix":
+            # the child has to share the resource tracker of this process, else it reports the rings as leaked
+            resource_tracker.ensure_running()
+        self.__receive = SharedRing(capacity, RECEIVE_RECORD_SIZE)
+        self.__send = SharedRing(capacity, SEND_RECORD_SIZE)
+        self.__connected = multiprocessing.Event()
+        self.__start_time = monotonic()
+        self.__connect_time = None
+        self.__process = multiprocessing.Process(target=_device_process, name="uC_api "+str(serial_port_path),
+            args=(serial_port_path, self.__receive.name(), self.__send.name(), capacity, capture_path, self.__connected), daemon=True)
+        self.__process.start()
+
+    def is_alive(self):
+        """is_alive tells if the child process is still running
+
+        :return: True if running
+        :rtype: bool
+        """
+        return self.__process.is_alive()
+
+    def wait_connected(self, timeout=None):
+        """wait_connected blocks until the child has connected to the uC or ended
+
+        :param timeout: maximal time to wait in s, defaults to None (no limit)
+        :type timeout: float, optional
+        :return: True if the uC is connected
+        :rtype: bool
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while not self.__connected.is_set() and self.__process.is_alive():
+            remaining = 0.01 if deadline is None else min(deadline - monotonic(), 0.01)
+            if remaining <= 0:
+                break
+            self.__connected.wait(remaining)
+        return self.connect_time() is not None
+
+    def connect_time(self):
+        """connect_time returns the time from starting the child until it was connected to the uC
+
+        :return: the time in s, None if not (yet) connected
+        :rtype: float
+        """
+        if self.__connect_time is None and self.__connected.is_set():
+            # the time the parent noticed it, at most the polling interval of wait_connected later
+            self.__connect_time = monotonic() - self.__start_time
+        return self.__connect_time
+
+    def send(self, packet):
+        """send hands a packet to the child, waits while the send ring is full
+
+        :param packet: the packet
+        :type packet: Packet, or any subclass
+        :return: False if the child process has ended
+        :rtype: bool
+        """
+        data = packet.to_bytearray()
+        while self.__send.put(data) == 0:
+            if not self.__process.is_alive():
+                logging.error("communication process of "+self.__process.name+" has ended, packet not send: "+str(packet))
+                return False
+            sleep(0.0001)
+        return True
+
+    def receive(self):
+        """receive takes all packets the child has read from the uC
+
+        :return: the packets
+        :rtype: [Packet]
+        """
+        data = self.__receive.get()
+        return [_PACKET_TYPES[data[offset]].from_bytearray(data[offset:offset + RECEIVE_RECORD_SIZE]) for offset in range(0, len(data), RECEIVE_RECORD_SIZE)]
+
+    def join(self):
+        """join waits until the child process has ended, while emptying the receive ring so it can finish
+
+        :return: the packets received while waiting
+        :rtype: [Packet]
+        """
+        packets = []
+        while self.__process.is_alive():
+            packets += self.receive()
+            self.__process.join(0.001)
+        packets += self.receive()
+        if self.__process.exitcode != 0:
+            logging.error("communication process of "+self.__process.name+" ended with exit code "+str(self.__process.exitcode))
+        self.__receive.close()
+        self.__send.close()
+        return packets
@@ -0,0 +1,363 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+import logging
+import os
+import select
+import selectors
+import socket
+import struct
+import threading
+from collections import deque
+from time import monotonic
+from .header import ConfigMainHeader
+from .packet import Packet
+
+"""
+fan out of the packets of one uC to many local subscribers (eg. a live monitor, an archiver and a closed loop controller)
+
+the EventServer registers a packet listener on a uC_api, the communication loop only queues the raw packets of every round,
+the server thread sends them to all subscribers. every subscriber chooses the headers it wants (eg. only async_from_chip0)
+and has a bounded send buffer, a subscriber that does not keep up is either disconnected (policy "disconnect")
+or skips batches until it caught up (policy "downsample"), the uC communication never waits for a subscriber.
+
+.. code-block:: python
+
+    server = uC_api.event_server.EventServer(uc, "/tmp/uc0_events.sock")
+    # in another process
+    subscriber = uC_api.event_server.EventSubscriber("/tmp/uc0_events.sock", headers=[130])
+    packets, dropped = subscriber.receive()
+
+protocol: the subscriber sends one json line {"headers": [...] or null for all, "pins": [[header, pin id], ...],
+"policy": "disconnect" or "downsample"}, the packets of a header in pins are only send for the listed pin ids,
+the server sends frames of the packet count and the number of packets dropped for this subscriber so far (2x 32bit little endian)
+followed by the 9 byte packets.
+"""
+
+_FRAME = struct.Struct("<II")
+_PACKET_SIZE = 9
+
+
+def _subscription_of(headers):
+    """_subscription_of returns the headers and the (header, pin id) pairs to filter for:
+    an int is used as is, an interface object adds all its headers (as CaptureReader.select),
+    the headers of a pin are shared by all pins so they are filtered by its pin id as well
+    """
+    wanted = []
+    pins = []
+    for header in headers:
+        if hasattr(header, "pin_id"):
+            pins += [[int(pin_header), header.pin_id()] for pin_header in header.header()]
+        elif hasattr(header, "header"):
+            wanted += [int(interface_header) for interface_header in header.header()]
+        else:
+            wanted.append(int(header))
+    return (wanted, pins)
+
+
+def _pin_id_offset(header):
+    """_pin_id_offset returns the byte of a packet holding the pin id: the value of an IN_CONF_PIN config packet, the pin id of a pin packet
+    """
+    return 6 if header == ConfigMainHeader.IN_CONF_PIN else 5
+
+
+class _Subscriber:
+    """state of one connected subscriber in the EventServer
+    """
+    def __init__(self, sock):
+        self.socket = sock
+        self.received = bytearray()
+        self.to_send = bytearray()
+        # None until the subscription was received, then a 256 entry table of wanted headers: 0 not wanted, 1 all, 2 only the pins
+        self.headers = None
+        # header to (byte of the pin id, wanted pin ids) for the headers only wanted for some pins
+        self.pins = {}
+        self.policy = "disconnect"
+        self.sent = 0
+        self.dropped = 0
+
+
+class EventServer:
+    """
+    EventServer sends the packets received from one uC to many subscribers,
+    see the description at the top of event_server.py
+    """
+    def __init__(self, api, address, max_buffer=2**20, max_queue=2**16):
+        """__init__ starts the server thread and registers it as packet listener on the uC
+
+        :param api: the uC
+        :type api: uC_api
+        :param address: path of a unix domain socket, or (host, port) for TCP
+        :type address: string or (string, int)
+        :param max_buffer: maximal bytes waiting to be send to one subscriber, defaults to 1MiB
+        :type max_buffer: int, optional
+        :param max_queue: maximal number of rounds queued by the communication loop for the server thread, older are dropped, defaults to 2**16
+        :type max_queue: int, optional
+        """
+        self.__api = api
+        self.__address = address
+        self.__max_buffer = max_buffer
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.__listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.__listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.__listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__listener.bind(address)
+        self.__listener.listen()
+        self.__listener.setblocking(False)
+        self.__wake_receive, self.__wake_send = socket.socketpair()
+        self.__wake_receive.setblocking(False)
+        self.__wake_send.setblocking(False)
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__listener, selectors.EVENT_READ)
+        self.__selector.register(self.__wake_receive, selectors.EVENT_READ)
+        self.__subscribers = {}
+        self.__queue = deque(maxlen=max_queue)
+        self.__queue_overflows = 0
+        self.__sleeping = False
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__thread_function, daemon=True)
+        self.__thread.start()
+        self.__api.add_packet_listener(self.__on_packets)
+
+    def address(self):
+        """address returns the address the server listens on (with the actual port for TCP port 0)
+
+        :return: the address
+        :rtype: string or (string, int)
+        """
+        return self.__listener.getsockname()
+
+    def __on_packets(self, packets):
+        """__on_packets runs in the communication loop of the uC, it only queues the packets
+        """
+        if len(self.__queue) == self.__queue.maxlen:
+            self.__queue_overflows += 1
+        self.__queue.append(packets)
+        if self.__sleeping:
+            try:
+                self.__wake_send.send(b"\x00")
+            except BlockingIOError:
+                pass
+
+    def __accept(self):
+        sock, address = self.__listener.accept()
+        sock.setblocking(False)
+        self.__subscribers[sock] = _Subscriber(sock)
+        self.__selector.register(sock, selectors.EVENT_READ)
+
+    def __drop(self, subscriber, reason):
+        self.__selector.unregister(subscriber.socket)
+        del self.__subscribers[subscriber.socket]
+        subscriber.socket.close()
+        logging.info("event server: subscriber removed ("+reason+"), "+str(len(self.__subscribers))+" subscribers")
+
+    def __receive(self, subscriber):
+        try:
+            data = subscriber.socket.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as error:
+            self.__drop(subscriber, repr(error))
+            return
+        if len(data) == 0:
+            self.__drop(subscriber, "closed")
+            return
+        subscriber.received += data
+        if subscriber.headers is None and b"\n" in subscriber.received:
+            line, rest = bytes(subscriber.received).split(b"\n", 1)
+            try:
+                subscription = json.loads(line)
+                wanted = subscription.get("headers")
+                pins = {}
+                for header, pin_id in subscription.get("pins") or []:
+                    pins.setdefault(header, (_pin_id_offset(header), set()))[1].add(pin_id)
+                if wanted is None:
+                    subscriber.headers = bytes(256 * [1])
+                else:
+                    wanted = set(wanted)
+                    subscriber.headers = bytes(1 if header in wanted else (2 if header in pins else 0) for header in range(256))
+                    subscriber.pins = pins
+                subscriber.policy = subscription.get("policy", "disconnect")
+            except (ValueError, AttributeError, TypeError):
+                self.__drop(subscriber, "invalid subscription")
+                return
+            logging.info("event server: subscriber added ("+subscriber.policy+"), "+str(len(self.__subscribers))+" subscribers")
+
+    def __distribute(self, packets):
+        """__distribute filters the packets of one round for every subscriber and adds them to its send buffer
+        """
+        for subscriber in list(self.__subscribers.values()):
+            if subscriber.headers is None:
+                continue
+            table = subscriber.headers
+            if len(subscriber.pins) == 0:
+                selected = b"".join(packets[offset:offset + _PACKET_SIZE] for offset in range(0, len(packets), _PACKET_SIZE) if table[packets[offset]])
+            else:
+                pins = subscriber.pins
+                selected = b"".join(packets[offset:offset + _PACKET_SIZE] for offset in range(0, len(packets), _PACKET_SIZE)
+                    if table[packets[offset]] == 1 or (table[packets[offset]] == 2
+                        and packets[offset + pins[packets[offset]][0]] in pins[packets[offset]][1]))
+            if len(selected) == 0:
+                continue
+            count = len(selected) // _PACKET_SIZE
+            if len(subscriber.to_send) + len(selected) > self.__max_buffer:
+                if subscriber.policy == "downsample":
+                    # skip this batch, the subscriber sees the gap in the dropped count
+                    subscriber.dropped += count
+                    continue
+                self.__drop(subscriber, "not keeping up")
+                continue
+            subscriber.to_send += _FRAME.pack(count, subscriber.dropped) + selected
+            subscriber.sent += count
+
+    def __send(self):
+        for subscriber in list(self.__subscribers.values()):
+            if len(subscriber.to_send) == 0:
+                continue
+            try:
+                sent = subscriber.socket.send(subscriber.to_send)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError as error:
+                self.__drop(subscriber, repr(error))
+                continue
+            del subscriber.to_send[:sent]
+
+    def __thread_function(self):
+        while self.__running:
+            busy = False
+            while len(self.__queue) > 0:
+                self.__distribute(self.__queue.popleft())
+                busy = True
+            self.__send()
+            waiting = any(len(subscriber.to_send) > 0 for subscriber in self.__subscribers.values())
+            self.__sleeping = True
+            if len(self.__queue) > 0:
+                self.__sleeping = False
+                continue
+            # wait for new packets, subscribers or, if data is waiting to be send, only shortly
+            for key, mask in self.__selector.select(0.001 if waiting else 0.1):
+                if key.fileobj is self.__listener:
+                    self.__accept()
+                elif key.fileobj is self.__wake_receive:
+                    try:
+                        while self.__wake_receive.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif key.fileobj in self.__subscribers:
+                    self.__receive(self.__subscribers[key.fileobj])
+            self.__sleeping = False
+
+    def statistics(self):
+        """statistics returns per subscriber the number of packets send and dropped and the bytes waiting to be send
+
+        :return: dict with the keys subscribers (list of dicts with the keys policy, sent, dropped and buffered) and queue_overflows
+        :rtype: dict
+        """
+        return {"subscribers": [{"policy": subscriber.policy, "sent": subscriber.sent, "dropped": subscriber.dropped, "buffered": len(subscriber.to_send)}
+            for subscriber in list(self.__subscribers.values())], "queue_overflows": self.__queue_overflows}
+
+    def close(self):
+        """close stops the server and disconnects all subscribers
+        """
+        self.__api.remove_packet_listener(self.__on_packets)
+        self.__running = False
+        self.__thread.join()
+        for subscriber in list(self.__subscribers.values()):
+            self.__drop(subscriber, "server closed")
+        self.__selector.close()
+        self.__listener.close()
+        self.__wake_receive.close()
+        self.__wake_send.close()
+        if isinstance(self.__address, str) and os.path.exists(self.__address):
+            os.unlink(self.__address)
+
+
+class EventSubscriber:
+    """
+    EventSubscriber receives the packets of a uC from an EventServer, eg. in another process
+    """
+    def __init__(self, address, headers=None, policy="disconnect"):
+        """__init__ connects to the server and subscribes
+
+        :param address: path of the unix domain socket, or (host, port) for TCP
+        :type address: string or (string, int)
+        :param headers: the headers to receive, ints or interface objects (all their headers, for a pin only its packets), defaults to None (all)
+        :type headers: [int or Interface_*], optional
+        :param policy: "disconnect" to be disconnected or "downsample" to skip packets when not keeping up, defaults to "disconnect"
+        :type policy: string, optional
+        """
+        self.__socket = socket.socket(socket.AF_UNIX if isinstance(address, str) else socket.AF_INET, socket.SOCK_STREAM)
+        self.__socket.connect(address)
+        wanted, pins = (None, []) if headers is None else _subscription_of(headers)
+        subscription = {"headers": wanted, "pins": pins, "policy": policy}
+        self.__socket.sendall(json.dumps(subscription).encode() + b"\n")
+        self.__received = bytearray()
+        self.__dropped = 0
+
+    def fileno(self):
+        return self.__socket.fileno()
+
+    def receive_raw(self, timeout=None):
+        """receive_raw returns all packets that have arrived, waiting up to timeout for the first
+
+        :param timeout: maximal time to wait in s, defaults to None (forever)
+        :type timeout: float, optional
+        :return: the 9 byte packets and the number of packets dropped by the server for this subscriber so far
+        :rtype: (bytes, int)
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        packets = []
+        while True:
+            remaining = None if deadline is None else max(deadline - monotonic(), 0)
+            # once there are packets only take what is already waiting
+            readable, writable, failed = select.select([self.__socket], [], [], 0 if len(packets) > 0 else remaining)
+            if len(readable) == 0:
+                if len(packets) > 0 or remaining is not None:
+                    return (b"".join(packets), self.__dropped)
+                continue
+            data = self.__socket.recv(2**16)
+            if len(data) == 0:
+                raise ConnectionError("event server closed the connection")
+            self.__received += data
+            while len(self.__received) >= _FRAME.size:
+                count, dropped = _FRAME.unpack_from(self.__received)
+                end = _FRAME.size + count * _PACKET_SIZE
+                if len(self.__received) < end:
+                    break
+                packets.append(bytes(self.__received[_FRAME.size:end]))
+                self.__dropped = dropped
+                del self.__received[:end]
+
+    def receive(self, timeout=None):
+        """receive returns all packets that have arrived as packet objects, waiting up to timeout for the first
+
+        :param timeout: maximal time to wait in s, defaults to None (forever)
+        :type timeout: float, optional
+        :return: the packets and the number of packets dropped by the server for this subscriber so far
+        :rtype: ([Packet], int)
+        """
+        packets, dropped = self.receive_raw(timeout)
+        return ([Packet.from_bytearray(packets[offset:offset + _PACKET_SIZE]) for offset in range(0, len(packets), _PACKET_SIZE)], dropped)
+
+    def close(self):
+        self.__socket.close()
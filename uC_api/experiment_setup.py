@@ -0,0 +1,336 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import copy
+import json
+import logging
+from .interface_pin import Interface_PIN
+from .interface_i2c import Interface_I2C
+from .interface_spi import Interface_SPI
+from .interface_async import Interface_Async
+from .packet import EncodedPacket
+from .stimulus import StimulusCache, stimulus_key
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+"""
+declarative setup of the interfaces of an experiment
+
+instead of activate() calls per interface the setup is described once as a dict, JSON or YAML file:
+
+.. code-block:: json
+
+    {
+        "name": "chip A",
+        "pin": [{"id": 13, "pin_mode": "OUTPUT"}],
+        "async_to_chip": [{"id": 0, "req_pin": 2, "ack_pin": 3, "data_width": 4, "data_pins": [4, 5, 6, 7]}],
+        "spi": [{"id": 0, "mode": "SPI_MODE1", "speed_class": 4, "order": "MSBFIRST", "number_of_bytes": 2}]
+    }
+
+the lists are pin, async_to_chip, async_from_chip, spi and i2c, every entry has the id (index in the list of the uC_api)
+and the parameters of the activate function of the interface (without time), missing optional parameters get the defaults of activate.
+the description is validated completely (unknown keys, modes, ranges, ids and pins used twice), all problems are reported in one ValueError.
+
+the setup is compiled with the activate functions of the interfaces into the ConfigPacket bytes they send, in the order of the description,
+and cached by the hash of the validated description (with a stimulus.StimulusCache on disk also across processes):
+
+.. code-block:: python
+
+    setup = uC_api.experiment_setup.load_setup("chip_a.yaml", cache=uC_api.stimulus.StimulusCache("~/.cache/uC_api_stimulus"))
+    setup.apply(uc)
+    # or as configure function of sweep experiments
+    experiment = uC_api.sweep.Experiment(params, stimulus, configure=setup)
+
+the interfaces of the uC_api take the state from the uC replies as after activate.
+apply skips the interfaces that are already active, so the setup of the first point of a sweep is kept for the following points.
+YAML files need pyyaml.
+"""
+
+_REQUIRED = object()
+
+
+def _integer(low, high):
+    def check(value):
+        return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+    check.description = "an integer from "+str(low)+" to "+str(high)
+    return check
+
+
+def _one_of(*choices):
+    def check(value):
+        return value in choices
+    check.description = "one of "+", ".join(str(choice) for choice in choices)
+    return check
+
+
+def _pin_list(value):
+    return isinstance(value, list) and all(_integer(0, 54)(pin) for pin in value)
+_pin_list.description = "a list of pin ids from 0 to 54"
+
+_ASYNC_PARAMETERS = {
+    "req_pin": (_integer(0, 54), _REQUIRED),
+    "ack_pin": (_integer(0, 54), _REQUIRED),
+    "data_width": (_integer(1, 32), _REQUIRED),
+    "data_pins": (_pin_list, _REQUIRED),
+    "mode": (_one_of("4Phase_Chigh_Dhigh", "4Phase_Clow_Dhigh", "4Phase_MCP23017"), "4Phase_Chigh_Dhigh"),
+    "req_delay": (_integer(0, 2**32 - 1), 0)}
+
+# kind: (number of interfaces, parameters of activate with the check and the default)
+_SCHEMA = {
+    "pin": (55, {
+        "pin_mode": (_one_of("INPUT", "OUTPUT"), "OUTPUT"),
+        "interval": (_integer(0, 2**32 - 1), 0)}),
+    "async_to_chip": (8, _ASYNC_PARAMETERS),
+    "async_from_chip": (8, _ASYNC_PARAMETERS),
+    "spi": (3, {
+        "mode": (_one_of("SPI_MODE0", "SPI_MODE1", "SPI_MODE2", "SPI_MODE3"), "SPI_MODE0"),
+        "speed_class": (_integer(0, 8), 0),
+        "order": (_one_of("LSBFIRST", "MSBFIRST"), "LSBFIRST"),
+        "number_of_bytes": (_integer(1, 4), 1)}),
+    "i2c": (3, {
+        "speed": (_one_of(10000, 100000, 400000, 1000000, 3400000), 400000),
+        "order": (_one_of("LSBFIRST", "MSBFIRST"), "LSBFIRST"),
+        "number_of_bytes": (_integer(1, 2), 1)}),
+}
+
+
+def validate_setup(description):
+    """validate_setup checks a setup description and fills in the defaults
+
+    :param description: the description, see the top of experiment_setup.py
+    :type description: dict
+    :raises ValueError: with all problems found
+    :return: the validated description, a new dict with the interface lists in the order of the description
+    :rtype: dict
+    """
+    problems = []
+    result = {}
+    if not isinstance(description, dict):
+        raise ValueError("a setup description has to be a dict, got "+type(description).__name__)
+    # pin id: what uses it, to find pins used twice
+    used_pins = {}
+    for kind, entries in description.items():
+        if kind == "name":
+            result["name"] = str(entries)
+            continue
+        if kind not in _SCHEMA:
+            problems.append("unknown interface list "+repr(kind)+", known are "+", ".join(_SCHEMA))
+            continue
+        count, parameters = _SCHEMA[kind]
+        if not isinstance(entries, list):
+            problems.append(kind+" has to be a list of interfaces")
+            continue
+        result[kind] = []
+        ids = set()
+        for position, entry in enumerate(entries):
+            where = kind+"["+str(position)+"]"
+            if not isinstance(entry, dict) or not _integer(0, count - 1)(entry.get("id")):
+                problems.append(where+" needs an id from 0 to "+str(count - 1))
+                continue
+            where = kind+" "+str(entry["id"])
+            if entry["id"] in ids:
+                problems.append(where+" is configured twice")
+            ids.add(entry["id"])
+            validated = {"id": entry["id"]}
+            for key in entry:
+                if key != "id" and key not in parameters:
+                    problems.append(where+" has the unknown parameter "+repr(key)+", known are "+", ".join(parameters))
+            for key, (check, default) in parameters.items():
+                if key not in entry:
+                    if default is _REQUIRED:
+                        problems.append(where+" needs the parameter "+key)
+                    else:
+                        validated[key] = default
+                elif not check(entry[key]):
+                    problems.append(where+" parameter "+key+" has to be "+check.description+", got "+repr(entry[key]))
+                else:
+                    validated[key] = entry[key]
+            result[kind].append(validated)
+            # the uC pins this interface occupies
+            pins = []
+            if kind == "pin":
+                pins = [entry["id"]]
+            elif kind.startswith("async") and "req_pin" in validated and "ack_pin" in validated and "data_pins" in validated:
+                if "data_width" in validated and len(validated["data_pins"]) != validated["data_width"]:
+                    problems.append(where+" has "+str(len(validated["data_pins"]))+" data_pins for data_width "+str(validated["data_width"]))
+                # the MCP23017 port extender has its own data pins
+                pins = [validated["req_pin"], validated["ack_pin"]] + ([] if validated.get("mode") == "4Phase_MCP23017" else validated["data_pins"])
+            if len(set(pins)) != len(pins):
+                problems.append(where+" uses a pin more than once")
+            for pin in set(pins):
+                if pin in used_pins:
+                    problems.append("pin "+str(pin)+" is used by "+used_pins[pin]+" and "+where)
+                used_pins[pin] = where
+    if len(problems) > 0:
+        raise ValueError("invalid setup description:\n - "+"\n - ".join(problems))
+    return result
+
+
+class _Recorder:
+    """
+    _Recorder stands in for the uC_api when the activate functions are compiled, it keeps the encoded packets
+    """
+    def __init__(self):
+        self.data = bytearray()
+
+    def send_packet(self, packet_to_send):
+        self.data += packet_to_send.to_bytearray()
+
+    def update_state(self):
+        pass
+
+
+def _compile(description):
+    """the ConfigPacket bytes of a validated description
+    """
+    recorder = _Recorder()
+    for kind, entries in description.items():
+        if kind == "name":
+            continue
+        for entry in entries:
+            parameters = {key: value for key, value in entry.items() if key != "id"}
+            if kind == "pin":
+                interface = Interface_PIN(recorder, entry["id"])
+            elif kind == "async_to_chip":
+                interface = Interface_Async(recorder, entry["id"], "TO_CHIP")
+            elif kind == "async_from_chip":
+                interface = Interface_Async(recorder, entry["id"], "FROM_CHIP")
+            elif kind == "spi":
+                interface = Interface_SPI(recorder, entry["id"])
+            else:
+                interface = Interface_I2C(recorder, entry["id"])
+            interface.activate(time=0, **parameters)
+    return bytes(recorder.data)
+
+
+class ExperimentSetup:
+    """
+    ExperimentSetup is a validated and compiled setup description, see the top of experiment_setup.py
+    """
+    def __init__(self, description, cache=None):
+        """__init__ validates and compiles the description, or takes the compiled bytes from the cache
+
+        :param description: the description
+        :type description: dict
+        :param cache: cache for the compiled setup, defaults to None (the cache of this module, in memory)
+        :type cache: StimulusCache, optional
+        :raises ValueError: if the description is not valid
+        """
+        self.description = validate_setup(description)
+        self.key = stimulus_key("setup", json.dumps(self.description))
+        self.__cache = _default_cache if cache is None else cache
+        self.__block = self.__cache.get(self.key, lambda: _compile(self.description))
+        self.__packets = None
+
+    def name(self):
+        """name returns the name of the setup
+
+        :return: the name, None if the description has none
+        :rtype: string
+        """
+        return self.description.get("name")
+
+    def data(self):
+        """data returns the compiled ConfigPacket bytes
+
+        :return: the packets
+        :rtype: bytes
+        """
+        return bytes(self.__block.data())
+
+    def packets(self):
+        """packets returns the compiled setup as packets
+
+        :return: the packets
+        :rtype: [EncodedPacket]
+        """
+        if self.__packets is None:
+            data = self.__block.data()
+            self.__packets = [EncodedPacket(data[start:start + 9]) for start in range(0, len(data), 9)]
+        return self.__packets
+
+    def interfaces(self, api):
+        """interfaces returns the interface objects of a uC_api this setup configures
+
+        :param api: the uC (level 2)
+        :type api: uC_api
+        :return: the interfaces in the order of the description
+        :rtype: [Interface_*]
+        """
+        return [getattr(api, kind)[entry["id"]] for kind, entries in self.description.items() if kind != "name" for entry in entries]
+
+    def apply(self, api):
+        """apply sends the compiled setup to a uC, as instant packets,
+        interfaces that are already active (eg. when used as configure function of a sweep) are skipped
+
+        :param api: the uC (level 2)
+        :type api: uC_api
+        """
+        remaining = {}
+        skipped = 0
+        for kind, entries in self.description.items():
+            if kind == "name":
+                continue
+            for entry in entries:
+                if getattr(api, kind)[entry["id"]].status()[0] in ("active", "activation pending"):
+                    skipped += 1
+                else:
+                    remaining.setdefault(kind, []).append(entry)
+        if skipped == 0:
+            api.send_packets(self.packets())
+            return
+        logging.info("setup "+str(self.name())+": "+str(skipped)+" interfaces of "+str(api.name())+" are already active, they are not activated again")
+        if len(remaining) == 0:
+            return
+        # the remaining interfaces are compiled (and cached) as a setup of their own
+        key = stimulus_key("setup", json.dumps(remaining))
+        data = self.__cache.get(key, lambda: _compile(remaining)).data()
+        api.send_packets([EncodedPacket(data[start:start + 9]) for start in range(0, len(data), 9)])
+
+    def __call__(self, api, params=None):
+        """the setup can be used as configure function of a sweep.Experiment, the params are ignored
+        """
+        self.apply(api)
+
+
+def load_setup(source, cache=None):
+    """load_setup reads a setup description and compiles it
+
+    :param source: a .json, .yaml or .yml file or the description as dict
+    :type source: string or dict
+    :param cache: cache for the compiled setup, defaults to None (the cache of this module, in memory)
+    :type cache: StimulusCache, optional
+    :raises ValueError: if the description is not valid
+    :return: the setup
+    :rtype: ExperimentSetup
+    """
+    if isinstance(source, dict):
+        return ExperimentSetup(copy.deepcopy(source), cache)
+    with open(source) as setup_file:
+        if source.endswith(".yaml") or source.endswith(".yml"):
+            if yaml is None:
+                raise ImportError("YAML setup descriptions need pyyaml")
+            description = yaml.safe_load(setup_file)
+        else:
+            description = json.load(setup_file)
+    return ExperimentSetup(description, cache)
+
+
+_default_cache = StimulusCache(memory_bytes=2**24)
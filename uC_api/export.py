@@ -0,0 +1,282 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import os
+import zipfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+export of the recorded interface data to columnar files
+
+the data is written in chunks: every call of Exporter.flush appends what was recorded since the last flush,
+so long sessions can be written to disk while the experiment is running and, with clear=True,
+without keeping the recorded data in memory.
+
+every interface direction is stored as a table <interface>/<direction> (eg. async_from_chip0/from_chip)
+with the columns time and data (I2C: read, device_address, register_address and data).
+the tables experiment_state, errors and config (the configuration with the uC timestamps of every interface)
+are written when the exporter is closed.
+
+supported formats (chosen by the file extension):
+ - .npz numpy zip archive, needs numpy, every chunk is a separate array <table>/<column>/<chunk>.npy, see load_npz_export
+ - .h5 / .hdf5 needs h5py, every column is a resizeable dataset <table>/<column>
+ - .parquet needs pyarrow, the path is a directory with one parquet file per table, every chunk is a row group
+"""
+
+"""
+interface configuration getters exported to the config table, each returns (value, uC timestamp)
+"""
+_CONFIG_GETTERS = ("status", "interface_type", "interface_mode", "data_width", "req_pin", "ack_pin", "req_delay",
+    "interval", "speed", "bit_order", "byte_order", "number_of_bytes")
+
+
+class _NpzWriter:
+    """writes the export as numpy zip archive, chunks are separate arrays in the archive
+    """
+    def __init__(self, path):
+        self.__zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        self.__chunks = {}
+
+    def __write_array(self, name, array):
+        with self.__zip.open(name + ".npy", "w", force_zip64=True) as array_file:
+            np.lib.format.write_array(array_file, np.asarray(array), allow_pickle=False)
+
+    def append(self, table, columns):
+        chunk = self.__chunks.get(table, 0)
+        for column, array in columns.items():
+            self.__write_array(table + "/" + column + "/" + str(chunk).zfill(6), array)
+        self.__chunks[table] = chunk + 1
+
+    def write(self, table, columns):
+        for column, array in columns.items():
+            self.__write_array(table + "/" + column, array)
+
+    def close(self):
+        self.__zip.close()
+
+
+class _Hdf5Writer:
+    """writes the export as HDF5 file, every column is a resizeable dataset
+    """
+    def __init__(self, path):
+        import h5py
+        self.__file = h5py.File(path, "w")
+
+    def append(self, table, columns):
+        for column, array in columns.items():
+            name = table + "/" + column
+            if name not in self.__file:
+                self.__file.create_dataset(name, data=array, maxshape=(None,), chunks=True)
+            else:
+                dataset = self.__file[name]
+                dataset.resize((dataset.shape[0] + len(array),))
+                dataset[-len(array):] = array
+        self.__file.flush()
+
+    def write(self, table, columns):
+        for column, array in columns.items():
+            if array.dtype.kind == "U":
+                array = array.astype(object)
+                import h5py
+                self.__file.create_dataset(table + "/" + column, data=array, dtype=h5py.string_dtype())
+            else:
+                self.__file.create_dataset(table + "/" + column, data=array)
+
+    def close(self):
+        self.__file.close()
+
+
+class _ParquetWriter:
+    """writes the export as directory of parquet files, one per table, every chunk is a row group
+    """
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self.__pyarrow = pyarrow
+        self.__path = path
+        self.__writers = {}
+        os.makedirs(path, exist_ok=True)
+
+    def __file_name(self, table):
+        return os.path.join(self.__path, table.replace("/", "_") + ".parquet")
+
+    def append(self, table, columns):
+        arrow_table = self.__pyarrow.table(columns)
+        if table not in self.__writers:
+            self.__writers[table] = self.__pyarrow.parquet.ParquetWriter(self.__file_name(table), arrow_table.schema)
+        self.__writers[table].write_table(arrow_table)
+
+    def write(self, table, columns):
+        self.__pyarrow.parquet.write_table(self.__pyarrow.table(columns), self.__file_name(table))
+
+    def close(self):
+        for writer in self.__writers.values():
+            writer.close()
+
+
+class Exporter:
+    """
+    Exporter writes the data recorded by all interfaces of a uC_api (level 2) in chunks to a columnar file,
+    see the description at the top of export.py.
+
+    create it with uC_api.exporter, call flush whenever the recorded data should be written (eg. periodically while
+    the experiment is running) and close at the end.
+    """
+    def __init__(self, api, path, file_format=None, clear=False):
+        """__init__ creates the export file
+
+        :param api: the uC_api to export
+        :type api: uC_api
+        :param path: the path of the export file (directory for parquet)
+        :type path: string
+        :param file_format: "npz", "hdf5" or "parquet", defaults to None (chosen by the extension of path)
+        :type file_format: string, optional
+        :param clear: if True the exported data is removed from the interfaces after every flush to free the memory, defaults to False
+        :type clear: bool, optional
+        """
+        if np is None:
+            raise ImportError("Exporter needs numpy")
+        if file_format is None:
+            file_format = os.path.splitext(path)[1].lstrip(".").lower()
+        if file_format == "npz":
+            self.__writer = _NpzWriter(path)
+        elif file_format in ("h5", "hdf5"):
+            self.__writer = _Hdf5Writer(path)
+        elif file_format == "parquet":
+            self.__writer = _ParquetWriter(path)
+        else:
+            raise ValueError("unknown export format "+str(file_format)+" only npz, hdf5 and parquet are supported")
+        self.__api = api
+        self.__path = path
+        self.__clear = clear
+        # number of entries already exported per table, used when the interfaces are not cleared
+        self.__exported = {}
+        self.__closed = False
+
+    def __interfaces(self):
+        """__interfaces lists all interfaces of the api with their export name
+
+        :return: list of (name, interface)
+        :rtype: [(string, Interface_*)]
+        """
+        interfaces = []
+        for group in ("async_to_chip", "async_from_chip", "spi", "i2c", "pin"):
+            for interface_id, interface in enumerate(getattr(self.__api, group)):
+                interfaces.append((group + str(interface_id), interface))
+        return interfaces
+
+    def __columns(self, data, times):
+        """__columns converts the recorded lists of one interface direction to numpy columns
+
+        :return: dict of column name to array
+        :rtype: {string: numpy.ndarray}
+        """
+        columns = {"time": np.asarray(times, dtype=np.int64)}
+        if len(data) > 0 and isinstance(data[0], tuple):
+            # I2C records (read, device_address, register_address, value)
+            values = np.asarray(data, dtype=np.int64).reshape(len(data), 4)
+            columns["read"] = values[:, 0]
+            columns["device_address"] = values[:, 1]
+            columns["register_address"] = values[:, 2]
+            columns["data"] = values[:, 3]
+        else:
+            columns["data"] = np.asarray(data, dtype=np.int64)
+        return columns
+
+    def flush(self):
+        """flush writes everything recorded since the last flush as a new chunk
+
+        :return: number of entries written
+        :rtype: int
+        """
+        if self.__closed:
+            logging.error("export to "+str(self.__path)+" is already closed")
+            return 0
+        self.__api.update_state()
+        written = 0
+        for name, interface in self.__interfaces():
+            for direction in ("to_chip", "from_chip"):
+                table = name + "/" + direction
+                if self.__clear:
+                    data, times = getattr(interface, "data_" + direction + "_and_clear")()
+                else:
+                    data, times = getattr(interface, "data_" + direction)()
+                    exported = self.__exported.get(table, 0)
+                    if len(times) < exported:
+                        logging.warning("export: data of "+table+" was cleared outside of the exporter, exporting from the start")
+                        exported = 0
+                    data, times = data[exported:], times[exported:]
+                    self.__exported[table] = exported + len(times)
+                if len(times) == 0:
+                    continue
+                self.__writer.append(table, self.__columns(data, times))
+                written += len(times)
+        return written
+
+    def close(self):
+        """close writes the remaining data, the experiment state, errors and the configuration of all interfaces and closes the file
+        """
+        if self.__closed:
+            return
+        self.flush()
+        states, timestamps = self.__api.experiment_state()
+        self.__writer.write("experiment_state", {"state": np.asarray(states, dtype=np.int64), "time": np.asarray(timestamps, dtype=np.int64)})
+        sources = ["uC"] * len(self.__api.errors)
+        errors = list(self.__api.errors)
+        config_interface, config_name, config_value, config_time = [], [], [], []
+        for name, interface in self.__interfaces():
+            for error in interface.errors():
+                sources.append(name)
+                errors.append(error)
+            for getter in _CONFIG_GETTERS:
+                if hasattr(interface, getter):
+                    value, timestamp = getattr(interface, getter)()
+                    config_interface.append(name)
+                    config_name.append(getter)
+                    config_value.append(str(value))
+                    config_time.append(timestamp)
+        self.__writer.write("errors", {"source": np.asarray(sources, dtype=str), "error": np.asarray(errors, dtype=str)})
+        self.__writer.write("config", {"interface": np.asarray(config_interface, dtype=str), "name": np.asarray(config_name, dtype=str),
+            "value": np.asarray(config_value, dtype=str), "time": np.asarray(config_time, dtype=np.int64)})
+        self.__writer.close()
+        self.__closed = True
+        logging.info("export: written to "+str(self.__path))
+
+
+def load_npz_export(path):
+    """load_npz_export reads a npz export and concatenates the chunks of every column
+
+    :param path: the path of the export file
+    :type path: string
+    :return: dict of table to dict of column to array
+    :rtype: {string: {string: numpy.ndarray}}
+    """
+    chunks = {}
+    with np.load(path) as archive:
+        for name in sorted(archive.files):
+            parts = name.split("/")
+            if len(parts) == 4:
+                # chunk of an interface table: <interface>/<direction>/<column>/<chunk>
+                chunks.setdefault(parts[0] + "/" + parts[1], {}).setdefault(parts[2], []).append(archive[name])
+            else:
+                chunks.setdefault(parts[0], {})[parts[1]] = [archive[name]]
+    return {table: {column: np.concatenate(arrays) for column, arrays in columns.items()} for table, columns in chunks.items()}
@@ -804,6 +804,22 @@ the 2 packets are used to align the communication between the PC and the uC
 """
 ALIGN_BYTEARRAY = b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xfd\x00\x00\x00\x00\x00\x00\x00\x00'
 
+"""
+headers of the data the uC sends from the chip (and the pins) to the PC,
+the other headers of an interface configure it or confirm the data send to the chip
+"""
+FROM_CHIP_HEADERS = frozenset([Data32bitHeader.OUT_SPI0, Data32bitHeader.OUT_SPI1, Data32bitHeader.OUT_SPI2,
+    Data32bitHeader.OUT_ASYNC_FROM_CHIP0, Data32bitHeader.OUT_ASYNC_FROM_CHIP1, Data32bitHeader.OUT_ASYNC_FROM_CHIP2, Data32bitHeader.OUT_ASYNC_FROM_CHIP3,
+    Data32bitHeader.OUT_ASYNC_FROM_CHIP4, Data32bitHeader.OUT_ASYNC_FROM_CHIP5, Data32bitHeader.OUT_ASYNC_FROM_CHIP6, Data32bitHeader.OUT_ASYNC_FROM_CHIP7,
+    DataI2CHeader.OUT_I2C0, DataI2CHeader.OUT_I2C1, DataI2CHeader.OUT_I2C2, PinHeader.OUT_PIN_LOW, PinHeader.OUT_PIN_HIGH])
+
+def from_chip_headers(interface):
+    """
+    returns the headers of an interface object that carry data from the chip (or the pin) to the PC,
+    empty for interfaces sending only to the chip, the packets of a pin are shared with all pins (see Interface_PIN.pin_id)
+    """
+    return [header for header in interface.header() if header in FROM_CHIP_HEADERS]
+
 """
 list of headers that should be logged on arrival
 errors are logged by default
@@ -19,6 +19,7 @@
 
 from .header import ConfigMainHeader, Data32bitHeader, ConfigSubHeader
 from .packet import ConfigPacket, Data32bitPacket
+from .run_index import RunIndex
 import logging, time
 
 class Interface_Async:
@@ -61,9 +62,11 @@ class Interface_Async:
         # data send to the chip
         self.__data_from_chip = []
         self.__data_from_chip_times = []
+        self.__runs_from_chip = RunIndex()
         # data recived from the chip
         self.__data_to_chip = []
         self.__data_to_chip_times = []
+        self.__runs_to_chip = RunIndex()
         # errors
         self.__errors = []
         # the parent object
@@ -187,15 +190,19 @@ class Interface_Async:
         self.update()
         return (self.__req_delay,self.__req_delay_timestamp)
 
-    def data_from_chip(self):
+    def data_from_chip(self, run=None):
         """ get the data recived from the chip
             will retun 2 lists: one with the word recoded and one with the time when it was recorded, linked by index
+            @param run: (int) only the data of this run, see run_offsets, default None is the data of all runs
             @return: tuple of the of data list and their timestamp list - index matched
         """
         self.update()
-        return (self.__data_from_chip, data_from_chip_times)
+        if run is None:
+            return (self.__data_from_chip, self.__data_from_chip_times)
+        start, end = self.__runs_from_chip.range(run, len(self.__data_from_chip))
+        return (self.__data_from_chip[start:end], self.__data_from_chip_times[start:end])
     
-    def data_to_chip(self):
+    def data_to_chip(self, run=None):
         """ get the data send to the chip when they are actually send off by the uC
             data_to_chip will retun the data send by the uC to the device under test (DUT)
 
@@ -204,10 +211,14 @@ class Interface_Async:
             the time might differ slightly from the time you sheduled the send word, 
             as it is the time when it was send out and the uC can only send one word at a time
             
+            @param run: (int) only the data of this run, see run_offsets, default None is the data of all runs
             @return: tuple of the of data list and their timestamp list (of when the uC send them) - index matched
         """
         self.update()
-        return (self.__data_to_chip, self.__data_to_chip_times)
+        if run is None:
+            return (self.__data_to_chip, self.__data_to_chip_times)
+        start, end = self.__runs_to_chip.range(run, len(self.__data_to_chip))
+        return (self.__data_to_chip[start:end], self.__data_to_chip_times[start:end])
 
     def data_from_chip_and_clear(self):
         """ get the data recived from the chip and clear the buffer
@@ -220,6 +231,7 @@ class Interface_Async:
         time = self.__data_from_chip_times
         self.__data_from_chip = []
         self.__data_from_chip_times = []
+        self.__runs_from_chip.clear()
         return (data, time)
     
     def data_to_chip_and_clear(self):
@@ -238,6 +250,7 @@ class Interface_Async:
         time = self.__data_to_chip_times
         self.__data_to_chip = []
         self.__data_to_chip_times = []
+        self.__runs_to_chip.clear()
         return (data, time)
     
     def errors(self):
@@ -378,5 +391,21 @@ class Interface_Async:
         else:
             logging.error("AER to chip interface "+str(self.__header[1])+" is reading interface - word is not sent.")
 
+    def new_run(self):
+        """ start a new run, called by update_state of the uC_api when an experiment starts
+        """
+        self.__runs_from_chip.new_run(len(self.__data_from_chip))
+        self.__runs_to_chip.new_run(len(self.__data_to_chip))
+
+    def run_offsets(self, direction="from_chip"):
+        """ get the run offset table of the recorded data, see run_index.py
+            @param direction: (string) "from_chip" or "to_chip"
+            @return: tuple of the first run in the data and the list of the first index of each run from there on
+        """
+        self.update()
+        if direction == "to_chip":
+            return self.__runs_to_chip.offsets()
+        return self.__runs_from_chip.offsets()
+
     def update(self):
         self.__api.update_state()
@@ -19,6 +19,7 @@
 
 from .header import ConfigMainHeader, DataI2CHeader, ConfigSubHeader
 from .packet import ConfigPacket, DataI2CPacket
+from .run_index import RunIndex
 import logging
 
 class Interface_I2C:
@@ -50,9 +51,11 @@ class Interface_I2C:
         # the data recived from the chip, and the time it was processed by the uC
         self.__data_from_chip = []
         self.__data_from_chip_times = []
+        self.__runs_from_chip = RunIndex()
         # the data send to the chip, and the time it was processed by the uC
         self.__data_to_chip = []
         self.__data_to_chip_times = []
+        self.__runs_to_chip = RunIndex()
         # the errors and unhandled packets reported by the uC
         self.__errors = []
         # the parent API object
@@ -102,17 +105,22 @@ class Interface_I2C:
         self.update()
         return (self.__order,self.__order_timestamp)
 
-    def data_from_chip(self):
+    def data_from_chip(self, run=None):
         """ Returns the data recived from the chip, and the time it was processed by the uC
 
         will retun 2 lists: one with the word recoded and one with the time when it was recorded, linked by index
 
+        @param run: (int) only the data of this run, see run_offsets, default None is the data of all runs
+
         @return: ([data_from_chip], [data_from_chip_times]) where data_from_chip is the data recived from the chip, and data_from_chip_times is the time it was processed by the uC
         """
         self.update()
-        return (self.__data_from_chip, data_from_chip_times)
+        if run is None:
+            return (self.__data_from_chip, self.__data_from_chip_times)
+        start, end = self.__runs_from_chip.range(run, len(self.__data_from_chip))
+        return (self.__data_from_chip[start:end], self.__data_from_chip_times[start:end])
     
-    def data_to_chip(self):
+    def data_to_chip(self, run=None):
         """ Returns the data send to the chip, and the time it was processed by the uC
 
         data_to_chip will retun the data send by the uC to the device under test (DUT)
@@ -122,10 +130,15 @@ class Interface_I2C:
         the time might differ slightly from the time you sheduled the send word, 
         as it is the time when it was send out and the uC can only send one word at a time
 
+        @param run: (int) only the data of this run, see run_offsets, default None is the data of all runs
+
         @return: ([data_to_chip], [data_to_chip_times]) where data_to_chip is the data send to the chip, and data_to_chip_times is the time it was processed by the uC
         """
         self.update()
-        return (self.__data_to_chip, self.__data_to_chip_times)
+        if run is None:
+            return (self.__data_to_chip, self.__data_to_chip_times)
+        start, end = self.__runs_to_chip.range(run, len(self.__data_to_chip))
+        return (self.__data_to_chip[start:end], self.__data_to_chip_times[start:end])
 
     def data_from_chip_and_clear(self):
         """ Returns the data recived from the chip, and the time it was processed by the uC, and clears the data
@@ -139,6 +152,7 @@ class Interface_I2C:
         time = self.__data_from_chip_times
         self.__data_from_chip = []
         self.__data_from_chip_times = []
+        self.__runs_from_chip.clear()
         return (data, time)
     
     def data_to_chip_and_clear(self):
@@ -157,6 +171,7 @@ class Interface_I2C:
         time = self.__data_to_chip_times
         self.__data_to_chip = []
         self.__data_to_chip_times = []
+        self.__runs_to_chip.clear()
         return (data, time)
     
     def errors(self):
@@ -287,6 +302,22 @@ class Interface_I2C:
         # we dont check the status here anymore as the uC will report the error anyway
         self.__api.send_packet(DataI2CPacket(self.__header[1], device_address=device_address, register_address=register_address,read=1,value=word,time=time))
 
+    def new_run(self):
+        """ start a new run, called by update_state of the uC_api when an experiment starts
+        """
+        self.__runs_from_chip.new_run(len(self.__data_from_chip))
+        self.__runs_to_chip.new_run(len(self.__data_to_chip))
+
+    def run_offsets(self, direction="from_chip"):
+        """ get the run offset table of the recorded data, see run_index.py
+            @param direction: (string) "from_chip" or "to_chip"
+            @return: tuple of the first run in the data and the list of the first index of each run from there on
+        """
+        self.update()
+        if direction == "to_chip":
+            return self.__runs_to_chip.offsets()
+        return self.__runs_from_chip.offsets()
+
     def update(self):
         """ update the data repersentation of the API object
         """
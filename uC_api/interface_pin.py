@@ -18,6 +18,7 @@
 
 from .header import ConfigMainHeader, PinHeader, ConfigSubHeader
 from .packet import ConfigPacket, PinPacket
+from .run_index import RunIndex
 from time import sleep
 import logging
 
@@ -51,8 +52,10 @@ class Interface_PIN:
         self.__interval_timestamp = 0
         self.__data_from_chip = []
         self.__data_from_chip_times = []
+        self.__runs_from_chip = RunIndex()
         self.__data_to_chip = []
         self.__data_to_chip_times = []
+        self.__runs_to_chip = RunIndex()
         self.__errors = []
         self.__pin_id = interface_id
         self.__api = api_object
@@ -66,6 +69,14 @@ class Interface_PIN:
         """
         return self.__header
 
+    def pin_id(self):
+        """pin_id returns the id of the pin on the uC, the pin packets of all pins share the headers
+
+        :return: pin id
+        :rtype: int
+        """
+        return self.__pin_id
+
     def status(self):
         """status returns the state of this interface,
 
@@ -100,18 +111,23 @@ class Interface_PIN:
         self.update()
         return (self.__interval,self.__interval_timestamp)
 
-    def data_from_chip(self):
+    def data_from_chip(self, run=None):
         """data_from_chip will retun the data recoded by the uC send from the device under test (DUT)
 
         will retun 2 lists: one with the word recoded and one with the time when it was recorded, linked by index
 
+        :param run: only the data of this run, see run_offsets, defaults to None (all runs)
+        :type run: int, optional
         :return: the words from the DUT and the times of those words
         :rtype: ([int],[int])
         """
         self.update()
-        return (self.__data_from_chip, data_from_chip_times)
+        if run is None:
+            return (self.__data_from_chip, self.__data_from_chip_times)
+        start, end = self.__runs_from_chip.range(run, len(self.__data_from_chip))
+        return (self.__data_from_chip[start:end], self.__data_from_chip_times[start:end])
     
-    def data_to_chip(self):
+    def data_to_chip(self, run=None):
         """data_to_chip will retun the data send by the uC to the device under test (DUT)
 
         will retun 2 lists: one with the word send and one with the exact time when it was send, linked by index
@@ -119,11 +135,16 @@ class Interface_PIN:
         the time might differ slightly from the time you sheduled the send word, 
         as it is the time when it was send out and the uC can only send one word at a time
 
+        :param run: only the data of this run, see run_offsets, defaults to None (all runs)
+        :type run: int, optional
         :return: the words send to the DUT and the times of those words
         :rtype: ([int],[int])
         """
         self.update()
-        return (self.__data_to_chip, self.__data_to_chip_times)
+        if run is None:
+            return (self.__data_to_chip, self.__data_to_chip_times)
+        start, end = self.__runs_to_chip.range(run, len(self.__data_to_chip))
+        return (self.__data_to_chip[start:end], self.__data_to_chip_times[start:end])
 
     def data_from_chip_and_clear(self):
         self.update()
@@ -131,6 +152,7 @@ class Interface_PIN:
         time = self.__data_from_chip_times
         self.__data_from_chip = []
         self.__data_from_chip_times = []
+        self.__runs_from_chip.clear()
         return (data, time)
     
     def data_to_chip_and_clear(self):
@@ -139,6 +161,7 @@ class Interface_PIN:
         time = self.__data_to_chip_times
         self.__data_to_chip = []
         self.__data_to_chip_times = []
+        self.__runs_to_chip.clear()
         return (data, time)
     
     def errors(self):
@@ -246,6 +269,25 @@ class Interface_PIN:
 
 
 
+    def new_run(self):
+        """new_run starts a new run, called by update_state of the uC_api when an experiment starts
+        """
+        self.__runs_from_chip.new_run(len(self.__data_from_chip))
+        self.__runs_to_chip.new_run(len(self.__data_to_chip))
+
+    def run_offsets(self, direction="from_chip"):
+        """run_offsets returns the run offset table of the recorded data, see run_index.py
+
+        :param direction: "from_chip" or "to_chip", defaults to "from_chip"
+        :type direction: string, optional
+        :return: the first run in the data and the first index of each run from there on
+        :rtype: (int, [int])
+        """
+        self.update()
+        if direction == "to_chip":
+            return self.__runs_to_chip.offsets()
+        return self.__runs_from_chip.offsets()
+
     def update(self):
         """ update the internal state representation of the pin object
         """
@@ -18,6 +18,7 @@
 
 from .header import ConfigMainHeader, Data32bitHeader, ConfigSubHeader
 from .packet import ConfigPacket, Data32bitPacket
+from .run_index import RunIndex
 import logging
 
 class Interface_SPI:
@@ -48,8 +49,10 @@ class Interface_SPI:
         self.__number_of_bytes_timestamp=0
         self.__data_from_chip = []
         self.__data_from_chip_times = []
+        self.__runs_from_chip = RunIndex()
         self.__data_to_chip = []
         self.__data_to_chip_times = []
+        self.__runs_to_chip = RunIndex()
         self.__api = api_object
         self.__errors = []
         if interface_id == 0:
@@ -114,7 +117,7 @@ class Interface_SPI:
         self.update()
         return (self.__order,self.__order_timestamp)
 
-    def number_of_bytes():
+    def number_of_bytes(self):
         """number_of_bytes the width of each send word, it can be 1,2,3 or 4 bytes
 
         :return: the wisth of each word and the timestamp in us
@@ -123,18 +126,23 @@ class Interface_SPI:
         self.update()
         return (self.__number_of_bytes,self.__number_of_bytes_timestamp)
 
-    def data_from_chip(self):
+    def data_from_chip(self, run=None):
         """data_from_chip will retun the data recoded by the uC send from the device under test (DUT)
 
         will retun 2 lists: one with the word recoded and one with the time when it was recorded, linked by index
 
+        :param run: only the data of this run, see run_offsets, defaults to None (all runs)
+        :type run: int, optional
         :return: the words from the DUT and the times of those words
         :rtype: ([int],[int])
         """
         self.update()
-        return (self.__data_from_chip, data_from_chip_times)
+        if run is None:
+            return (self.__data_from_chip, self.__data_from_chip_times)
+        start, end = self.__runs_from_chip.range(run, len(self.__data_from_chip))
+        return (self.__data_from_chip[start:end], self.__data_from_chip_times[start:end])
     
-    def data_to_chip(self):
+    def data_to_chip(self, run=None):
         """data_to_chip will retun the data send by the uC to the device under test (DUT)
 
         will retun 2 lists: one with the word send and one with the exact time when it was send, linked by index
@@ -142,11 +150,16 @@ class Interface_SPI:
         the time might differ slightly from the time you sheduled the send word, 
         as it is the time when it was send out and the uC can only send one word at a time
 
+        :param run: only the data of this run, see run_offsets, defaults to None (all runs)
+        :type run: int, optional
         :return: the words send to the DUT and the times of those words
         :rtype: ([int],[int])
         """
         self.update()
-        return (self.__data_to_chip, self.__data_to_chip_times)
+        if run is None:
+            return (self.__data_to_chip, self.__data_to_chip_times)
+        start, end = self.__runs_to_chip.range(run, len(self.__data_to_chip))
+        return (self.__data_to_chip[start:end], self.__data_to_chip_times[start:end])
 
     def data_from_chip_and_clear(self):
         self.update()
@@ -154,6 +167,7 @@ class Interface_SPI:
         time = self.__data_from_chip_times
         self.__data_from_chip = []
         self.__data_from_chip_times = []
+        self.__runs_from_chip.clear()
         return (data, time)
     
     def data_to_chip_and_clear(self):
@@ -162,6 +176,7 @@ class Interface_SPI:
         time = self.__data_to_chip_times
         self.__data_to_chip = []
         self.__data_to_chip_times = []
+        self.__runs_to_chip.clear()
         return (data, time)
     
     def errors(self):
@@ -270,6 +285,25 @@ class Interface_SPI:
         self.__api.send_packet(Data32bitPacket(header = self.__header[1], value = word, time = time))
 
 
+    def new_run(self):
+        """new_run starts a new run, called by update_state of the uC_api when an experiment starts
+        """
+        self.__runs_from_chip.new_run(len(self.__data_from_chip))
+        self.__runs_to_chip.new_run(len(self.__data_to_chip))
+
+    def run_offsets(self, direction="from_chip"):
+        """run_offsets returns the run offset table of the recorded data, see run_index.py
+
+        :param direction: "from_chip" or "to_chip", defaults to "from_chip"
+        :type direction: string, optional
+        :return: the first run in the data and the first index of each run from there on
+        :rtype: (int, [int])
+        """
+        self.update()
+        if direction == "to_chip":
+            return self.__runs_to_chip.offsets()
+        return self.__runs_from_chip.offsets()
+
     def update(self):
         """update updates the internal state form the uC
         """
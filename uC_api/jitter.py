@@ -0,0 +1,170 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from .header import DataI2CHeader
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+scheduled versus executed time of the timed packets
+
+the uC_api keeps every packet it writes to the uC in a compact table (the 9 encoded bytes, see uC_api.sent_packets) after record_sent_packets(),
+the interfaces record the confirmation of every executed word with the uC time it was executed (data_to_chip).
+jitter_report matches both per interface and reports how precisely the stimulus was executed:
+
+.. code-block:: python
+
+    uc.record_sent_packets()
+    uc.start_experiment()
+    ... timed send() calls or send_block ...
+    uc.stop_experiment(time=end)
+    report = uC_api.jitter.jitter_report(uc, run=uc.current_run())
+    print(report["async_to_chip0"]["latency"], report["async_to_chip0"]["dropped"])
+
+the timed packets of one interface are executed in the order they are send, so the n-th confirmation belongs to the n-th timed packet,
+words send instantly (time 0) are confirmed in between. in the usual case (no instant words, nothing dropped) the matching is one
+comparison of the arrays, else the confirmations are aligned by their words: a confirmation matching neither the next timed nor the
+next instant word skips the timed packets up to a following one with this word (dropped, eg. the input queue was full
+or the experiment was stopped before their time), or is counted as unexpected.
+
+the packets of a pin are matched by their value (the packets of all pins share the header), the packets of an I2C interface
+by (read, device_address, register_address) as the words confirmed by data_to_chip.
+
+the latency is the executed minus the requested time in us, at least up to one tick of the firmware (100us) is expected.
+the times are compared as recorded, so use it with uC_api(unwrap_time=False). needs numpy.
+"""
+
+_PACKET_DTYPE = None if np is None else np.dtype([("header", "u1"), ("time", "<u4"), ("value", "<u4")])
+_I2C_HEADERS = frozenset(int(header) for header in DataI2CHeader)
+
+
+def match_executions(timed_values, timed_times, instant_values, executed_values, executed_times, search=64):
+    """match_executions assigns the confirmations of one interface to the timed packets
+
+    :param timed_values: the words of the timed packets in the order they were send
+    :type timed_values: numpy.ndarray
+    :param timed_times: their requested times in us
+    :type timed_times: numpy.ndarray
+    :param instant_values: the words send instantly, in order
+    :type instant_values: numpy.ndarray
+    :param executed_values: the confirmed words in order
+    :type executed_values: numpy.ndarray
+    :param executed_times: the time of the confirmations in us
+    :type executed_times: numpy.ndarray
+    :param search: number of timed packets searched ahead for a confirmation, defaults to 64
+    :type search: int, optional
+    :return: the index of the confirmation of every timed packet (-1 for not executed) and the number of unexpected confirmations
+    :rtype: (numpy.ndarray, int)
+    """
+    count = len(timed_values)
+    if len(instant_values) == 0 and len(executed_values) == count and np.array_equal(timed_values, executed_values):
+        return (np.arange(count), 0)
+    matches = np.full(count, -1, dtype=np.int64)
+    timed_values, timed_times = timed_values.tolist(), timed_times.tolist()
+    instant_values = instant_values.tolist()
+    timed = 0
+    instant = 0
+    unexpected = 0
+    for index, (value, time) in enumerate(zip(executed_values.tolist(), executed_times.tolist())):
+        # a timed packet is never executed before its time
+        if timed < count and timed_values[timed] == value and timed_times[timed] <= time:
+            matches[timed] = index
+            timed += 1
+        elif instant < len(instant_values) and instant_values[instant] == value:
+            instant += 1
+        else:
+            for ahead in range(timed + 1, min(timed + 1 + search, count)):
+                if timed_values[ahead] == value and timed_times[ahead] <= time:
+                    matches[ahead] = index
+                    timed = ahead + 1
+                    break
+            else:
+                unexpected += 1
+    return (matches, unexpected)
+
+
+def _targets(api):
+    """(name, interface, header, pin id or None) of the interfaces that confirm executed words
+    """
+    targets = [("async_to_chip"+str(index), interface, int(interface.header()[1]), None) for index, interface in enumerate(api.async_to_chip)]
+    targets += [("spi"+str(index), interface, int(interface.header()[1]), None) for index, interface in enumerate(api.spi)]
+    targets += [("i2c"+str(index), interface, int(interface.header()[1]), None) for index, interface in enumerate(api.i2c)]
+    targets += [("pin"+str(index), interface, int(interface.header()[1]), index) for index, interface in enumerate(api.pin)]
+    return targets
+
+
+def jitter_report(api, run=None, tolerance=100, percentiles=(50, 90, 99, 99.9), search=64):
+    """jitter_report compares the requested with the executed times of the timed packets per interface
+
+    :param api: the uC (level 2)
+    :type api: uC_api
+    :param run: the run, defaults to None (all packets and data since they were cleared)
+    :type run: int, optional
+    :param tolerance: latency in us above which an execution counts as late, defaults to 100 (one tick of the firmware)
+    :type tolerance: int, optional
+    :param percentiles: the percentiles of the latency reported, defaults to (50, 90, 99, 99.9)
+    :type percentiles: tuple, optional
+    :param search: see match_executions, defaults to 64
+    :type search: int, optional
+    :return: dict of interface name (eg. async_to_chip0, spi1, i2c0, pin3, only interfaces with timed packets) to dicts with the keys
+        requested, executed, dropped, unexpected, late and latency (dict with mean, std, min, max and p<percentile> in us, None if nothing was executed),
+        and the key total with requested, executed, dropped, unexpected and late of all interfaces
+    :rtype: dict
+    """
+    if np is None:
+        raise ImportError("the jitter report needs numpy")
+    sent = np.frombuffer(api.sent_packets(run), dtype=_PACKET_DTYPE)
+    headers = sent["header"]
+    report = {}
+    total = {"requested": 0, "executed": 0, "dropped": 0, "unexpected": 0, "late": 0}
+    for name, interface, header, pin_id in _targets(api):
+        rows = headers == header
+        if not np.any(rows):
+            continue
+        values = sent["value"][rows].astype(np.int64)
+        times = sent["time"][rows].astype(np.int64)
+        executed_values, executed_times = interface.data_to_chip(run=run)
+        if pin_id is not None:
+            # pin packets carry <pin_id><value><0><0> in the value field
+            own = (values & 0xff) == pin_id
+            values, times = (values[own] >> 8) & 0xff, times[own]
+        elif header in _I2C_HEADERS:
+            # I2C packets carry <device_address << 1 | read><register_address><value ms><value ls>, matched on (read, device_address, register_address)
+            values = ((values & 0x1) << 16) | (((values & 0xff) >> 1) << 8) | ((values >> 8) & 0xff)
+            executed_values = [(read << 16) | (device_address << 8) | register_address for read, device_address, register_address, value in executed_values]
+        timed = times != 0
+        if not np.any(timed):
+            continue
+        executed_values = np.asarray(executed_values, dtype=np.int64)
+        executed_times = np.asarray(executed_times, dtype=np.int64)
+        matches, unexpected = match_executions(values[timed], times[timed], values[~timed], executed_values, executed_times, search)
+        done = matches >= 0
+        latency = executed_times[matches[done]] - times[timed][done]
+        result = {"requested": int(len(matches)), "executed": int(np.count_nonzero(done)), "dropped": int(np.count_nonzero(~done)),
+            "unexpected": unexpected, "late": int(np.count_nonzero(latency > tolerance)), "latency": None}
+        if len(latency) > 0:
+            result["latency"] = {"mean": float(np.mean(latency)), "std": float(np.std(latency)), "min": int(np.min(latency)), "max": int(np.max(latency))}
+            for percentile, value in zip(percentiles, np.percentile(latency, percentiles)):
+                result["latency"]["p"+str(percentile)] = float(value)
+        report[name] = result
+        for key in total:
+            total[key] += result[key]
+    report["total"] = total
+    return report
@@ -0,0 +1,213 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import threading
+
+"""
+round trip latency measurement between the host and the uC
+
+a LatencyProbe periodically sends an instant IN_READ_TIME request, the communication loop stamps the request when it is
+written and the reply when it is read (the uC answers instant requests in order, with the IN_READ_TIME header)
+and records the difference.
+the replies to the probe are not put into the read buffer.
+
+every sample is sorted into one of two histograms:
+ - idle: no other packets were exchanged with the uC between the request and the reply
+ - loaded: other packets were written or read in the meantime (including the same write or read)
+
+.. code-block:: python
+
+    probe = uc.latency_probe(interval=0.01)
+    ... run the experiment ...
+    print(probe.statistics())
+    probe.close()
+
+the histograms are log linear (HDR style): every power of two is split into 2**(significant_bits-1) buckets,
+so every recorded value is known with a relative error below 2**-(significant_bits-1).
+"""
+
+
+class LatencyHistogram:
+    """
+    LatencyHistogram counts values (ns) in log linear buckets with a bounded relative error
+    """
+    def __init__(self, significant_bits=7):
+        """__init__ creates an empty histogram
+
+        :param significant_bits: number of significant bits of the bucket values, defaults to 7 (relative error < 1.6%)
+        :type significant_bits: int, optional
+        """
+        self.__bits = significant_bits
+        self.__half = 1 << (significant_bits - 1)
+        self.__counts = [0] * ((64 + 1) * self.__half)
+        self.__count = 0
+        self.__sum = 0
+        self.__min = None
+        self.__max = None
+        self.__lock = threading.Lock()
+
+    def __index(self, value):
+        exponent = max(value.bit_length() - self.__bits, 0)
+        return exponent * self.__half + (value >> exponent)
+
+    def __value(self, index):
+        """the middle of the values counted in the bucket
+        """
+        exponent = max((index >> (self.__bits - 1)) - 1, 0)
+        lowest = (index - exponent * self.__half) << exponent
+        return lowest + ((1 << exponent) >> 1)
+
+    def record(self, value):
+        """record counts one value
+
+        :param value: the value in ns, negative values are counted as 0
+        :type value: int
+        """
+        value = max(int(value), 0)
+        with self.__lock:
+            self.__counts[self.__index(value)] += 1
+            self.__count += 1
+            self.__sum += value
+            self.__min = value if self.__min is None else min(self.__min, value)
+            self.__max = value if self.__max is None else max(self.__max, value)
+
+    def count(self):
+        """count returns the number of recorded values
+
+        :return: the number of values
+        :rtype: int
+        """
+        return self.__count
+
+    def percentiles(self, percentiles=(50, 90, 99, 99.9)):
+        """percentiles returns the values below which the given percentages of the recorded values are
+
+        :param percentiles: the percentages (0-100), defaults to (50, 90, 99, 99.9)
+        :type percentiles: [float], optional
+        :return: the value in ns for each percentage, None if nothing was recorded
+        :rtype: {float: int}
+        """
+        with self.__lock:
+            counts = list(self.__counts)
+            total = self.__count
+            lowest, highest = self.__min, self.__max
+        result = {}
+        for percentile in percentiles:
+            if total == 0:
+                result[percentile] = None
+                continue
+            # rank of the value, 1 based
+            rank = max(int(percentile / 100.0 * total + 0.5), 1)
+            seen = 0
+            for index, bucket_count in enumerate(counts):
+                seen += bucket_count
+                if seen >= rank:
+                    result[percentile] = min(max(self.__value(index), lowest), highest)
+                    break
+        return result
+
+    def statistics(self, percentiles=(50, 90, 99, 99.9)):
+        """statistics summarises the histogram
+
+        :param percentiles: the percentages reported, defaults to (50, 90, 99, 99.9)
+        :type percentiles: [float], optional
+        :return: dict with count, min, mean, max and p<percentage> (in s, None if nothing was recorded)
+        :rtype: dict
+        """
+        values = self.percentiles(percentiles)
+        with self.__lock:
+            result = {"count": self.__count,
+                "min": None if self.__min is None else self.__min * 1e-9,
+                "mean": None if self.__count == 0 else self.__sum / self.__count * 1e-9,
+                "max": None if self.__max is None else self.__max * 1e-9}
+        for percentile, value in values.items():
+            result["p" + str(percentile)] = None if value is None else value * 1e-9
+        return result
+
+    def reset(self):
+        """reset removes all recorded values
+        """
+        with self.__lock:
+            self.__counts = [0] * len(self.__counts)
+            self.__count = 0
+            self.__sum = 0
+            self.__min = None
+            self.__max = None
+
+
+class LatencyProbe:
+    """
+    LatencyProbe measures the round trip latency to the uC with periodic IN_READ_TIME requests, create it with uC_api.latency_probe
+    """
+    def __init__(self, api, interval=0.01, significant_bits=7):
+        """__init__ starts the probe thread
+
+        :param api: the uC_api to measure
+        :type api: uC_api
+        :param interval: time in s between two requests, defaults to 0.01
+        :type interval: float, optional
+        :param significant_bits: precision of the histograms, see LatencyHistogram, defaults to 7
+        :type significant_bits: int, optional
+        """
+        self.idle = LatencyHistogram(significant_bits)
+        self.loaded = LatencyHistogram(significant_bits)
+        self.__api = api
+        self.__interval = interval
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        while not self.__stop.wait(self.__interval):
+            if self.__api.is_closed():
+                break
+            self.__api._send_latency_probe()
+
+    def record(self, latency_ns, loaded):
+        """record stores one round trip (called by the communication loop)
+
+        :param latency_ns: time from writing the request to reading the reply in ns
+        :type latency_ns: int
+        :param loaded: True if other packets were exchanged in the meantime
+        :type loaded: bool
+        """
+        if loaded:
+            self.loaded.record(latency_ns)
+        else:
+            self.idle.record(latency_ns)
+
+    def statistics(self, percentiles=(50, 90, 99, 99.9)):
+        """statistics returns the summary of both histograms, see LatencyHistogram.statistics
+
+        :param percentiles: the percentages reported, defaults to (50, 90, 99, 99.9)
+        :type percentiles: [float], optional
+        :return: {"idle": {...}, "loaded": {...}}
+        :rtype: dict
+        """
+        return {"idle": self.idle.statistics(percentiles), "loaded": self.loaded.statistics(percentiles)}
+
+    def reset(self):
+        """reset clears both histograms
+        """
+        self.idle.reset()
+        self.loaded.reset()
+
+    def close(self):
+        """close stops sending requests, the replies still in flight are recorded
+        """
+        self.__stop.set()
+        self.__thread.join()
@@ -105,6 +105,12 @@ class Packet:
         else:
             logging.error("exec_time "+str(time)+" is not a valid unsigned integer of 4 bytes")
 
+    def set_unwrapped_time(self, time):
+        """setter method for the time of a received packet on the 64bit host timeline, see uC_api(unwrap_time=True)
+        @param time: (int) the unwrapped time, a packet with it can not be converted to a bytearray anymore
+        """
+        self._exec_time=time
+
     def to_bytearray(self):
         """ placeholder for converting the package to a bytearray
         @return: the packet as a bytearray
@@ -589,3 +595,37 @@ class ErrorPacket(Packet):
         value = unpacked[2],
         original_sub_header = unpacked[3])
 
+
+
+class EncodedPacket(Packet):
+    """
+    EncodedPacket is a packet that was already converted to its 9 bytes, eg. a compiled stimulus (see sweep.py),
+    sending it skips the conversion in the communication loop
+    """
+    def __init__(self, byte_array):
+        """ constructs the packet from the bytes of any packet type
+            @param byte_array: (bytes) the 9 bytes of the packet
+        """
+        self._bytes = bytes(byte_array)
+        self._header = self._bytes[0]
+        self._exec_time = int.from_bytes(self._bytes[1:5], "little")
+
+    @classmethod
+    def encode(cls, packet):
+        """ encode converts a packet of any type into an EncodedPacket
+            @param packet: (Packet) the packet
+            @return: the EncodedPacket
+        """
+        return cls(packet.to_bytearray())
+
+    def value(self):
+        """ getter method for the 32bit value of data 32bit packets
+            @return: the value of the packet
+        """
+        return int.from_bytes(self._bytes[5:9], "little")
+
+    def to_bytearray(self):
+        return self._bytes
+
+    def __str__(self):
+        return "[Packet]: encoded: header = "+ str(self._header) +", bytes = "+ self._bytes.hex() + ", at time = "+ str(self._exec_time) +"us"
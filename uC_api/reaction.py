@@ -0,0 +1,156 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import threading
+from collections import deque
+from .header import DataI2CHeader, PinHeader, from_chip_headers
+
+"""
+closed loop reactions evaluated directly in the communication loop
+
+normally a reaction to an event of the chip goes: communication thread -> read buffer -> update_state by the user
+-> send_packet -> write buffer -> communication thread. a ReactionRule skips all of this: it is checked by the
+communication loop on the raw packets right after they are read, and its response packets are encoded in advance
+and written in the same round, before the received packets are decoded.
+
+.. code-block:: python
+
+    # send a spike to async_to_chip0 whenever async_from_chip1 reports an address with bit 3 set
+    rule = uC_api.reaction.ReactionRule(uc.async_from_chip[1], mask=0x8, match=0x8,
+        response=[uC_api.packet.Data32bitPacket(uC_api.header.Data32bitHeader.IN_ASYNC_TO_CHIP0, value=5)])
+    uc.add_reaction_rule(rule)
+    ...
+    print(rule.statistics())
+
+the latency of a trigger is measured from reading the bytes from the connection until the response was written.
+
+the value compared with mask and match is the 32bit value of data packets, the data of I2C packets
+and the state of the pin (0 or 1) of pin packets.
+"""
+
+
+def _value_of(header):
+    """_value_of returns the function reading the value compared by a rule from a raw packet with the header
+    """
+    if header in [int(pin_header) for pin_header in PinHeader]:
+        return lambda byte_packet: byte_packet[6]
+    if header in [int(i2c_header) for i2c_header in DataI2CHeader]:
+        return lambda byte_packet: (byte_packet[7] << 8) | byte_packet[8]
+    return lambda byte_packet: int.from_bytes(byte_packet[5:9], "little")
+
+
+class ReactionRule:
+    """
+    ReactionRule is a condition on the packets from the uC (header and value & mask == match)
+    with the pre encoded packets that are send when it matches, see the description at the top of reaction.py
+    """
+    def __init__(self, header, response, mask=0xffffffff, match=None, max_triggers=None, latency_samples=4096):
+        """__init__ compiles the rule
+
+        :param header: the header of the packets to check, or an interface object (its headers of the data from the chip are used,
+            for a pin only its own packets match)
+        :type header: int or Interface_*
+        :param response: the instant packets (time 0) to send when the rule matches
+        :type response: [Packet]
+        :param mask: the bits of the 32bit value that are compared, defaults to 0xffffffff
+        :type mask: int, optional
+        :param match: the value the masked bits have to have, defaults to None (every packet with the header matches)
+        :type match: int, optional
+        :param max_triggers: the rule is disabled after this many matches, defaults to None (never)
+        :type max_triggers: int, optional
+        :param latency_samples: number of latest latencies kept for the statistics, defaults to 4096
+        :type latency_samples: int, optional
+        :raises ValueError: if the interface sends no data from the chip or a response packet is timed
+        """
+        self.pin_id = None
+        if hasattr(header, "header"):
+            headers = from_chip_headers(header)
+            if len(headers) == 0:
+                raise ValueError("reaction rules need an interface with data from the chip, "+str(header.header())+" has none")
+            if hasattr(header, "pin_id"):
+                self.pin_id = header.pin_id()
+        else:
+            headers = [header]
+        self.headers = [int(rule_header) for rule_header in headers]
+        self.__value = _value_of(self.headers[0])
+        for packet in response:
+            if packet.time() != 0:
+                raise ValueError("reaction responses have to be instant packets (time 0), got "+str(packet))
+        self.response = b"".join(packet.to_bytearray() for packet in response)
+        self.mask = mask
+        self.match = None if match is None else match & mask
+        self.max_triggers = max_triggers
+        self.triggers = 0
+        self.__latencies = deque(maxlen=latency_samples)
+        self.__lock = threading.Lock()
+
+    def matches(self, byte_packet):
+        """matches checks the rule against one raw packet (called by the communication loop)
+
+        :param byte_packet: 9 byte packet with one of the headers of this rule
+        :type byte_packet: bytes
+        :return: True if the response should be send
+        :rtype: bool
+        """
+        if self.max_triggers is not None and self.triggers >= self.max_triggers:
+            return False
+        if self.pin_id is not None and byte_packet[5] != self.pin_id:
+            return False
+        if self.match is not None and self.__value(byte_packet) & self.mask != self.match:
+            return False
+        self.triggers += 1
+        return True
+
+    def record_latency(self, latency_ns):
+        """record_latency stores the trigger to write latency of one match (called by the communication loop)
+
+        :param latency_ns: the latency in ns
+        :type latency_ns: int
+        """
+        with self.__lock:
+            self.__latencies.append(latency_ns)
+
+    def statistics(self):
+        """statistics returns the number of matches and the trigger to write latency of the latest matches
+
+        :return: dict with the keys triggers, samples, and latency_min, latency_median, latency_p99, latency_max (in s, None without samples)
+        :rtype: dict
+        """
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+        result = {"triggers": self.triggers, "samples": len(latencies)}
+        if len(latencies) == 0:
+            result.update({"latency_min": None, "latency_median": None, "latency_p99": None, "latency_max": None})
+        else:
+            result.update({"latency_min": latencies[0] * 1e-9, "latency_median": latencies[len(latencies) // 2] * 1e-9,
+                "latency_p99": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1e-9, "latency_max": latencies[-1] * 1e-9})
+        return result
+
+
+def compile_rules(rules):
+    """compile_rules groups the rules by header for the communication loop
+
+    :param rules: the rules
+    :type rules: [ReactionRule]
+    :return: dict of header to the rules with this header
+    :rtype: {int: [ReactionRule]}
+    """
+    table = {}
+    for rule in rules:
+        for header in rule.headers:
+            table.setdefault(header, []).append(rule)
+    return table
@@ -0,0 +1,202 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import struct
+import threading
+from collections import deque
+from time import monotonic_ns
+from .header import ErrorHeader, ALIGN_BYTEARRAY
+from .capture import CAPTURE_RECORD, CAPTURE_FROM_UC, _record_range
+from .uC import FIRMWARE_VERSION
+
+
+class CaptureReplay:
+    """
+    CaptureReplay plays the packets the uC sent in a capture file back as if they came from a serial connection.
+
+    it implements the part of the pyserial interface used by uC_api (in_waiting, read, write, close),
+    so a uC_api can be constructed on top of a capture to run analysis code written against the live API offline:
+
+    .. code-block:: python
+
+        replay = uC_api.replay.CaptureReplay(capture_files)
+        uc = uC_api.uC_api("replay", 2, connection=replay)
+        replay.replay_finished.wait()
+        uc.update_state()
+
+    the packets go through the same decoding, update_state and interface processing as live data.
+    they are either delivered as fast as possible, or paced by their recorded host timestamps.
+    packets written by the API are counted but not send anywhere, the alignment handshake is answered by the replay.
+    """
+    def __init__(self, paths, paced=False, speed=1.0, chunk_records=4096):
+        """__init__ creates the replay, the capture files are read in chunks while replaying
+
+        :param paths: capture file or list of capture files (eg. CaptureWriter.files()) played in order
+        :type paths: string or [string]
+        :param paced: if True the packets are delivered with the time difference they were recorded with, defaults to False (as fast as possible)
+        :type paced: bool, optional
+        :param speed: factor to speed up (>1) or slow down (<1) a paced replay, defaults to 1.0
+        :type speed: float, optional
+        :param chunk_records: number of records read from the file at once, defaults to 4096
+        :type chunk_records: int, optional
+        """
+        self.port = "replay"
+        self.timeout = None
+        self.__paths = [paths] if isinstance(paths, str) else list(paths)
+        self.__paced = paced
+        self.__speed = speed
+        self.__chunk_records = chunk_records
+        self.__records = self.__read_records()
+        # packets ready to be read by the API
+        self.__buffer = bytearray()
+        # packets read from the file but not yet due (paced replay)
+        self.__pending = deque()
+        self.__aligned = False
+        self.__end_of_capture = False
+        self.__start_host_time = None
+        self.__start_replay_time = None
+        self.__replayed = 0
+        self.__written = 0
+        self.__closed = False
+        self.replay_finished = threading.Event()
+
+    def __read_records(self):
+        """__read_records reads the packets from the uC out of the capture files in chunks
+
+        :return: generator of lists of (host time in ns, 9 byte packet)
+        :rtype: generator
+        """
+        for path in self.__paths:
+            with open(path, "rb") as capture_file:
+                version, first, last, trailer = _record_range(capture_file)
+                capture_file.seek(first)
+                remaining = (last - first) // CAPTURE_RECORD.size
+                while remaining > 0:
+                    count = min(remaining, self.__chunk_records)
+                    chunk = capture_file.read(count * CAPTURE_RECORD.size)
+                    remaining -= count
+                    yield [(host_time, packet) for direction, host_time, packet in CAPTURE_RECORD.iter_unpack(chunk) if direction == CAPTURE_FROM_UC]
+
+    def __next_chunk(self):
+        """__next_chunk moves the next chunk of records into the pending queue
+
+        :return: False if the capture is exhausted
+        :rtype: bool
+        """
+        try:
+            self.__pending.extend(next(self.__records))
+            return True
+        except StopIteration:
+            self.__end_of_capture = True
+            return False
+
+    def __fill(self):
+        """__fill moves all packets that are due from the pending queue into the read buffer
+        """
+        if not self.__aligned or self.__closed:
+            return
+        if len(self.__pending) == 0 and not self.__end_of_capture:
+            self.__next_chunk()
+        if len(self.__pending) > 0 and self.__start_host_time is None:
+            self.__start_host_time = self.__pending[0][0]
+            self.__start_replay_time = monotonic_ns()
+        if self.__paced:
+            due = self.__start_host_time + (monotonic_ns() - self.__start_replay_time) * self.__speed if self.__start_host_time is not None else 0
+            while len(self.__pending) > 0 and self.__pending[0][0] <= due:
+                self.__deliver(self.__pending.popleft()[1])
+                if len(self.__pending) == 0 and not self.__end_of_capture:
+                    self.__next_chunk()
+        else:
+            while len(self.__pending) > 0:
+                self.__deliver(self.__pending.popleft()[1])
+        if self.__end_of_capture and len(self.__pending) == 0 and len(self.__buffer) == 0:
+            if not self.replay_finished.is_set():
+                logging.info("replay: finished after "+str(self.__replayed)+" packets")
+            self.replay_finished.set()
+
+    def __deliver(self, packet):
+        """__deliver hands one recorded packet to the API, the recorded handshake responce is skipped as the replay answers it itself
+
+        :param packet: 9 byte packet
+        :type packet: bytes
+        """
+        if packet[0] == ErrorHeader.OUT_ALIGN_SUCCESS_VERSION:
+            return
+        self.__buffer += packet
+        self.__replayed += 1
+
+    @property
+    def in_waiting(self):
+        """number of bytes ready to be read, like pyserial
+        """
+        if len(self.__buffer) < 9:
+            self.__fill()
+        return len(self.__buffer)
+
+    def read(self, size=1):
+        """read returns up to size bytes of the replayed packets, like pyserial but never blocks
+
+        :param size: number of bytes to read, defaults to 1
+        :type size: int, optional
+        :return: the bytes
+        :rtype: bytes
+        """
+        if len(self.__buffer) < size:
+            self.__fill()
+        data = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return data
+
+    def write(self, data):
+        """write takes the bytes send by the API, they are only counted,
+        the first alignment request is answered with the firmware version the API expects
+
+        :param data: the bytes send
+        :type data: bytes
+        :return: number of bytes written
+        :rtype: int
+        """
+        if not self.__aligned and ALIGN_BYTEARRAY[9:] in bytes(data):
+            self.__aligned = True
+            self.__buffer += struct.pack("<BBIBBB", ErrorHeader.OUT_ALIGN_SUCCESS_VERSION,
+                FIRMWARE_VERSION.FIRMWARE_VERSION_MAJOR, FIRMWARE_VERSION.FIRMWARE_VERSION_PATCH, FIRMWARE_VERSION.FIRMWARE_VERSION_MINOR, 0, 0)
+        else:
+            self.__written += len(data) // 9
+        return len(data)
+
+    def close(self):
+        """close stops the replay
+        """
+        self.__closed = True
+        self.replay_finished.set()
+
+    def replayed(self):
+        """replayed returns the number of packets delivered to the API so far
+
+        :return: number of packets
+        :rtype: int
+        """
+        return self.__replayed
+
+    def written(self):
+        """written returns the number of packets the API tried to send to the (replayed) uC
+
+        :return: number of packets
+        :rtype: int
+        """
+        return self.__written
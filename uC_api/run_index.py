@@ -0,0 +1,75 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+run offsets of the recorded interface data
+
+every experiment start (IN_SET_TIME with a value of 1 or larger) begins a new run, the data recorded before the first start
+belongs to run 0, the same as in capture.CaptureReader.runs. update_state tells every interface when a run starts,
+the interface stores the length of its data lists at that moment in a RunIndex per direction,
+so the data of one run is a slice of the lists: data_from_chip(run=k), without scanning the times.
+"""
+
+
+class RunIndex:
+    """
+    RunIndex is the table of the first index of every run in the data lists of one interface direction
+    """
+    def __init__(self):
+        # the run the first offset belongs to, larger than 0 after the data was cleared
+        self.__first_run = 0
+        self.__offsets = [0]
+
+    def new_run(self, length):
+        """new_run starts the next run
+
+        :param length: the current length of the data lists
+        :type length: int
+        """
+        self.__offsets.append(length)
+
+    def clear(self):
+        """clear is called when the data lists are cleared, the run that is recorded continues at index 0
+        """
+        self.__first_run += len(self.__offsets) - 1
+        self.__offsets = [0]
+
+    def range(self, run, length):
+        """range returns the slice of the data lists that belongs to a run
+
+        :param run: the run
+        :type run: int
+        :param length: the current length of the data lists
+        :type length: int
+        :raises IndexError: if the run was cleared or has not started yet
+        :return: first and end index
+        :rtype: (int, int)
+        """
+        position = run - self.__first_run
+        if position < 0 or position >= len(self.__offsets):
+            raise IndexError("run "+str(run)+" is not in the recorded data (runs "+str(self.__first_run)+" to "+
+                str(self.__first_run + len(self.__offsets) - 1)+")")
+        end = self.__offsets[position + 1] if position + 1 < len(self.__offsets) else length
+        return (self.__offsets[position], end)
+
+    def offsets(self):
+        """offsets returns the offset table
+
+        :return: the run of the first offset and the first index of every run from there on
+        :rtype: (int, [int])
+        """
+        return (self.__first_run, list(self.__offsets))
@@ -0,0 +1,180 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import math
+from .packet import Packet
+from .stimulus import PacketBlock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+static analysis of a schedule of timed packets before it is run
+
+the firmware keeps the timed packets in the input ring buffer (INPUT_BUFFER_SIZE in uc_boards.h, one spot is never used)
+and executes them from a timer interrupt every EXEC_PRESISION (100us): every tick executes, in buffer order, all packets with
+an exec time up to the time of the tick, one after the other. the host writes the packets as fast as the link allows,
+but only as many as the buffer has free spots, it learns about freed spots with a delay (the free spots report of the uC).
+
+analyze_schedule simulates this for a schedule (the queued timed packets of a uC_api, a compiled stimulus block, packets or times)
+and predicts where it will not run as intended:
+
+.. code-block:: python
+
+    report = uC_api.schedule.analyze_schedule(uc.pending_timed_packets(), buffer_size=4096, throughput=1e6)
+    print(report["peak_occupancy"], report["skew"], report["crowded_ticks"], report["stall_points"])
+
+ - peak_occupancy: the most packets waiting in the buffer, if it reaches the buffer size the upload is limited by the buffer
+ - crowded_ticks: ticks with more packets than can be executed in one tick (exec_time each), they delay the following ticks
+ - skew: the time the packets are executed after their exec time, at least up to one tick, more if ticks are crowded or packets late
+ - stall_points: the packets that arrive at the uC after their exec time as the upload waited for free spots or the link,
+   the cause of the "Timing exec squewed" warning of the uC_api
+
+the throughput, refill latency and execution time per packet are properties of the setup, measure them for precise predictions.
+needs numpy.
+"""
+
+_PACKET_DTYPE = None if np is None else np.dtype([("header", "u1"), ("time", "<u4"), ("value", "<u4")])
+
+
+def schedule_times(source):
+    """schedule_times returns the exec times of the timed packets of a schedule, in the order they are written to the uC
+
+    :param source: a PacketBlock, encoded packets (bytes), a list of packets and blocks (eg. from uC_api.pending_timed_packets)
+        or the exec times (list or numpy array)
+    :type source: PacketBlock, bytes, [Packet or PacketBlock] or [int]
+    :return: the exec times in us
+    :rtype: numpy.ndarray
+    """
+    if np is None:
+        raise ImportError("the schedule analysis needs numpy")
+    if isinstance(source, PacketBlock):
+        source = source.data()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return np.frombuffer(source, dtype=_PACKET_DTYPE)["time"].astype(np.int64)
+    if isinstance(source, np.ndarray):
+        return source.astype(np.int64)
+    parts = []
+    times = []
+    for item in source:
+        if isinstance(item, PacketBlock):
+            if len(times) > 0:
+                parts.append(np.array(times, dtype=np.int64))
+                times = []
+            parts.append(np.frombuffer(item.data(), dtype=_PACKET_DTYPE)["time"].astype(np.int64))
+        elif isinstance(item, Packet):
+            # instant packets are not put in the buffer
+            if item.time() != 0:
+                times.append(item.time())
+        else:
+            times.append(int(item))
+    parts.append(np.array(times, dtype=np.int64))
+    return np.concatenate(parts)
+
+
+def analyze_schedule(source, buffer_size=4096, throughput=1000000, refill_latency=1000, exec_time=1.0, tick=100, upload_start=0,
+        max_points=10):
+    """analyze_schedule simulates the upload and execution of a schedule, see the description at the top of schedule.py
+
+    :param source: the schedule, see schedule_times
+    :type source: PacketBlock, bytes, [Packet or PacketBlock] or [int]
+    :param buffer_size: INPUT_BUFFER_SIZE of the firmware, defaults to 4096 (Teensy 4.1, 512 on the small boards)
+    :type buffer_size: int, optional
+    :param throughput: bytes per s the host writes to the uC, defaults to 1000000
+    :type throughput: float, optional
+    :param refill_latency: us from a packet being executed until the host writes to its spot, defaults to 1000
+    :type refill_latency: float, optional
+    :param exec_time: us the execution of one packet takes, defaults to 1.0
+    :type exec_time: float, optional
+    :param tick: the timer period of the firmware in us (EXEC_PRESISION), defaults to 100
+    :type tick: int, optional
+    :param upload_start: us after start_experiment the upload starts, negative if the packets are send before, defaults to 0
+    :type upload_start: float, optional
+    :param max_points: number of worst ticks and stall points listed, defaults to 10
+    :type max_points: int, optional
+    :return: dict with the keys packets, peak_occupancy, peak_occupancy_time, buffer_full_waits (packets that waited for a free spot),
+        skew (dict with mean, p50, p99, max in us), late (packets executed more than one tick after their exec time),
+        crowded_ticks (number), worst_ticks (list of (tick time, packets)), late_uploads (packets arriving after their exec time),
+        stall_points (list of dicts with index, time, arrival and packets of every group of late packets),
+        arrival_times and execution_times (numpy arrays, us)
+    :rtype: dict
+    """
+    times = schedule_times(source)
+    count = len(times)
+    capacity = buffer_size - 1
+    send_interval = 9e6 / throughput
+    # the simulation is sequential (every packet depends on the previous ones), plain lists are faster than numpy scalars here
+    time_list = times.tolist()
+    arrivals = [0.0] * count
+    executions = [0.0] * count
+    ticks = [0] * count
+    link = float(upload_start)
+    buffer_full_waits = 0
+    tick_time = -math.inf
+    tick_end = -math.inf
+    for index in range(count):
+        ready = link
+        if index >= capacity:
+            # the spot is free when the packet capacity places earlier was executed, the host learns it refill_latency later
+            free = executions[index - capacity] + refill_latency
+            if free > ready:
+                ready = free
+                buffer_full_waits += 1
+        link = ready + send_interval
+        arrivals[index] = link
+        due = max(time_list[index], link)
+        if due <= tick_time:
+            # the running tick continues with the next packet in the buffer
+            start = tick_end
+        else:
+            # the next tick after the packet is due and the running tick ended (a crowded tick skips the ticks it overlaps)
+            tick_time = max(math.ceil(max(due, tick_end) / tick), 1) * tick
+            start = tick_time
+        tick_end = start + exec_time
+        executions[index] = start
+        ticks[index] = tick_time
+    arrival_times = np.array(arrivals)
+    execution_times = np.array(executions)
+    report = {"packets": count, "buffer_full_waits": buffer_full_waits, "arrival_times": arrival_times, "execution_times": execution_times}
+    if count == 0:
+        report.update({"peak_occupancy": 0, "peak_occupancy_time": 0.0, "skew": {"mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0},
+            "late": 0, "crowded_ticks": 0, "worst_ticks": [], "late_uploads": 0, "stall_points": []})
+        return report
+    # packets in the buffer when a packet arrives: arrived ones minus executed ones (both times are sorted)
+    occupancy = np.arange(1, count + 1) - np.searchsorted(execution_times, arrival_times, side="right")
+    peak = int(np.argmax(occupancy))
+    skew = execution_times - times
+    tick_starts, tick_packets = np.unique(np.array(ticks), return_counts=True)
+    crowded = tick_packets * exec_time > tick
+    worst = np.argsort(-tick_packets, kind="stable")[:max_points]
+    late_upload = arrival_times > times
+    # groups of consecutive late packets
+    group_starts = np.flatnonzero(late_upload & ~np.concatenate(([False], late_upload[:-1])))
+    group_ends = np.flatnonzero(late_upload & ~np.concatenate((late_upload[1:], [False])))
+    report.update({
+        "peak_occupancy": int(occupancy[peak]), "peak_occupancy_time": float(arrival_times[peak]),
+        "skew": {"mean": float(np.mean(skew)), "p50": float(np.percentile(skew, 50)), "p99": float(np.percentile(skew, 99)),
+            "max": float(np.max(skew))},
+        "late": int(np.count_nonzero(skew > tick)),
+        "crowded_ticks": int(np.count_nonzero(crowded)),
+        "worst_ticks": [(int(tick_starts[index]), int(tick_packets[index])) for index in worst if crowded[index]],
+        "late_uploads": int(np.count_nonzero(late_upload)),
+        "stall_points": [{"index": int(start), "time": int(times[start]), "arrival": float(arrival_times[start]), "packets": int(end - start + 1)}
+            for start, end in zip(group_starts[:max_points], group_ends[:max_points])]})
+    return report
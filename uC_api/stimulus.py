@@ -0,0 +1,318 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from time import perf_counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+compiled stimulus blocks and their cache
+
+a stimulus (eg. a calibration spike train) is a list of words with the times they are send to one interface.
+compile_block encodes it directly into the 9 byte packets the uC expects (sorted by time), without creating Packet objects,
+uC_api.send_block hands the whole block to the communication loop, which writes it in slices as the uC input queue has space.
+
+the StimulusCache keeps compiled blocks by a hash (sha256) of their inputs, in memory and optionally in a directory on disk,
+both with least recently used eviction. a block found on disk is memory mapped, so a hit is one hash, one mmap and the upload:
+
+.. code-block:: python
+
+    cache = uC_api.stimulus.StimulusCache("~/.cache/uC_api_stimulus")
+    block = cache.compile(uc.async_to_chip[0], words, times)
+    uc.start_experiment()
+    uc.send_block(block)
+    print(cache.statistics())
+
+compile works with lists or numpy arrays (faster), only for interfaces with 32bit data packets (async to chip and SPI),
+other packets (eg. a configuration sequence) can be cached with get and a function that encodes them.
+"""
+
+
+class PacketBlock:
+    """
+    PacketBlock is a sequence of encoded 9 byte packets sorted by time, with a read position for the communication loop
+    """
+    def __init__(self, data):
+        """__init__ wraps the encoded packets
+
+        :param data: the packets, a multiple of 9 bytes
+        :type data: bytes, bytearray, mmap or memoryview
+        """
+        self.__data = memoryview(data).cast("B")
+        if len(self.__data) % 9 != 0:
+            raise ValueError("a packet block has to be a multiple of 9 bytes, got "+str(len(self.__data)))
+        self.__position = 0
+
+    def __len__(self):
+        """number of packets in the block"""
+        return len(self.__data) // 9
+
+    def data(self):
+        """data returns all encoded packets
+
+        :return: the packets
+        :rtype: memoryview
+        """
+        return self.__data
+
+    def remaining(self):
+        """remaining returns the number of packets not taken yet
+
+        :return: the number of packets
+        :rtype: int
+        """
+        return (len(self.__data) - self.__position) // 9
+
+    def take(self, count):
+        """take returns the next count packets (called by the communication loop)
+
+        :param count: the maximal number of packets
+        :type count: int
+        :return: the packets and the time of the last one
+        :rtype: (bytes, int)
+        """
+        end = min(self.__position + 9 * count, len(self.__data))
+        data = bytes(self.__data[self.__position:end])
+        self.__position = end
+        return (data, struct.unpack_from("<I", data, len(data) - 8)[0] if len(data) > 0 else 0)
+
+    def copy(self):
+        """copy returns a new block on the same data with its own read position, so a block can be send more than once
+
+        :return: the block
+        :rtype: PacketBlock
+        """
+        return PacketBlock(self.__data)
+
+
+def compile_block(header, values, times):
+    """compile_block encodes words with their times into a block of 32bit data packets, sorted by time (stable)
+
+    :param header: the header of the packets, or an interface object (its data header is used)
+    :type header: int or Interface_*
+    :param values: the 32bit words
+    :type values: [int] or numpy.ndarray
+    :param times: the times in us after the experiment start
+    :type times: [int] or numpy.ndarray
+    :return: the encoded packets
+    :rtype: bytes
+    """
+    if hasattr(header, "header"):
+        header = header.header()[1]
+    if len(values) != len(times):
+        raise ValueError("values and times need the same length, got "+str(len(values))+" and "+str(len(times)))
+    if np is not None:
+        times = np.asarray(times, dtype=np.uint32)
+        order = np.argsort(times, kind="stable")
+        packets = np.empty(len(times), dtype=np.dtype([("header", "u1"), ("time", "<u4"), ("value", "<u4")]))
+        packets["header"] = int(header)
+        packets["time"] = times[order]
+        packets["value"] = np.asarray(values, dtype=np.uint32)[order]
+        return packets.tobytes()
+    order = sorted(range(len(times)), key=lambda index: times[index])
+    packer = struct.Struct("<BII")
+    return b"".join(packer.pack(int(header), times[index], values[index]) for index in order)
+
+
+def stimulus_key(*parts):
+    """stimulus_key hashes the inputs of a compilation
+
+    :param parts: the inputs, bytes, strings, numbers, lists or numpy arrays
+    :type parts: object
+    :return: the hex sha256 of the inputs
+    :rtype: string
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if np is not None and isinstance(part, np.ndarray):
+            digest.update(str(part.dtype).encode() + np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, (bytes, bytearray, memoryview)):
+            digest.update(bytes(part))
+        else:
+            digest.update(repr(part).encode())
+        # separate the parts, so ("ab", "c") and ("a", "bc") differ
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class StimulusCache:
+    """
+    StimulusCache keeps compiled stimulus blocks in memory and on disk, see the description at the top of stimulus.py
+    """
+    def __init__(self, directory=None, memory_bytes=2**28, disk_bytes=2**32):
+        """__init__ creates the cache
+
+        :param directory: the directory for the blocks on disk, defaults to None (memory only)
+        :type directory: string, optional
+        :param memory_bytes: maximal size of the blocks kept in memory, defaults to 2**28 (256MB)
+        :type memory_bytes: int, optional
+        :param disk_bytes: maximal size of the blocks on disk, defaults to 2**32 (4GB)
+        :type disk_bytes: int, optional
+        """
+        self.__directory = None if directory is None else os.path.expanduser(directory)
+        if self.__directory is not None:
+            os.makedirs(self.__directory, exist_ok=True)
+        self.__memory_bytes = memory_bytes
+        self.__disk_bytes = disk_bytes
+        self.__memory = OrderedDict()
+        self.__memory_size = 0
+        self.__lock = threading.Lock()
+        self.__statistics = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "compile_time": 0.0}
+
+    def __path(self, key):
+        return os.path.join(self.__directory, key + ".bin")
+
+    def __keep(self, key, data):
+        """__keep puts a block in the memory cache and evicts the least recently used ones, lock has to be held
+        """
+        if len(data) > self.__memory_bytes:
+            return
+        self.__memory[key] = data
+        self.__memory_size += len(data)
+        while self.__memory_size > self.__memory_bytes:
+            evicted_key, evicted = self.__memory.popitem(last=False)
+            self.__memory_size -= len(evicted)
+
+    def __store(self, key, data):
+        """__store writes a block to the disk cache and removes the least recently used blocks above disk_bytes
+        """
+        path = self.__path(key)
+        temporary = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+        with open(temporary, "wb") as block_file:
+            block_file.write(data)
+        # atomic, so other processes never map a partial block
+        os.replace(temporary, path)
+        entries = []
+        for name in os.listdir(self.__directory):
+            if name.endswith(".bin"):
+                try:
+                    status = os.stat(os.path.join(self.__directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, name))
+        total = sum(size for used, size, name in entries)
+        for used, size, name in sorted(entries):
+            if total <= self.__disk_bytes:
+                break
+            if name == key + ".bin":
+                continue
+            try:
+                os.remove(os.path.join(self.__directory, name))
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def __load(self, key):
+        """__load maps a block from the disk cache, None if it is not there
+        """
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as block_file:
+                if os.fstat(block_file.fileno()).st_size == 0:
+                    return b""
+                data = mmap.mmap(block_file.fileno(), 0, access=mmap.ACCESS_READ)
+            # mark as recently used for the eviction
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def get(self, key, encode):
+        """get returns the block for a key, encode is only called if it is not cached
+
+        :param key: the key, eg. from stimulus_key
+        :type key: string
+        :param encode: function without arguments returning the encoded packets (bytes, a multiple of 9)
+        :type encode: callable
+        :return: the block, ready to send with uC_api.send_block
+        :rtype: PacketBlock
+        """
+        with self.__lock:
+            data = self.__memory.get(key)
+            if data is not None:
+                self.__memory.move_to_end(key)
+                self.__statistics["memory_hits"] += 1
+                return PacketBlock(data)
+        data = self.__load(key) if self.__directory is not None else None
+        if data is not None:
+            with self.__lock:
+                self.__statistics["disk_hits"] += 1
+                self.__keep(key, data)
+            return PacketBlock(data)
+        start = perf_counter()
+        data = bytes(encode())
+        compile_time = perf_counter() - start
+        if self.__directory is not None:
+            try:
+                self.__store(key, data)
+            except OSError as error:
+                logging.error("stimulus block could not be stored in the cache: "+repr(error))
+        with self.__lock:
+            self.__statistics["misses"] += 1
+            self.__statistics["compile_time"] += compile_time
+            self.__keep(key, data)
+        return PacketBlock(data)
+
+    def compile(self, header, values, times):
+        """compile returns the compiled block of words and times for an interface, see compile_block, from the cache if possible
+
+        :param header: the header of the packets, or an interface object (its data header is used)
+        :type header: int or Interface_*
+        :param values: the 32bit words
+        :type values: [int] or numpy.ndarray
+        :param times: the times in us after the experiment start
+        :type times: [int] or numpy.ndarray
+        :return: the block
+        :rtype: PacketBlock
+        """
+        if hasattr(header, "header"):
+            header = header.header()[1]
+        if np is not None:
+            key = stimulus_key("block", int(header), np.asarray(values, dtype=np.uint32), np.asarray(times, dtype=np.uint32))
+        else:
+            key = stimulus_key("block", int(header), [int(value) for value in values], [int(time) for time in times])
+        return self.get(key, lambda: compile_block(header, values, times))
+
+    def statistics(self):
+        """statistics returns the hits, misses, hit rate and the time spend compiling
+
+        :return: dict with the keys memory_hits, disk_hits, misses, hit_rate, compile_time (s), memory_bytes (in use)
+        :rtype: dict
+        """
+        with self.__lock:
+            result = dict(self.__statistics)
+            result["memory_bytes"] = self.__memory_size
+        lookups = result["memory_hits"] + result["disk_hits"] + result["misses"]
+        result["hit_rate"] = (result["memory_hits"] + result["disk_hits"]) / lookups if lookups > 0 else 0.0
+        return result
+
+    def clear(self):
+        """clear removes all blocks from the memory cache (the disk cache is kept)
+        """
+        with self.__lock:
+            self.__memory.clear()
+            self.__memory_size = 0
@@ -0,0 +1,461 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, monotonic
+from .packet import EncodedPacket
+from .stimulus import PacketBlock
+
+"""
+parameter sweeps: many experiments with different parameters run one after the other on a uC
+
+every point of the sweep is an Experiment: the parameters, an optional configure function (interface activation),
+the stimulus (packets timed relative to the experiment start, or a function creating them from the parameters) and the duration.
+the SweepRunner runs them in a pipeline:
+
+ - while experiment k runs on the uC, the stimulus of experiment k+1 is created and encoded (compile_stimulus) in a worker thread
+ - after experiment k, its data (data_from_chip(run=k) of all interfaces by default) is analysed by the analyze function in a worker,
+   while experiment k+1 already runs
+
+the experiment is started with start_experiment, the stimulus is send in one go with send_packets and the uC stops the experiment
+itself with a timed stop_experiment at the duration, so the length of an experiment is given by the uC clock.
+
+.. code-block:: python
+
+    def stimulus(params):
+        return [Data32bitPacket(Data32bitHeader.IN_ASYNC_TO_CHIP0, value=params["word"], time=t) for t in range(1000, 100000, params["period"])]
+
+    def analyze(params, data):
+        words, times = data["async_from_chip1"]
+        return len(words)
+
+    runner = uC_api.sweep.SweepRunner(uc, analyze=analyze)
+    results = runner.run([uC_api.sweep.Experiment({"word": w, "period": p}, stimulus, duration=100000) for w in range(16) for p in (100, 1000)])
+
+analyze runs in a thread by default, pass a concurrent.futures.ProcessPoolExecutor as analysis_executor for heavy analysis
+(analyze and its results have to be picklable then).
+
+with several identical boards the SweepScheduler runs the experiments on all of them in parallel:
+
+.. code-block:: python
+
+    boards = uC_api.connect_all(["/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2"])
+    scheduler = uC_api.sweep.SweepScheduler(list(boards.values()), analyze=analyze)
+    results = scheduler.run(experiments)
+"""
+
+
+class Experiment:
+    """
+    Experiment is one point of a sweep, see the description at the top of sweep.py
+    """
+    def __init__(self, params=None, stimulus=None, duration=1000000, configure=None, name=None):
+        """__init__ describes the experiment
+
+        :param params: the parameters, handed to stimulus, configure and analyze, defaults to None (empty dict)
+        :type params: dict, optional
+        :param stimulus: the packets to send, times in us after the experiment start, or a function returning them for the params, defaults to None (no stimulus)
+        :type stimulus: [Packet], PacketBlock or callable, optional
+        :param duration: uC time in us after the start at which the experiment is stopped, defaults to 1000000
+        :type duration: int, optional
+        :param configure: function called with the uC_api and the params before the experiment starts (eg. to activate interfaces), defaults to None
+        :type configure: callable, optional
+        :param name: name of the experiment for the results and the log, defaults to None (the params)
+        :type name: string, optional
+        """
+        self.params = {} if params is None else params
+        self.stimulus = stimulus
+        self.duration = duration
+        self.configure = configure
+        self.name = str(self.params) if name is None else name
+
+    def packets(self):
+        """packets returns the stimulus packets of the experiment
+
+        :return: the packets
+        :rtype: [Packet]
+        """
+        if self.stimulus is None:
+            return []
+        if callable(self.stimulus):
+            return self.stimulus(self.params)
+        return self.stimulus
+
+
+def compile_stimulus(packets):
+    """compile_stimulus sorts the packets by time (stable, instant packets first) and encodes them,
+    so sending them does not need any conversion anymore, a PacketBlock (eg. from a stimulus.StimulusCache) is already compiled
+
+    :param packets: the packets
+    :type packets: [Packet] or PacketBlock
+    :return: the encoded packets
+    :rtype: [EncodedPacket] or PacketBlock
+    """
+    if isinstance(packets, PacketBlock):
+        return packets
+    return [EncodedPacket.encode(packet) for packet in sorted(packets, key=lambda packet: packet.time())]
+
+
+def collect_all(api, run):
+    """collect_all is the default collect function of the SweepRunner, it returns the data from the chip of all interfaces in a run
+
+    :param api: the uC
+    :type api: uC_api
+    :param run: the run
+    :type run: int
+    :return: the data and times of every interface with data, by name (eg. async_from_chip1, pin3)
+    :rtype: {string: ([int], [int])}
+    """
+    data = {}
+    for name, interfaces in (("async_from_chip", api.async_from_chip), ("spi", api.spi), ("i2c", api.i2c), ("pin", api.pin)):
+        for index, interface in enumerate(interfaces):
+            values, times = interface.data_from_chip(run=run)
+            if len(values) > 0:
+                data[name + str(index)] = (values, times)
+    return data
+
+
+class SweepRunner:
+    """
+    SweepRunner runs experiments on a uC (level 2) in a pipeline, see the description at the top of sweep.py
+    """
+    def __init__(self, api, analyze=None, collect=collect_all, analysis_executor=None, clear=False, timeout=10.0):
+        """__init__ creates the runner
+
+        :param api: the uC, level 2
+        :type api: uC_api
+        :param analyze: function called with the params and the collected data of every experiment in a worker, its return value is the result, defaults to None
+        :type analyze: callable, optional
+        :param collect: function called with the uC_api and the run after every experiment, returns the data for analyze, defaults to collect_all
+        :type collect: callable, optional
+        :param analysis_executor: the executor for analyze, defaults to None (one worker thread)
+        :type analysis_executor: concurrent.futures.Executor, optional
+        :param clear: if True the recorded data of all interfaces is cleared after collecting it, so long sweeps do not fill the memory, defaults to False
+        :type clear: bool, optional
+        :param timeout: time in s an experiment may take longer than its duration before it counts as failed, defaults to 10.0
+        :type timeout: float, optional
+        """
+        self.__api = api
+        self.__analyze = analyze
+        self.__collect = collect
+        self.__analysis_executor = analysis_executor
+        self.__clear = clear
+        self.__timeout = timeout
+        self.__statistics = {"experiments": 0, "failed": 0, "wall_time": 0.0, "device_time": 0.0}
+
+    def run_experiment(self, experiment, stimulus=None):
+        """run_experiment runs one experiment on the uC and collects its data
+
+        :param experiment: the experiment
+        :type experiment: Experiment
+        :param stimulus: the compiled stimulus, defaults to None (compiled here)
+        :type stimulus: [EncodedPacket], optional
+        :raises TimeoutError: if the uC did not stop the experiment in time
+        :raises ConnectionError: if the connection to the uC is closed
+        :return: the run and the collected data
+        :rtype: (int, object)
+        """
+        api = self.__api
+        if stimulus is None:
+            stimulus = compile_stimulus(experiment.packets())
+        if api.is_closed():
+            raise ConnectionError("the connection to "+str(api.name())+" is closed")
+        if experiment.configure is not None:
+            experiment.configure(api, experiment.params)
+        states = len(api.experiment_state()[0])
+        api.start_experiment()
+        if isinstance(stimulus, PacketBlock):
+            api.send_block(stimulus)
+        else:
+            api.send_packets(stimulus)
+        api.stop_experiment(time=experiment.duration)
+        # wait for the uC to acknowledge the start and the timed stop
+        deadline = monotonic() + experiment.duration * 1e-6 + self.__timeout
+        while True:
+            api.update_state()
+            new_states = api.experiment_state()[0][states:]
+            if len(new_states) >= 2 and new_states[0] > 0 and new_states[-1] == 0:
+                break
+            if api.is_closed():
+                raise ConnectionError("the connection to "+str(api.name())+" was closed during "+experiment.name)
+            if monotonic() > deadline:
+                raise TimeoutError("the uC "+str(api.name())+" did not stop "+experiment.name+" in time")
+            sleep(0.001)
+        run = api.current_run()
+        data = self.__collect(api, run)
+        if self.__clear:
+            for interface in api.async_to_chip + api.async_from_chip + api.spi + api.i2c + api.pin:
+                interface.data_from_chip_and_clear()
+                interface.data_to_chip_and_clear()
+        return (run, data)
+
+    def run(self, experiments):
+        """run runs all experiments in order, pipelined with the stimulus preparation and the analysis
+
+        :param experiments: the experiments
+        :type experiments: [Experiment]
+        :return: for every experiment a dict with the keys experiment, run, data, result (of analyze), error (None or the error as string)
+        and time (s the experiment took on the host)
+        :rtype: [dict]
+        """
+        experiments = list(experiments)
+        results = []
+        analyses = []
+        start = monotonic()
+        prepare = ThreadPoolExecutor(1)
+        analysis = self.__analysis_executor if self.__analysis_executor is not None else ThreadPoolExecutor(1)
+        try:
+            next_stimulus = prepare.submit(compile_stimulus, experiments[0].packets()) if len(experiments) > 0 else None
+            for index, experiment in enumerate(experiments):
+                result = {"experiment": experiment, "run": None, "data": None, "result": None, "error": None, "time": None}
+                results.append(result)
+                try:
+                    stimulus = next_stimulus.result()
+                except Exception as error:
+                    stimulus = None
+                    result["error"] = repr(error)
+                if index + 1 < len(experiments):
+                    next_stimulus = prepare.submit(lambda following: compile_stimulus(following.packets()), experiments[index + 1])
+                if stimulus is None:
+                    logging.error("stimulus of "+experiment.name+" failed: "+result["error"])
+                    continue
+                experiment_start = monotonic()
+                try:
+                    result["run"], result["data"] = self.run_experiment(experiment, stimulus)
+                except Exception as error:
+                    logging.error("experiment "+experiment.name+" failed: "+repr(error))
+                    result["error"] = repr(error)
+                    if isinstance(error, ConnectionError):
+                        # the following experiments can not run either
+                        for following in experiments[index + 1:]:
+                            results.append({"experiment": following, "run": None, "data": None, "result": None, "error": repr(error), "time": None})
+                        break
+                    continue
+                finally:
+                    result["time"] = monotonic() - experiment_start
+                    self.__statistics["device_time"] += result["time"]
+                if self.__analyze is not None:
+                    analyses.append((result, analysis.submit(self.__analyze, experiment.params, result["data"])))
+            for result, future in analyses:
+                try:
+                    result["result"] = future.result()
+                except Exception as error:
+                    logging.error("analysis of "+result["experiment"].name+" failed: "+repr(error))
+                    result["error"] = repr(error)
+        finally:
+            prepare.shutdown(wait=False)
+            if self.__analysis_executor is None:
+                analysis.shutdown(wait=True)
+        self.__statistics["experiments"] += len(results)
+        self.__statistics["failed"] += sum(1 for result in results if result["error"] is not None)
+        self.__statistics["wall_time"] += monotonic() - start
+        return results
+
+    def statistics(self):
+        """statistics returns the number of experiments and failed experiments, the wall time of all sweeps
+        and the time spent running experiments on the uC (the rest is the preparation and analysis that did not overlap)
+
+        :return: dict with the keys experiments, failed, wall_time and device_time (s)
+        :rtype: dict
+        """
+        return dict(self.__statistics)
+
+
+class SweepScheduler:
+    """
+    SweepScheduler distributes experiments over a pool of identical boards (one uC_api each, level 2)
+
+    the experiments are dealt to one queue per board, every board runs the experiments of its queue and when it is empty
+    takes the last experiment from the longest queue of the other boards (work stealing), so all boards stay busy even if
+    the experiments take different times. an experiment that fails is retried on another board,
+    a board whose connection is closed (eg. the USB device was unplugged) stops and its queue is moved to the other boards.
+    every result carries the name of the board it ran on.
+    """
+    def __init__(self, apis, analyze=None, collect=collect_all, analysis_executor=None, clear=False, timeout=10.0, retries=1):
+        """__init__ creates the scheduler
+
+        :param apis: the boards
+        :type apis: [uC_api]
+        :param analyze: function called with the params and the collected data of every experiment in a worker, see SweepRunner, defaults to None
+        :type analyze: callable, optional
+        :param collect: function called with the uC_api and the run after every experiment, defaults to collect_all
+        :type collect: callable, optional
+        :param analysis_executor: the executor for analyze, defaults to None (one worker thread)
+        :type analysis_executor: concurrent.futures.Executor, optional
+        :param clear: if True the recorded data is cleared after collecting it, see SweepRunner, defaults to False
+        :type clear: bool, optional
+        :param timeout: time in s an experiment may take longer than its duration, defaults to 10.0
+        :type timeout: float, optional
+        :param retries: number of times a failed experiment is retried (on another board if possible), defaults to 1
+        :type retries: int, optional
+        """
+        self.__apis = list(apis)
+        self.__runners = [SweepRunner(api, collect=collect, clear=clear, timeout=timeout) for api in self.__apis]
+        self.__analyze = analyze
+        self.__analysis_executor = analysis_executor
+        self.__retries = retries
+        self.__condition = threading.Condition()
+        self.__queues = [deque() for api in self.__apis]
+        self.__alive = [True for api in self.__apis]
+        self.__remaining = 0
+        self.__statistics = {"wall_time": 0.0,
+            "boards": [{"name": api.name(), "experiments": 0, "failed": 0, "stolen": 0, "device_time": 0.0} for api in self.__apis]}
+
+    def __take(self, board):
+        """__take returns the next job for a board, from its own queue or stolen from the longest other queue,
+        None if all experiments are done or the board was stopped, waits while other boards might still hand back jobs
+        """
+        with self.__condition:
+            while True:
+                if not self.__alive[board] or self.__remaining == 0:
+                    return None
+                if len(self.__queues[board]) > 0:
+                    return self.__queues[board].popleft()
+                longest = max(range(len(self.__queues)), key=lambda other: len(self.__queues[other]))
+                if len(self.__queues[longest]) > 0:
+                    self.__statistics["boards"][board]["stolen"] += 1
+                    return self.__queues[longest].pop()
+                self.__condition.wait()
+
+    def __hand_back(self, board, job):
+        """__hand_back queues a failed job again, on the shortest queue of another board that is alive if there is one,
+        lock has to be held
+
+        :return: False if no board is left to run it
+        :rtype: bool
+        """
+        others = [other for other in range(len(self.__queues)) if self.__alive[other] and other != board]
+        if len(others) == 0:
+            if not self.__alive[board]:
+                return False
+            others = [board]
+        target = min(others, key=lambda other: len(self.__queues[other]))
+        self.__queues[target].append(job)
+        self.__condition.notify_all()
+        return True
+
+    def __finish(self, job, error=None):
+        """__finish marks a job as done, lock has to be held
+        """
+        job["result"]["error"] = error
+        self.__remaining -= 1
+        self.__condition.notify_all()
+
+    def __stop_board(self, board):
+        """__stop_board takes a board out of the pool and moves its queue to the other boards, lock has to be held
+        """
+        self.__alive[board] = False
+        queue = self.__queues[board]
+        self.__queues[board] = deque()
+        for job in queue:
+            if not self.__hand_back(board, job):
+                self.__finish(job, "no board left to run the experiment")
+        self.__condition.notify_all()
+
+    def __work(self, board, analysis, analyses):
+        """__work runs the experiments of one board until all are done
+        """
+        runner = self.__runners[board]
+        statistics = self.__statistics["boards"][board]
+        name = self.__apis[board].name()
+        while True:
+            job = self.__take(board)
+            if job is None:
+                return
+            result = job["result"]
+            result["attempts"] += 1
+            result["board"] = name
+            experiment_start = monotonic()
+            try:
+                result["run"], result["data"] = runner.run_experiment(job["experiment"])
+            except Exception as error:
+                logging.error("experiment "+job["experiment"].name+" failed on "+str(name)+": "+repr(error))
+                with self.__condition:
+                    statistics["failed"] += 1
+                    statistics["device_time"] += monotonic() - experiment_start
+                    retry = result["attempts"] <= self.__retries
+                    if not retry or not self.__hand_back(board, job):
+                        self.__finish(job, repr(error))
+                    if isinstance(error, ConnectionError) or self.__apis[board].is_closed():
+                        logging.error(str(name)+" is disconnected, its experiments are moved to the other boards")
+                        self.__stop_board(board)
+                        return
+                continue
+            result["time"] = monotonic() - experiment_start
+            with self.__condition:
+                statistics["experiments"] += 1
+                statistics["device_time"] += result["time"]
+                if self.__analyze is not None:
+                    analyses.append((result, analysis.submit(self.__analyze, job["experiment"].params, result["data"])))
+                self.__finish(job)
+
+    def run(self, experiments):
+        """run runs all experiments on the boards
+
+        :param experiments: the experiments
+        :type experiments: [Experiment]
+        :return: for every experiment (in the given order) a dict with the keys experiment, board (name of the uC), run, data,
+        result (of analyze), error (None or the last error as string), attempts and time (s the experiment took on the host)
+        :rtype: [dict]
+        """
+        experiments = list(experiments)
+        results = [{"experiment": experiment, "board": None, "run": None, "data": None, "result": None, "error": None,
+            "attempts": 0, "time": None} for experiment in experiments]
+        start = monotonic()
+        with self.__condition:
+            self.__alive = [not api.is_closed() for api in self.__apis]
+            self.__queues = [deque() for api in self.__apis]
+            self.__remaining = len(experiments)
+            boards = [board for board in range(len(self.__apis)) if self.__alive[board]]
+            for index, experiment in enumerate(experiments):
+                job = {"experiment": experiment, "result": results[index]}
+                if len(boards) == 0:
+                    self.__finish(job, "no board left to run the experiment")
+                else:
+                    self.__queues[boards[index % len(boards)]].append(job)
+        analysis = self.__analysis_executor if self.__analysis_executor is not None else ThreadPoolExecutor(1)
+        analyses = []
+        workers = [threading.Thread(target=self.__work, args=(board, analysis, analyses), daemon=True) for board in boards]
+        try:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            for result, future in analyses:
+                try:
+                    result["result"] = future.result()
+                except Exception as error:
+                    logging.error("analysis of "+result["experiment"].name+" failed: "+repr(error))
+                    result["error"] = repr(error)
+        finally:
+            if self.__analysis_executor is None:
+                analysis.shutdown(wait=True)
+        self.__statistics["wall_time"] += monotonic() - start
+        return results
+
+    def statistics(self):
+        """statistics returns the wall time of all runs and per board the number of experiments, failed attempts,
+        experiments taken from other queues (stolen) and the time spent running experiments
+
+        :return: dict with the keys wall_time (s) and boards (list of dicts with name, experiments, failed, stolen, device_time)
+        :rtype: dict
+        """
+        with self.__condition:
+            return {"wall_time": self.__statistics["wall_time"], "boards": [dict(board) for board in self.__statistics["boards"]]}
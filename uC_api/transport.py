@@ -0,0 +1,296 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import select
+import socket
+import threading
+from time import monotonic, perf_counter
+import serial
+
+"""
+transports carry the byte stream between uC_api and the uC
+
+every transport has the part of the pyserial interface the communication loop uses:
+in_waiting, read(size) (waits up to timeout, None is forever), write(data), close(), fileno() and the attributes port and timeout.
+the loop reads everything that is waiting at once and writes all packets of one round with one write (bulk semantics).
+
+ - SerialTransport: the uC on a (USB) serial port, via pyserial
+ - TcpTransport: a uC behind a serial to TCP bridge (eg. ser2net), path tcp://host:port
+ - PipeTransport: an in memory pipe, PipeTransport.pair() returns both ends, eg. for a simulated uC
+
+uC_api opens the transport given by its serial_port_path with open_transport, or takes an opened one as connection.
+"""
+
+
+class SerialTransport:
+    """
+    SerialTransport connects to the uC on a serial port using pyserial
+    """
+    def __init__(self, path):
+        """__init__ opens the serial port
+
+        :param path: the serial port
+        :type path: string
+        """
+        #its USB so the speed setting gets ignored and it runes at max speed
+        self.__serial = serial.Serial(path, 115200, timeout=None, write_timeout=0)
+        self.port = path
+
+    @property
+    def timeout(self):
+        return self.__serial.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.__serial.timeout = timeout
+
+    @property
+    def in_waiting(self):
+        return self.__serial.in_waiting
+
+    def read(self, size=1):
+        return self.__serial.read(size)
+
+    def write(self, data):
+        return self.__serial.write(data)
+
+    def fileno(self):
+        return self.__serial.fileno()
+
+    def close(self):
+        self.__serial.close()
+
+
+class _SocketTransport:
+    """common part of the transports using a socket, received bytes are buffered so in_waiting is exact
+    """
+    def __init__(self, sock, port):
+        self.port = port
+        self.timeout = None
+        self.__socket = sock
+        self.__buffer = bytearray()
+        self.__closed = False
+
+    def __receive(self, timeout):
+        """__receive moves the bytes available on the socket to the buffer, waiting up to timeout for the first bytes
+        """
+        if self.__closed:
+            return
+        readable, writable, failed = select.select([self.__socket], [], [], timeout)
+        if len(readable) > 0:
+            data = self.__socket.recv(2**16)
+            if len(data) == 0:
+                self.__closed = True
+                raise ConnectionError(str(self.port)+" was closed by the other side")
+            self.__buffer += data
+
+    @property
+    def in_waiting(self):
+        self.__receive(0)
+        return len(self.__buffer)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        if len(self.__buffer) < size:
+            self.__receive(0)
+        while len(self.__buffer) < size:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            self.__receive(remaining)
+        data = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return data
+
+    def write(self, data):
+        self.__socket.sendall(data)
+        return len(data)
+
+    def fileno(self):
+        return self.__socket.fileno()
+
+    def close(self):
+        self.__closed = True
+        self.__socket.close()
+
+
+class TcpTransport(_SocketTransport):
+    """
+    TcpTransport connects to a uC behind a serial to TCP bridge
+    """
+    def __init__(self, host, port, connect_timeout=5.0, sock=None):
+        """__init__ connects to the bridge
+
+        :param host: host name or address of the bridge
+        :type host: string
+        :param port: TCP port of the bridge
+        :type port: int
+        :param connect_timeout: time in s to wait for the connection, defaults to 5.0
+        :type connect_timeout: float, optional
+        :param sock: an already connected socket to use instead (eg. the accepted side of a server), defaults to None
+        :type sock: socket.socket, optional
+        """
+        if sock is None:
+            sock = socket.create_connection((host, port), timeout=connect_timeout)
+        sock.settimeout(None)
+        # the packets are small, send them right away
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().__init__(sock, "tcp://"+str(host)+":"+str(port))
+
+    @classmethod
+    def pair(cls):
+        """pair returns two TcpTransports connected over the loopback interface, eg. to benchmark or to connect a simulated uC
+
+        :return: both ends
+        :rtype: (TcpTransport, TcpTransport)
+        """
+        listener = socket.create_server(("127.0.0.1", 0))
+        host, port = listener.getsockname()
+        client = socket.create_connection((host, port))
+        server, address = listener.accept()
+        listener.close()
+        return (cls(host, port, sock=client), cls(host, port, sock=server))
+
+
+class PipeTransport:
+    """
+    PipeTransport is one end of an in memory pipe, create both ends with PipeTransport.pair()
+    """
+    def __init__(self, incoming, outgoing, port="pipe"):
+        self.port = port
+        self.timeout = None
+        self.__incoming = incoming
+        self.__outgoing = outgoing
+
+    @classmethod
+    def pair(cls, port="pipe"):
+        """pair creates an in memory pipe
+
+        :param port: name of the pipe, defaults to "pipe"
+        :type port: string, optional
+        :return: both ends, what is written to one end is read from the other
+        :rtype: (PipeTransport, PipeTransport)
+        """
+        a_to_b = _PipeBuffer()
+        b_to_a = _PipeBuffer()
+        return (cls(b_to_a, a_to_b, port), cls(a_to_b, b_to_a, port))
+
+    @property
+    def in_waiting(self):
+        return len(self.__incoming.data)
+
+    def read(self, size=1):
+        return self.__incoming.take(size, self.timeout)
+
+    def write(self, data):
+        self.__outgoing.put(data)
+        return len(data)
+
+    def fileno(self):
+        # no file descriptor, a DeviceManager polls the pipe
+        return None
+
+    def close(self):
+        self.__outgoing.close()
+        self.__incoming.close()
+
+
+class _PipeBuffer:
+    """one direction of a PipeTransport
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.__condition = threading.Condition()
+        self.__closed = False
+
+    def put(self, data):
+        with self.__condition:
+            self.data += data
+            self.__condition.notify_all()
+
+    def take(self, size, timeout):
+        with self.__condition:
+            self.__condition.wait_for(lambda: len(self.data) >= size or self.__closed, timeout)
+            data = bytes(self.data[:size])
+            del self.data[:size]
+            return data
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+
+def open_transport(path):
+    """open_transport opens the transport for a uC path: tcp://host:port for a TCP bridge, everything else is a serial port
+
+    :param path: the path of the uC
+    :type path: string
+    :return: the opened transport
+    :rtype: SerialTransport or TcpTransport
+    """
+    if path.startswith("tcp://"):
+        host, port = path[len("tcp://"):].rsplit(":", 1)
+        return TcpTransport(host, int(port))
+    return SerialTransport(path)
+
+
+def benchmark_transport(sender, receiver, packets=100000, block=64, latency_samples=1000):
+    """benchmark_transport measures the throughput and latency of a pair of connected transports with 9 byte packets
+
+    throughput: packets are written in blocks of block packets and read in bulk on the other side,
+    latency: one packet is send and the time until it has arrived is measured, latency_samples times
+
+    :param sender: the sending end
+    :type sender: transport
+    :param receiver: the receiving end
+    :type receiver: transport
+    :param packets: number of packets for the throughput measurement, defaults to 100000
+    :type packets: int, optional
+    :param block: packets per write, defaults to 64
+    :type block: int, optional
+    :param latency_samples: number of single packets for the latency measurement, defaults to 1000
+    :type latency_samples: int, optional
+    :return: dict with the keys packets_per_second, bytes_per_second, latency_median and latency_max (in s)
+    :rtype: {string: float}
+    """
+    data = bytes(9 * block)
+    received = [0]
+    def read_all(expected):
+        receiver.timeout = 5.0
+        while received[0] < expected:
+            chunk = receiver.read(max(min(receiver.in_waiting, expected - received[0]), 1))
+            if len(chunk) == 0:
+                break
+            received[0] += len(chunk)
+    reader = threading.Thread(target=read_all, args=(9 * block * (packets // block),))
+    start = perf_counter()
+    reader.start()
+    for i in range(packets // block):
+        sender.write(data)
+    reader.join()
+    duration = perf_counter() - start
+    latencies = []
+    receiver.timeout = 1.0
+    for i in range(latency_samples):
+        start = perf_counter()
+        sender.write(data[:9])
+        receiver.read(9)
+        latencies.append(perf_counter() - start)
+    latencies.sort()
+    return {"packets_per_second": received[0] / 9 / duration, "bytes_per_second": received[0] / duration,
+        "latency_median": latencies[len(latencies) // 2] if latencies else 0.0, "latency_max": latencies[-1] if latencies else 0.0}
@@ -23,11 +23,22 @@ import serial
 import serial.tools.list_ports
 from .packet import *
 from .header import *
-from time import sleep
+from time import sleep, monotonic, perf_counter_ns
 from .interface_pin import Interface_PIN
 from .interface_i2c import Interface_I2C
 from .interface_spi import Interface_SPI
 from .interface_async import Interface_Async
+from .capture import CaptureWriter, CAPTURE_FROM_UC, CAPTURE_TO_UC
+from .export import Exporter
+from .device_process import DeviceProcess
+from .transport import open_transport
+from .reaction import compile_rules
+from .latency import LatencyProbe
+from .clock import ClockModel, TimeUnwrapper
+from .stimulus import PacketBlock
+from .run_index import RunIndex
+from .acknowledge import AckTracker
+from collections import deque
 from queue import Queue
 
 class FIRMWARE_VERSION(enum.IntEnum):
@@ -38,6 +49,78 @@ class FIRMWARE_VERSION(enum.IntEnum):
     FIRMWARE_VERSION_MINOR = 9
     FIRMWARE_VERSION_PATCH = 2
 
+"""
+results of one round of the communication loop, see uC_api._io_step
+"""
+IO_CLOSED = -1
+IO_IDLE = 0
+IO_BUSY = 1
+
+"""
+maximal number of bytes written and read in one round of the communication loop
+"""
+_MAX_WRITE_BYTES = 9 * 256
+_MAX_READ_BYTES = 9 * 1024
+
+# the request send by a LatencyProbe, the communication loop recognizes it by identity and does not forward its reply
+_LATENCY_PROBE_PACKET = Data32bitPacket(Data32bitHeader.IN_READ_TIME)
+
+# data 32bit headers the communication loop does not handle itself, with _forward_raw_packets they are passed on without decoding
+_FORWARD_HEADERS = frozenset(int(header) for header in Data32bitHeader) - {int(Data32bitHeader.OUT_FREE_INSTRUCTION_SPOTS),
+    int(Data32bitHeader.IN_READ_TIME), int(Data32bitHeader.OUT_TIME), int(Data32bitHeader.IN_SET_TIME)}
+
+# time in us after which an IN_READ_TIME request (or its time for a timed one) is not expected to be answered anymore (the reply was lost)
+_TIME_REQUEST_TIMEOUT = 1000000
+
+"""
+serial port listing shared by uCs connecting at the same time, see _list_ports
+"""
+_port_list_lock = threading.Lock()
+_port_list = (0.0, [])
+
+def _list_ports(max_age=1.0):
+    """_list_ports lists the serial ports of the system, the list is reused for max_age seconds,
+    so connecting many uCs at once enumerates the ports only once
+
+    :param max_age: maximal age of the reused list in s, defaults to 1.0
+    :type max_age: float, optional
+    :return: the ports
+    :rtype: [serial.tools.list_ports_common.ListPortInfo]
+    """
+    global _port_list
+    with _port_list_lock:
+        if monotonic() - _port_list[0] > max_age:
+            _port_list = (monotonic(), serial.tools.list_ports.comports())
+        return _port_list[1]
+
+def connect_all(ports, api_level=2, timeout=10.0, **kwargs):
+    """connect_all connects to many uCs in parallel, the port listing, alignment and version check of all uCs run at the same time
+    and it returns as soon as every uC has answered or failed, or the timeout has passed
+
+    the time each uC needed to be ready is available with uC_api.connect_time
+
+    :param ports: the serial port paths
+    :type ports: [string]
+    :param api_level: the api level of all uCs, see uC_api, defaults to 2
+    :type api_level: int, optional
+    :param timeout: maximal time in s to wait for all uCs, defaults to 10.0
+    :type timeout: float, optional
+    :param kwargs: further parameters passed to every uC_api, eg. manager or process
+    :return: dict of port path to uC, uCs that are not connected have is_connected() == False
+    :rtype: {string: uC_api}
+    """
+    start = monotonic()
+    boards = {port: uC_api(port, api_level, **kwargs) for port in ports}
+    for port, board in boards.items():
+        board.wait_connected(max(timeout - (monotonic() - start), 0))
+    for port, board in boards.items():
+        if board.is_connected():
+            logging.info(f"{port} ready after {board.connect_time():.3f}s")
+        else:
+            logging.error(f"{port} not ready after {monotonic() - start:.3f}s")
+    return boards
+
+
 class uC_api:
     """ 
     the class uC_api exposes the full interface to the uC as an object, 
@@ -47,24 +130,49 @@ class uC_api:
     you might need to time.sleep(0.01) after the activation for the python object to update register the state change
 
     if you want to record data you need to use function start_experiment() to be abel to see the data send back
-    the maximum time of each experiment is 72min, please call stop experiment before that to start agian
+    the maximum time of each experiment is 72min, please call stop experiment before that to start agian,
+    with unwrap_time=True the received data is on one continuous 64bit timeline across wrap arounds and experiments
 
     after you are done call close_connection to sever the serial connection to the uC, 
     the recorded data in the python object remains and can be processed after
     """
-    def __init__(self, serial_port_path, api_level=2):
+    def __init__(self, serial_port_path, api_level=2, capture_path=None, connection=None, manager=None, process=False, unwrap_time=False):
         """__init__ creates the uC interface object and establishes the connection to the uC on the given port
 
-        :param serial_port_path: the path of your system to the serial port, eg. on linux it might be /dev/ttyAMC0 or higher, on mac /dev/tty.usbmodem<XXXXX> on windows <COM port>
+        :param serial_port_path: the path of your system to the serial port, eg. on linux it might be /dev/ttyAMC0 or higher, on mac /dev/tty.usbmodem<XXXXX> on windows <COM port>, or tcp://host:port for a uC behind a serial to TCP bridge, see transport.py
         :type serial_port_path: string 
         :param api_level: level 1 is that the api only espablishes the connection to the uC and the "infinite" write and read buffers, you need to construct the instruction packages your self, 
         level 2 it wraps the full representation of the uC interfaces in objects that are made availible as variables on this object, defaults to 2
         :type api_level: int, optional
+        :param capture_path: if given all raw packets exchanged with the uC, including the connection handshake, are captured to this file see start_capture, defaults to None
+        :type capture_path: string, optional
+        :param connection: an already opened connection object with the pyserial interface (in_waiting, read, write, close) that is used instead of opening serial_port_path,
+        eg. a replay.CaptureReplay to run the API offline on a recorded capture, serial_port_path is then only used as name, defaults to None
+        :type connection: object, optional
+        :param manager: a device_manager.DeviceManager that runs the communication of this uC on its shared I/O thread(s)
+        instead of a thread per uC, defaults to None (own thread)
+        :type manager: DeviceManager, optional
+        :param process: if True the communication with the uC (serial reading, alignment, decoding) runs in a child process,
+        the packets are exchanged via shared memory, see device_process.py, defaults to False
+        :type process: bool, optional
+        :param unwrap_time: if True the times of the received packets are unwrapped to one continuous 64bit timeline in us
+        (across the 32bit wrap around after 71.6 min and across start_experiment), so the data of long sessions of back to back
+        experiments is one recording, see clock.TimeUnwrapper, defaults to False (uC time since the last start_experiment)
+        :type unwrap_time: bool, optional
         """
         
         #print(f"Initializing for {serial_port_path}, API: {api_level}")
         self.__experiment_state = []
         self.__experiment_state_timestamp = []
+        self.__experiment_starts = 0
+        # every packet written to the uC (9 bytes each) with the runs, for jitter.jitter_report, see record_sent_packets
+        # the runs are counted also when not recording, so the run numbers match the interface data
+        self.__record_sent = False
+        self.__sent = bytearray()
+        self.__sent_runs = RunIndex()
+        self.__sent_started = False
+        self.__sent_lock = threading.Lock()
+        self.__ack_tracker = None
         self.__read_buffer = Queue()
         self.__write_buffer_timed = Queue()
         self.__write_buffer = Queue()
@@ -73,7 +181,42 @@ class uC_api:
         self.__name = "MCU_" + str(serial_port_path)
         
         self.__connection = None
+        self.__given_connection = connection
         self.__serial_port_path = serial_port_path
+        self.__capture = None
+        self.__capture_files = []
+        self.__manager = manager
+        # set when the communication with the uC has ended (closed or failed to connect)
+        self.__closed = threading.Event()
+        # set when the connection attempt has ended, successful or not
+        self.__ready = threading.Event()
+        self.__connected = False
+        self.__start_time = monotonic()
+        self.__connect_time = None
+        self.__connect_latency = None
+        self.__firmware_version = None
+        # functions called by the communication loop with the raw packets received in each round
+        self.__packet_listeners = []
+        # with _forward_raw_packets the raw packets for the read buffer are collected here instead (process=True child)
+        self.__forwarded = None
+        # reaction rules checked by the communication loop, by header, see reaction.py
+        self.__reaction_rules = []
+        self.__reaction_table = {}
+        # IN_READ_TIME requests written and not answered yet: (perf_counter_ns of the write, traffic before the write, is probe)
+        self.__time_requests = deque()
+        # uC times of the timed IN_READ_TIME requests written and not answered yet
+        self.__timed_time_requests = deque()
+        # number of packets written and read by the communication loop
+        self.__traffic = 0
+        self.__latency_probe = None
+        # uC time to host time, fed by the communication loop
+        self.__clock_model = ClockModel()
+        self.__time_unwrapper = TimeUnwrapper() if unwrap_time else None
+        self.__device_process = None
+        if process and (connection is not None or manager is not None):
+            raise ValueError("process=True can not be combined with a connection or a manager")
+        if capture_path is not None and not process:
+            self.start_capture(capture_path)
         
         if self.__api_level == 2:
             # create all the interface objects
@@ -90,14 +233,20 @@ class uC_api:
             for async_id in range(8):
                 self.async_from_chip.append(Interface_Async(self,async_id,"FROM_CHIP"))
                 
-        # setup the thread function that handles the communication
-        self.__communication_thread = threading.Thread(target=self.__thread_function)
+        if process:
+            # the communication is run by a child process, it captures the packets if requested
+            self.__communication_thread = None
+            self.__device_process = DeviceProcess(serial_port_path, capture_path=capture_path)
+        elif self.__manager is not None:
+            # the communication is run by the device manager
+            self.__communication_thread = None
+            self.__manager.add_device(self)
+        else:
+            # setup the thread function that handles the communication
+            self.__communication_thread = threading.Thread(target=self.__thread_function)
 
-        #start the thread
-        self.__communication_thread.start()
-        
-        # wait for 10 seconds for the uC to align
-        self.__connection = False
+            #start the thread
+            self.__communication_thread.start()
         
 
     def update_state(self):
@@ -106,6 +255,7 @@ class uC_api:
 
         level 2 only
         """
+        self.__receive_from_process()
         # process all availible messages from the uC one by one
         while not self.__read_buffer.empty():
             # get the next package
@@ -121,6 +271,12 @@ class uC_api:
             if header_for_sorting == Data32bitHeader.IN_SET_TIME:
                 self.__experiment_state.append(packet_to_process.value())
                 self.__experiment_state_timestamp.append(packet_to_process.time())
+                if packet_to_process.value() != 0:
+                    # every start after the first begins a new run, the data before the first start belongs to run 0
+                    if self.__experiment_starts > 0:
+                        for interface in self.async_to_chip + self.async_from_chip + self.spi + self.i2c + self.pin:
+                            interface.new_run()
+                    self.__experiment_starts += 1
                 no_match = False
                 continue
             # iterate though all interfaces and check if they signal they are responcible for that header
@@ -194,6 +350,18 @@ class uC_api:
         """
         return (self.__experiment_state, self.__experiment_state_timestamp)
 
+    def current_run(self):
+        """current_run returns the run the data is currently recorded in, every experiment start after the first begins a new run,
+        use it with data_from_chip(run=k) and data_to_chip(run=k) of the interfaces, see run_index.py
+
+        level 2 only
+
+        :return: the run
+        :rtype: int
+        """
+        self.update_state()
+        return max(self.__experiment_starts - 1, 0)
+
     def send_packet(self, packet_to_send):
         """send_packet send a packet to the uC via the "infinite" buffer
         needs a package object see package.py
@@ -204,14 +372,127 @@ class uC_api:
         # reset the time reference for the timed instructions
         if packet_to_send.header() == Data32bitHeader.IN_SET_TIME:
             self.__last_timed_packet = packet_to_send.value()
+        if self.__device_process is not None:
+            # the child process sorts the packets into its instant and timed buffer
+            if packet_to_send.time() != 0 and packet_to_send.time() < self.__last_timed_packet:
+                logging.warning("the instructions are not sorted in time - execution order will be inconsistent")
+            self.__device_process.send(packet_to_send)
         # put the packet in the buffer depending if it s instant or timed
-        if packet_to_send.time() == 0:
+        elif packet_to_send.time() == 0:
             self.__write_buffer.put(packet_to_send)
+            if self.__manager is not None:
+                self.__manager.wake(self)
         else:
             self.__write_buffer_timed.put(packet_to_send)
             # check if the timed instructions are sorted in time
             if packet_to_send.time() < self.__last_timed_packet:
                 logging.warning("the instructions are not sorted in time - execution order will be inconsistent")
+            if self.__manager is not None:
+                self.__manager.wake(self)
+
+    def send_packets(self, packets_to_send):
+        """send_packets sends many packets at once (eg. a stimulus compiled with sweep.compile_stimulus),
+        the timed packets have to be sorted in time
+
+        :param packets_to_send: the packets to be send
+        :type packets_to_send: [Packet], or any subclass
+        """
+        if self.__device_process is not None:
+            for packet_to_send in packets_to_send:
+                self.send_packet(packet_to_send)
+            return
+        for packet_to_send in packets_to_send:
+            if packet_to_send.header() == Data32bitHeader.IN_SET_TIME:
+                self.__last_timed_packet = packet_to_send.value()
+            if packet_to_send.time() == 0:
+                self.__write_buffer.put(packet_to_send)
+            else:
+                self.__write_buffer_timed.put(packet_to_send)
+        if self.__manager is not None:
+            self.__manager.wake(self)
+
+    def send_block(self, block):
+        """send_block sends a block of encoded packets sorted by time (see stimulus.py), the communication loop writes it in slices
+        as the uC input queue has space, without converting single packets.
+        all packets of the block are handled as timed packets, send the block after the instant packets it depends on (eg. start_experiment)
+
+        :param block: the block, eg. from stimulus.StimulusCache.compile
+        :type block: PacketBlock
+        :return: the queued copy of the block, its remaining() packets are not written to the uC yet (for flow control)
+        :rtype: PacketBlock
+        """
+        block = block.copy()
+        if self.__device_process is not None:
+            # the send ring of the child process does the flow control
+            data = block.data()
+            for offset in range(0, len(data), 9):
+                self.__device_process.send(EncodedPacket(data[offset:offset + 9]))
+            block.take(len(block))
+            return block
+        if len(block) == 0:
+            return block
+        self.__write_buffer_timed.put(block)
+        if self.__manager is not None:
+            self.__manager.wake(self)
+        return block
+
+    def pending_timed_packets(self):
+        """pending_timed_packets returns the timed packets and blocks not written to the uC yet (eg. for schedule.analyze_schedule),
+        in the order they will be written, not available with process=True
+
+        :return: the packets and blocks, the block the communication loop is writing first (with its remaining packets)
+        :rtype: [Packet or PacketBlock]
+        """
+        if self.__device_process is not None:
+            logging.error("pending_timed_packets is not available with process=True, the packets are buffered in the child process")
+            return []
+        with self.__write_buffer_timed.mutex:
+            pending = list(self.__write_buffer_timed.queue)
+        block = self.__timed_block
+        if block is not None:
+            # only the part of the block that was not written yet
+            remaining = block.remaining()
+            pending.insert(0, PacketBlock(block.data()[len(block.data()) - 9 * remaining:]))
+        return pending
+
+    def record_sent_packets(self, record=True):
+        """record_sent_packets starts (or stops) keeping every packet written to the uC for sent_packets, not available with process=True
+
+        :param record: if False the recording stops, the recorded packets are kept, defaults to True
+        :type record: bool, optional
+        """
+        if self.__device_process is not None:
+            logging.error("record_sent_packets is not available with process=True, the packets are written by the child process")
+            return
+        with self.__sent_lock:
+            self.__record_sent = record
+
+    def sent_packets(self, run=None):
+        """sent_packets returns the packets written to the uC (instant and timed, in the order they were written, see jitter.py)
+        while record_sent_packets was enabled, the runs are numbered as the runs of the interface data, not available with process=True
+
+        :param run: the run, defaults to None (all packets since the last clear_sent_packets)
+        :type run: int, optional
+        :raises IndexError: if the run was cleared or has not started yet
+        :return: the encoded packets, 9 bytes each
+        :rtype: bytes
+        """
+        if self.__device_process is not None:
+            logging.error("sent_packets is not available with process=True, the packets are written by the child process")
+            return b""
+        with self.__sent_lock:
+            if run is None:
+                return bytes(self.__sent)
+            first, end = self.__sent_runs.range(run, len(self.__sent) // 9)
+            with memoryview(self.__sent) as sent:
+                return bytes(sent[9 * first:9 * end])
+
+    def clear_sent_packets(self):
+        """clear_sent_packets removes the packets from the table of sent_packets, the run numbers are kept
+        """
+        with self.__sent_lock:
+            self.__sent_runs.clear()
+            self.__sent = bytearray()
 
     def read_packet(self):
         """read_packet returns one package from the uC via the "infinte" buffer
@@ -222,6 +503,12 @@ class uC_api:
         :rtype: Packet, or any subclass
         """
         if self.__api_level == 1:
+            if self.__device_process is not None:
+                # wait for the child process to deliver a packet
+                self.__receive_from_process()
+                while self.__read_buffer.empty():
+                    sleep(0.0001)
+                    self.__receive_from_process()
             read_packet = self.__read_buffer.get()
             self.__read_buffer.task_done()
             return read_packet
@@ -235,132 +522,501 @@ class uC_api:
         :rtype: boolean
         """
         if self.__api_level == 1:
+            self.__receive_from_process()
             return (self.__read_buffer.empty() == False)
         else:
             logging.error("reading raw packets is only availible in API level 1")
 
+    def start_capture(self, path, max_file_size=2**30, buffer_size=2**16):
+        """start_capture records every raw packet exchanged with the uC together with its direction and 
+        the host monotonic time to a binary capture file, see capture.py
+
+        the packets are recorded by the communication thread and written to disk in batches
+
+        :param path: the path of the capture file, files are numbered when rotating
+        :type path: string
+        :param max_file_size: the size in bytes after which a new capture file is started, defaults to 1GiB
+        :type max_file_size: int, optional
+        :param buffer_size: the number of bytes collected before writing them to disk, defaults to 64KiB
+        :type buffer_size: int, optional
+        :return: the capture writer
+        :rtype: CaptureWriter
+        """
+        if self.__device_process is not None:
+            logging.error("with process=True the capture can only be started with the capture_path parameter of uC_api")
+            return None
+        if self.__capture is not None:
+            self.stop_capture()
+        self.__capture = CaptureWriter(path, max_file_size=max_file_size, buffer_size=buffer_size)
+        return self.__capture
+
+    def stop_capture(self):
+        """stop_capture stops the capture and writes the remaining packets to disk,
+        close_connection stops a running capture too
+
+        :return: the paths of all capture files written by the last capture, empty if there was no capture
+        :rtype: [string]
+        """
+        capture = self.__capture
+        self.__capture = None
+        if capture is not None:
+            capture.close()
+            self.__capture_files = capture.files()
+        return self.__capture_files
+
+    def add_packet_listener(self, listener):
+        """add_packet_listener registers a function that is called by the communication loop with all raw packets
+        received from the uC in one round (bytes, a multiple of 9), before they are decoded.
+        it runs in the communication thread, so it has to return quickly (eg. only queue the packets), see event_server.py
+
+        not availible with process=True
+
+        :param listener: the function, called with one bytes argument
+        :type listener: callable
+        """
+        if self.__device_process is not None:
+            logging.error("packet listeners are not availible with process=True")
+            return
+        self.__packet_listeners = self.__packet_listeners + [listener]
+
+    def remove_packet_listener(self, listener):
+        """remove_packet_listener removes a function registered with add_packet_listener
+
+        :param listener: the function
+        :type listener: callable
+        """
+        # compared by equality, a bound method is a new object on every access
+        self.__packet_listeners = [other for other in self.__packet_listeners if other != listener]
+
+    def add_reaction_rule(self, rule):
+        """add_reaction_rule registers a ReactionRule, its response is written by the communication loop
+        in the same round the matching packet was read, see reaction.py
+
+        not availible with process=True
+
+        :param rule: the rule
+        :type rule: ReactionRule
+        """
+        if self.__device_process is not None:
+            logging.error("reaction rules are not availible with process=True")
+            return
+        self.__reaction_rules = self.__reaction_rules + [rule]
+        self.__reaction_table = compile_rules(self.__reaction_rules)
+
+    def remove_reaction_rule(self, rule):
+        """remove_reaction_rule removes a rule registered with add_reaction_rule
+
+        :param rule: the rule
+        :type rule: ReactionRule
+        """
+        self.__reaction_rules = [other for other in self.__reaction_rules if other is not rule]
+        self.__reaction_table = compile_rules(self.__reaction_rules)
+
+    def latency_probe(self, interval=0.01):
+        """latency_probe starts measuring the round trip latency to the uC with an IN_READ_TIME request every interval,
+        the latencies are sorted into an idle and a loaded histogram, see latency.py.
+        a running probe is replaced
+
+        not availible with process=True
+
+        :param interval: time in s between two requests, defaults to 0.01
+        :type interval: float, optional
+        :return: the probe, call statistics on it for the percentiles and close to stop it
+        :rtype: LatencyProbe
+        """
+        if self.__device_process is not None:
+            logging.error("the latency probe is not availible with process=True")
+            return None
+        if self.__latency_probe is not None:
+            self.__latency_probe.close()
+        self.__latency_probe = LatencyProbe(self, interval)
+        return self.__latency_probe
+
+    def clock_model(self, interval=0.1):
+        """clock_model returns the model of the uC clock in host time, see clock.py,
+        it is fed by the replies to IN_READ_TIME requests, if no latency probe is running one is started to send them
+
+        not availible with process=True
+
+        :param interval: time in s between two requests of the started latency probe, defaults to 0.1
+        :type interval: float, optional
+        :return: the clock model, use to_host on it to convert uC times
+        :rtype: ClockModel
+        """
+        if self.__device_process is not None:
+            logging.error("the clock model is not availible with process=True")
+            return None
+        if self.__latency_probe is None:
+            self.latency_probe(interval)
+        return self.__clock_model
+
+    def track_acknowledgements(self):
+        """track_acknowledgements starts (or returns the running) tracking of the packets send to the uC,
+        every packet is matched with its confirmation or error, see acknowledge.py, not availible with process=True
+
+        :return: the tracker, use summary and unacknowledged on it
+        :rtype: AckTracker
+        """
+        if self.__device_process is not None:
+            logging.error("the acknowledgement tracking is not availible with process=True")
+            return None
+        if self.__ack_tracker is None:
+            self.__ack_tracker = AckTracker(self.__name)
+        return self.__ack_tracker
+
+    def _send_latency_probe(self):
+        """_send_latency_probe sends one latency probe request, used by LatencyProbe
+        """
+        self.__write_buffer.put(_LATENCY_PROBE_PACKET)
+        if self.__manager is not None:
+            self.__manager.wake(self)
+
+    def exporter(self, path, file_format=None, clear=False):
+        """exporter creates an Exporter that writes the recorded data of all interfaces in chunks to a 
+        npz, hdf5 or parquet file, see export.py
+
+        call flush on it to write what was recorded so far (also while the experiment is running) and close at the end,
+        which adds the experiment state, errors and interface configuration
+
+        level 2 only
+
+        :param path: the path of the export file, the extension selects the format if file_format is not given
+        :type path: string
+        :param file_format: "npz", "hdf5" or "parquet", defaults to None
+        :type file_format: string, optional
+        :param clear: if True the exported data is removed from the interfaces after every flush to free the memory, defaults to False
+        :type clear: bool, optional
+        :return: the exporter
+        :rtype: Exporter
+        """
+        return Exporter(self, path, file_format=file_format, clear=clear)
+
+    def export(self, path, file_format=None):
+        """export writes all recorded data, the experiment state, errors and interface configuration to a 
+        npz, hdf5 or parquet file in one go, see exporter
+
+        level 2 only
+
+        :param path: the path of the export file, the extension selects the format if file_format is not given
+        :type path: string
+        :param file_format: "npz", "hdf5" or "parquet", defaults to None
+        :type file_format: string, optional
+        """
+        self.exporter(path, file_format=file_format).close()
+
     #def print_all_errors(self):
 
-    def close_connection(self):
+    def close_connection(self, reset=True):
         """close_connection closes the serial connection to the uC and blocks until this is done
         resets the uC too
+
+        :param reset: if False the uC is not reset, so its configuration and running experiment are kept (eg. for a daemon.DeviceDaemon), defaults to True
+        :type reset: bool, optional
         """
+        # the value of the close packet tells the worker thread if the uC is reset
+        close_packet = Data32bitPacket(Data32bitHeader.UC_CLOSE_CONNECTION, value = 1 if reset else 0)
+        if self.__device_process is not None:
+            if self.__closed.is_set():
+                return
+            # the child process closes the connection and ends, the packets it still delivers are kept
+            self.__device_process.send(close_packet)
+            if reset:
+                self.__experiment_state.append(-1)
+                self.__experiment_state_timestamp.append(-1)
+            host_time = perf_counter_ns()
+            for packet in self.__device_process.join():
+                self.__unwrap_time(packet, host_time)
+                self.__read_buffer.put(packet)
+            self.__closed.set()
+            return
+        if self.__latency_probe is not None:
+            self.__latency_probe.close()
         # place close connection packet in the write buffer, so the worker thread closes the connection and stop itself
-        self.__write_buffer.put(Data32bitPacket(Data32bitHeader.UC_CLOSE_CONNECTION))
+        self.__write_buffer.put(close_packet)
         # add reset to the experiment state history
-        self.__experiment_state.append(-1)
-        self.__experiment_state_timestamp.append(-1)
+        if reset:
+            self.__experiment_state.append(-1)
+            self.__experiment_state_timestamp.append(-1)
         # wait for the worker thread to close the connection
-        self.__communication_thread.join()
+        if self.__communication_thread is not None:
+            self.__communication_thread.join()
+        else:
+            self.__manager.wake(self)
+            self.__closed.wait()
+        self.stop_capture()
+        if self.__ack_tracker is not None:
+            self.__ack_tracker.close()
 
     def reset(self):
         """reset uC and hope the serial connection survives
         """
         # place reset packet in the write buffer, so the worker thread sends it
-        self.__write_buffer.put(Data32bitPacket(Data32bitHeader.IN_RESET))
+        if self.__device_process is not None:
+            self.__device_process.send(Data32bitPacket(Data32bitHeader.IN_RESET))
+        else:
+            self.__write_buffer.put(Data32bitPacket(Data32bitHeader.IN_RESET))
         # add reset to the experiment state history
         self.__experiment_state.append(-1)
         self.__experiment_state_timestamp.append(-1)
+        if self.__manager is not None:
+            self.__manager.wake(self)
+
+    def name(self):
+        """name returns the name of this uC, MCU_<serial port path>
+
+        :return: the name
+        :rtype: string
+        """
+        return self.__name
+
+    def wait_connected(self, timeout=None):
+        """wait_connected blocks until the uC has answered the connection request or connecting failed
+
+        :param timeout: maximal time to wait in s, defaults to None (no limit)
+        :type timeout: float, optional
+        :return: True if the uC is connected
+        :rtype: bool
+        """
+        if self.__device_process is not None:
+            return self.__device_process.wait_connected(timeout)
+        self.__ready.wait(timeout)
+        return self.__connected
 
-    def __check_first_connection(self,connection):
+    def is_connected(self):
+        """is_connected tells if the connection to the uC was established (it stays True after closing)
+
+        :return: True if connected
+        :rtype: bool
+        """
+        if self.__device_process is not None:
+            return self.__device_process.connect_time() is not None
+        return self.__connected
+
+    def connect_time(self):
+        """connect_time returns the time from creating this object until the uC was ready
+
+        :return: the time in s, None if not (yet) connected
+        :rtype: float
+        """
+        if self.__device_process is not None:
+            return self.__device_process.connect_time()
+        return self.__connect_time
+
+    def firmware_version(self):
+        """firmware_version returns the firmware version the uC reported while connecting
+
+        :return: major, minor and patch version, None if not connected
+        :rtype: (int, int, int)
+        """
+        return self.__firmware_version
+
+    def connect_latency(self):
+        """connect_latency returns the time the uC needed to answer the (last) alignment request while connecting
+
+        :return: the time in s, None if the uC did not answer (yet)
+        :rtype: float
+        """
+        return self.__connect_latency
+
+    def is_closed(self):
+        """is_closed tells if the communication with the uC has ended, because it was closed or it failed to connect
+
+        :return: True if closed
+        :rtype: bool
+        """
+        if self.__device_process is not None and not self.__closed.is_set():
+            return not self.__device_process.is_alive()
+        return self.__closed.is_set()
+
+    def __receive_from_process(self):
+        """__receive_from_process moves the packets delivered by the child process (process=True) into the read buffer
+        """
+        if self.__device_process is None or self.__closed.is_set():
+            return
+        host_time = perf_counter_ns()
+        for packet in self.__device_process.receive():
+            self.__unwrap_time(packet, host_time)
+            self.__read_buffer.put(packet)
+
+    def __unwrap_time(self, packet, host_time):
+        """__unwrap_time puts a received packet on the continuous 64bit timeline if unwrap_time is enabled
+
+        :param packet: the received packet
+        :type packet: Packet
+        :param host_time: perf_counter_ns when it was read
+        :type host_time: int
+        """
+        unwrapper = self.__time_unwrapper
+        if unwrapper is None or isinstance(packet, ErrorPacket):
+            return
+        if packet.header() == Data32bitHeader.IN_SET_TIME and packet.value() != 0:
+            packet.set_unwrapped_time(unwrapper.restart(packet.time(), host_time))
+        else:
+            packet.set_unwrapped_time(unwrapper.unwrap(packet.time(), host_time))
+
+    def __write(self, byte_array):
+        """__write writes raw bytes to the uC connection and records them if a capture is running
+
+        :param byte_array: the bytes to send
+        :type byte_array: bytes
+        """
+        self.__connection.write(byte_array)
+        capture = self.__capture
+        if capture is not None:
+            capture.record(CAPTURE_TO_UC, byte_array)
+
+    def __check_first_connection(self, connection, timeout=1.0):
         """__check_first_connection checks if the uC is responding and prints the firmware version
         if the firmware version does not match the API version it will print a warning
+
+        after sending the alignment request it blocks on the incomming bytes until the deadline and scans the stream
+        for the OUT_ALIGN_SUCCESS_VERSION packet, so it returns as soon as the uC answers, the time is available as connect_latency
+
+        :param connection: the opened connection
+        :type connection: transport.SerialTransport or compatible
+        :param timeout: time in s to wait for the uC, defaults to 1.0
+        :type timeout: float, optional
+        :return: True if the uC answered
+        :rtype: bool
         """
-        connection_state = False
         logging.info("send: opening connection - aligning commuication")
+        start = monotonic()
+        deadline = start + timeout
         # write 9 bytes to the uC to align the communication
-        connection.write(ALIGN_BYTEARRAY)
-        # wait for 10 seconds for the uC to align -> 1 second
-        for i in range(4): # was 40 with sleep (0.25)
-            # check if the uC has send a packet
-            if connection.in_waiting >= 9:
-                byte_packet = connection.read(size = 9)
-                # do reading alingnment
-                byte_packet = byte_packet.lstrip(b'\xff')
-                sleep(0.05)
-                # if the packet is not complete, try to recover by reading the rest of the packet
-                if len(byte_packet) < 9:
-                    if len(byte_packet) == 0:
-                        # no packet (was only alignment bytes), jump to next iteration
-                        continue
-                    elif connection.in_waiting < 9-len(byte_packet):
-                        # something went wrong, try again
-                        logging.error("partial packet received, but not enough bytes send by uC, trying to recover by realigning")
-                        connection.write(ALIGN_BYTEARRAY)
-                        continue
-                    # complete partial packet
-                    else:
-                        byte_packet = bytearray(byte_packet).extend(bytearray(connection.read(size = 9-len(byte_packet))))
-                # convert the byte packet to a packet object
-                read_packet = Packet.from_bytearray(byte_packet)
-                # check if the packet is the expected Success packet
-                if read_packet.header() == ErrorHeader.OUT_ALIGN_SUCCESS_VERSION:
-                    logging.info("uC is ready - firmware version: "+str(read_packet.original_header())+"."+str(read_packet.original_sub_header())+"."+str(read_packet.value()))
-                    # check if the firmware version matches the API version
-                    if read_packet.original_header() != FIRMWARE_VERSION.FIRMWARE_VERSION_MAJOR or read_packet.original_sub_header() != FIRMWARE_VERSION.FIRMWARE_VERSION_MINOR or read_packet.value() < FIRMWARE_VERSION.FIRMWARE_VERSION_PATCH:
-                        logging.warning("uC firmware version does not match the API version: \nfirmware version: "+str(read_packet.original_header())+"."+str(read_packet.original_sub_header())+"."+str(read_packet.value())+" \nAPI version: "+str(int(FIRMWARE_VERSION.FIRMWARE_VERSION_MAJOR))+"."+str(int(FIRMWARE_VERSION.FIRMWARE_VERSION_MINOR))+"."+str(int(FIRMWARE_VERSION.FIRMWARE_VERSION_PATCH)))
-                    # connection is established
-                    connection = True
-                    connection_state = True
-                    return True
-                else:
-                    logging.warning("unknown packet received, while connecting to uC for the first time: "+str(read_packet))
-            sleep(0.25)
-        # connection failed after 40 tries/10sec --> changed to 4 times, 1 second
-        if connection_state == False:
-            #logging.error("uC is not responding for 10 sec, wrong port?, no permission?")
-            logging.error("uC is not responding to first connection request")
-            return False
-
+        self.__write(ALIGN_BYTEARRAY)
+        received = bytearray()
+        original_timeout = getattr(connection, "timeout", None)
+        try:
+            while True:
+                # scan the received bytes for the success packet: header, major, patch (32bit), minor, 0, 0
+                position = -1
+                incomplete = -1
+                candidate = received.find(ErrorHeader.OUT_ALIGN_SUCCESS_VERSION)
+                while candidate >= 0:
+                    if candidate > len(received) - 9:
+                        incomplete = candidate
+                        break
+                    if received[candidate + 7:candidate + 9] == b"\x00\x00":
+                        position = candidate
+                        break
+                    candidate = received.find(ErrorHeader.OUT_ALIGN_SUCCESS_VERSION, candidate + 1)
+                if position >= 0:
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    logging.error("uC is not responding to first connection request")
+                    return False
+                # block until bytes arrive or the deadline has passed, never read past a possible success packet
+                # so the bytes the uC sends after it are left for the communication loop
+                connection.timeout = remaining
+                data = connection.read(size = incomplete + 9 - len(received) if incomplete >= 0 else 9)
+                if len(data) == 0:
+                    # connections that do not block (eg. a replay)
+                    sleep(0.0005)
+                received += data
+        finally:
+            connection.timeout = original_timeout
+        self.__connect_latency = monotonic() - start
+        byte_packet = bytes(received[position:position + 9])
+        # packets the uC sent before the alignment (eg. from a previous session) are skipped
+        skipped = received[:position].lstrip(b'\xff')
+        if len(skipped) > 0:
+            logging.warning("skipped "+str(len(skipped))+" bytes received before the uC was aligned")
+        capture = self.__capture
+        if capture is not None:
+            capture.record(CAPTURE_FROM_UC, byte_packet)
+        read_packet = Packet.from_bytearray(byte_packet)
+        self.__firmware_version = (read_packet.original_header(), read_packet.original_sub_header(), read_packet.value())
+        logging.info("uC is ready - firmware version: "+str(read_packet.original_header())+"."+str(read_packet.original_sub_header())+"."+str(read_packet.value())+
+            " after "+str(round(self.__connect_latency * 1000, 3))+"ms")
+        # check if the firmware version matches the API version
+        if read_packet.original_header() != FIRMWARE_VERSION.FIRMWARE_VERSION_MAJOR or read_packet.original_sub_header() != FIRMWARE_VERSION.FIRMWARE_VERSION_MINOR or read_packet.value() < FIRMWARE_VERSION.FIRMWARE_VERSION_PATCH:
+            logging.warning("uC firmware version does not match the API version: \nfirmware version: "+str(read_packet.original_header())+"."+str(read_packet.original_sub_header())+"."+str(read_packet.value())+" \nAPI version: "+str(int(FIRMWARE_VERSION.FIRMWARE_VERSION_MAJOR))+"."+str(int(FIRMWARE_VERSION.FIRMWARE_VERSION_MINOR))+"."+str(int(FIRMWARE_VERSION.FIRMWARE_VERSION_PATCH)))
+        return True
 
     def __thread_function(self):
         """__thread_function internal function managing the actual async communication with the uC in the background
         """
-        idle_write_pc = False
-        idle_write_uc = 0
-        idle_read = False
-        last_sent_time = 0
-        last_free_spots = 0
-        packet_send = 0
-        exec_running = 0
-        free_input_queue_spots_on_uc  = -1
-        request_free_input_queue_spots = False
-        
+        try:
+            if not self._open_connection():
+                return
+            # start communication
+            while True:
+                io_state = self._io_step()
+                if io_state == IO_CLOSED:
+                    return
+                # slow down the loop if there is nothing to do
+                if io_state == IO_IDLE:
+                    sleep(0.000003)
+        except Exception as error:
+            # end the communication, so close_connection and wait_connected do not block
+            logging.error("communication with "+self.__name+" failed: "+repr(error))
+            self._io_abort()
+
+    def _open_connection(self):
+        """_open_connection opens the serial port (with retries) and aligns the communication with the uC,
+        used by the communication thread or by a DeviceManager before calling _io_step
+
+        :return: True if the uC is connected
+        :rtype: bool
+        """
+        # state of the communication loop
+        self.__idle_write_pc = False
+        self.__idle_write_uc = 0
+        self.__idle_read = False
+        self.__last_sent_time = 0
+        self.__last_free_spots = 0
+        self.__packet_send = 0
+        self.__exec_running = 0
+        self.__free_input_queue_spots_on_uc = -1
+        self.__request_free_input_queue_spots = False
+        # bytes received from the uC that do not form a complete packet yet
+        self.__received = bytearray()
+        # the PacketBlock the timed packets are currently taken from, see send_block
+        self.__timed_block = None
+
         # Serial connection helper variables, to retry connecting if somehow there is already a connection live
         attempt = 1
         max_attempts = 5
         connected = False
         port_error = False   
         
-        # List all available serial ports
-        ports = serial.tools.list_ports.comports()
+        if self.__given_connection is not None:
+            # the connection was opened by the caller (e.g. a capture replay), only align the communication
+            logging.info(f"Using given connection for {self.__serial_port_path}, API: {self.__api_level}")
+            self.__connection = self.__given_connection
+            attempt = 0
+            connected = self.__check_first_connection(self.__connection)
+        else:
+            # List all available serial ports
+            ports = _list_ports()
         
-        # Check if the ports are busy
-        for port in ports:   
-            if self.__serial_port_path == port.device: 
-                if "USB Serial Device" in port.description:    
-                    logging.info(f"{self.__serial_port_path} is listed.")    
-                else:     
-                    logging.info(f"{self.__serial_port_path} is busy.")
-                    port_error = True         
+            # Check if the ports are busy
+            for port in ports:   
+                if self.__serial_port_path == port.device: 
+                    if "USB Serial Device" in port.description:    
+                        logging.info(f"{self.__serial_port_path} is listed.")    
+                    else:     
+                        logging.info(f"{self.__serial_port_path} is busy.")
+                        port_error = True         
             
-        logging.info(f"Opening serial {self.__serial_port_path}, API: {self.__api_level}")
-        for attempt in range(max_attempts + 1):                    
-            if not connected: # no connection has been established yet                 
-                if not port_error:  # port is busy or not connected
-                    self.__connection = serial.Serial(self.__serial_port_path, 115200, timeout= None, write_timeout=0) #its USB so the speed setting gets ignored and it runes at max speed
+            logging.info(f"Opening serial {self.__serial_port_path}, API: {self.__api_level}")
+            for attempt in range(max_attempts + 1):                    
+                if not connected: # no connection has been established yet                 
+                    if not port_error:  # port is busy or not connected
+                        self.__connection = open_transport(self.__serial_port_path)
                 
-                # init communication by forcing the uC to align
-                if not self.__check_first_connection(self.__connection):
-                    #print(f"Try[{attempt + 1}] Port: {self.__connection.port}, Was not the first connection, closing and retrying")
-                    logging.warning(f"Try[{attempt + 1}] Port: {self.__connection.port}, Was not the first connection, closing and retrying")
-                    self.__connection.close()     
-                    #return
+                    # init communication by forcing the uC to align
+                    if not self.__check_first_connection(self.__connection):
+                        #print(f"Try[{attempt + 1}] Port: {self.__connection.port}, Was not the first connection, closing and retrying")
+                        logging.warning(f"Try[{attempt + 1}] Port: {self.__connection.port}, Was not the first connection, closing and retrying")
+                        self.__connection.close()     
+                        #return
+                    else:
+                        port_error = False
+                        connected = True
                 else:
-                    port_error = False
-                    connected = True
-            else:
-                break
+                    break
         
         # throw an error message if it failed to connected after x amount of times
         if attempt >= max_attempts:
@@ -369,133 +1025,372 @@ class uC_api:
         # only start the communication if connected and no port errors        
         if connected and not port_error:           
             logging.info(f"Connected to {self.__serial_port_path}!")
-            # start communication
-            while True:
-                # check if there is something to send
-                if not self.__write_buffer_timed.empty() or not self.__write_buffer.empty():
-                    # set loop slowdown condition flags to false
-                    idle_write_pc = False
-                    # first write the instant packets
-                    if not self.__write_buffer.empty():
-                        data_packet = self.__write_buffer.get()
-                        # check and close the connection if requested by API
-                        if data_packet.header() == Data32bitHeader.UC_CLOSE_CONNECTION:
-                            self.__connection.write(Data32bitPacket(Data32bitHeader.IN_RESET).to_bytearray())
-                            self.__connection.close()
-                            return
-                        # else send the packet
-                        self.__connection.write(data_packet.to_bytearray())
-                        logging.debug("send instant: "+str(data_packet))
-                        self.__write_buffer.task_done()
-                    # then write the timed packets
-                    else:
-                        # check if there is space in the uC input queue
-                        if free_input_queue_spots_on_uc  > 0 :
-                            # send the packet and decrease the free input queue spots reference in the API
-                            data_packet = self.__write_buffer_timed.get()
-                            free_input_queue_spots_on_uc  -= 1
-                            self.__connection.write(data_packet.to_bytearray())
-                            last_sent_time = data_packet.time()
-                            packet_send += 1
-                            logging.debug("send timed: "+str(data_packet))
+            self.__connect_time = monotonic() - self.__start_time
+            self.__connected = True
+            self.__ready.set()
+            return True
+        self.__closed.set()
+        self.__ready.set()
+        return False
+
+    def _io_fileno(self):
+        """_io_fileno returns the file descriptor of the connection to wait on for incomming data, if the connection has one
+
+        :return: the file descriptor or None
+        :rtype: int
+        """
+        try:
+            return self.__connection.fileno()
+        except Exception:
+            return None
+
+    def _forward_raw_packets(self):
+        """_forward_raw_packets makes the communication loop collect the 9 bytes of the packets instead of putting
+        the packet objects into the read buffer, used by the child process of process=True, see device_process.py.
+        the data 32bit packets the loop does not handle itself are not decoded at all
+        """
+        self.__forwarded = []
+
+    def _take_raw_packets(self):
+        """_take_raw_packets returns the packets collected since the last call, called from the thread running _io_step
+
+        :return: the packets as send by the uC, a multiple of 9 bytes
+        :rtype: bytes
+        """
+        forwarded = self.__forwarded
+        if len(forwarded) == 0:
+            return b""
+        self.__forwarded = []
+        return b"".join(forwarded)
+
+    def _io_abort(self):
+        """_io_abort ends the communication after an unrecoverable error in _open_connection or _io_step,
+        so close_connection and wait_connected do not block
+        """
+        try:
+            self.__connection.close()
+        except Exception:
+            pass
+        self.__closed.set()
+        self.__ready.set()
+
+    def __react(self, reaction_table, packets, read_time):
+        """__react checks the reaction rules on the packets of this round and writes the responses of all matches with one write
+
+        :param reaction_table: the rules by header from compile_rules
+        :type reaction_table: {int: [ReactionRule]}
+        :param packets: the raw packets
+        :type packets: [bytes]
+        :param read_time: perf_counter_ns() after the packets were read
+        :type read_time: int
+        """
+        responses = bytearray()
+        triggered = []
+        for byte_packet in packets:
+            rules = reaction_table.get(byte_packet[0])
+            if rules is None:
+                continue
+            for rule in rules:
+                if rule.matches(byte_packet):
+                    responses += rule.response
+                    triggered.append(rule)
+        if len(triggered) > 0:
+            self.__write(bytes(responses))
+            self.__record_sent_packets(responses)
+            if self.__ack_tracker is not None:
+                self.__ack_tracker.sent(responses)
+            latency = perf_counter_ns() - read_time
+            for rule in triggered:
+                rule.record_latency(latency)
+
+    def __time_request(self, uc_time, read_time):
+        """__time_request takes the instant IN_READ_TIME request a time reply answers,
+        the reply carries the IN_READ_TIME header, the experiment time in its time and the raw micros() of the uC in its value,
+        replies to timed requests (send when their time has come) are not matched, requests older than _TIME_REQUEST_TIMEOUT are dropped
+
+        :param uc_time: the uC time of the reply (its time field)
+        :type uc_time: int
+        :param read_time: perf_counter_ns() after the reply was read
+        :type read_time: int
+        :return: (perf_counter_ns of the write, traffic before the write, is probe) of the request, None for the reply of a timed request
+        :rtype: (int, int, bool)
+        """
+        timed = self.__timed_time_requests
+        while len(timed) > 0 and uc_time - timed[0] > _TIME_REQUEST_TIMEOUT:
+            # the reply was lost
+            timed.popleft()
+        if len(timed) > 0 and timed[0] <= uc_time:
+            timed.popleft()
+            return None
+        requests = self.__time_requests
+        while len(requests) > 0 and read_time - requests[0][0] > 1000 * _TIME_REQUEST_TIMEOUT:
+            # the reply was lost
+            requests.popleft()
+        return requests.popleft() if len(requests) > 0 else None
+
+    def __sent_run_boundary(self, packet, end, boundaries):
+        """__sent_run_boundary notes the start of the next run of the sent packets when a stop after a start is written,
+        the packets written after the stop are executed in the next experiment
+
+        :param packet: the IN_SET_TIME packet
+        :type packet: Packet
+        :param end: the bytes to send in this round up to and with the packet
+        :type end: int
+        :param boundaries: the run boundaries of this round, see __record_sent_packets
+        :type boundaries: [int]
+        """
+        if packet.value() != 0:
+            self.__sent_started = True
+        elif self.__sent_started:
+            self.__sent_started = False
+            boundaries.append(end)
+
+    def __record_sent_packets(self, data, boundaries=()):
+        """__record_sent_packets adds the written bytes to the table of sent_packets if recording and starts the runs
+
+        :param data: the written packets
+        :type data: bytes
+        :param boundaries: the end of the stop packets in data that start a run, see __sent_run_boundary, defaults to ()
+        :type boundaries: [int], optional
+        """
+        with self.__sent_lock:
+            for end in boundaries:
+                self.__sent_runs.new_run((len(self.__sent) + (end if self.__record_sent else 0)) // 9)
+            if self.__record_sent:
+                self.__sent += data
+
+    def _io_step(self):
+        """_io_step does one round of the communication with the uC: writes all waiting instant packets
+        (or the timed packets that fit into the uC input queue) with one write and processes all packets that have arrived,
+        used by the communication thread or by a DeviceManager after _open_connection
+
+        :return: IO_BUSY if there was something to do, IO_IDLE if not, IO_CLOSED if the connection was closed
+        :rtype: int
+        """
+        # check if there is something to send
+        if not self.__write_buffer_timed.empty() or not self.__write_buffer.empty() or self.__timed_block is not None:
+            # set loop slowdown condition flags to false
+            self.__idle_write_pc = False
+            to_send = bytearray()
+            time_requests = []
+            boundaries = []
+            # first write the instant packets
+            if not self.__write_buffer.empty():
+                while not self.__write_buffer.empty() and len(to_send) < _MAX_WRITE_BYTES:
+                    data_packet = self.__write_buffer.get()
+                    # check and close the connection if requested by API
+                    if data_packet.header() == Data32bitHeader.UC_CLOSE_CONNECTION:
+                        if data_packet.value() != 0:
+                            to_send += Data32bitPacket(Data32bitHeader.IN_RESET).to_bytearray()
+                        if len(to_send) > 0:
+                            self.__write(bytes(to_send))
+                        self.__connection.close()
+                        self.__closed.set()
+                        return IO_CLOSED
+                    # else send the packet
+                    if data_packet.header() == Data32bitHeader.IN_READ_TIME:
+                        time_requests.append(data_packet is _LATENCY_PROBE_PACKET)
+                    to_send += data_packet.to_bytearray()
+                    if data_packet.header() == Data32bitHeader.IN_SET_TIME:
+                        self.__sent_run_boundary(data_packet, len(to_send), boundaries)
+                    logging.debug("send instant: "+str(data_packet))
+                    self.__write_buffer.task_done()
+            # then write the timed packets
+            else:
+                # check if there is space in the uC input queue
+                if self.__free_input_queue_spots_on_uc > 0 :
+                    # send the packets and decrease the free input queue spots reference in the API
+                    while self.__free_input_queue_spots_on_uc > 0 and len(to_send) < _MAX_WRITE_BYTES:
+                        # a block is send in slices of as many packets as fit
+                        if self.__timed_block is not None:
+                            count = min(self.__free_input_queue_spots_on_uc, max((_MAX_WRITE_BYTES - len(to_send)) // 9, 1))
+                            block_data, self.__last_sent_time = self.__timed_block.take(count)
+                            to_send += block_data
+                            if Data32bitHeader.IN_READ_TIME in block_data[0::9]:
+                                self.__timed_time_requests.extend(int.from_bytes(block_data[offset + 1:offset + 5], "little")
+                                    for offset in range(0, len(block_data), 9) if block_data[offset] == Data32bitHeader.IN_READ_TIME)
+                            self.__free_input_queue_spots_on_uc -= len(block_data) // 9
+                            self.__packet_send += len(block_data) // 9
+                            if self.__timed_block.remaining() == 0:
+                                self.__timed_block = None
+                            continue
+                        if self.__write_buffer_timed.empty():
+                            break
+                        data_packet = self.__write_buffer_timed.get()
+                        if isinstance(data_packet, PacketBlock):
+                            self.__timed_block = data_packet
                             self.__write_buffer_timed.task_done()
-                        else:
-                            # request the free input queue spots from the uC, 
-                            # first request is send instantly, then every 200th loop run through
-                            # to not overload the uC with requests, uC will also report the free input
-                            # queue spots when it frees up space and the queue was full before
-                            idle_write_uc += 1
-                            if idle_write_uc%200 == 1:
-                                if request_free_input_queue_spots == False:
-                                    request_free_input_queue_spots = True
-                                    packet_to_send = Data32bitPacket(Data32bitHeader.IN_FREE_INSTRUCTION_SPOTS)
-                                    self.__connection.write(packet_to_send.to_bytearray())
-                                    logging.debug("send request: "+str(packet_to_send))
-                else:
-                    # set write loop slowdown condition flag
-                    idle_write_pc = True
-
-                # check if there is a package to read from the serial connection, 
-                # read 20 packages under the assumption that the pc is faster and
-                # the uC will send more packages 
-                # stops if there is nothing to read
-                for i in range(20):
-                    if self.__connection.in_waiting >= 9:
-                        idle_read = False
-                        byte_packet = self.__connection.read(size = 9)
-                        # remove alignment bytes
-                        byte_packet = byte_packet.lstrip(b'\xff')
-                        # check if the packet is complete
-                        if len(byte_packet) < 9:
-                            if len(byte_packet) != 0:
-                                #initiate alignment for incompleate packets
-                                logging.warning("outgoing uC alignment needed, shifted by "+str(len(byte_packet))+ " bytes")
-                                # partial packet not recoverable
-                                if self.__connection.in_waiting < 9-len(byte_packet):
-                                    logging.error("partial packet received, but not enough bytes send by uC, trying to recover by realigning")
-                                    self.__connection.write(ALIGN_BYTEARRAY)
-                                    continue
-                                # to complete partial packet
-                                byte_packet = bytearray(byte_packet).extend(bytearray(self.__connection.read(size = 9-len(byte_packet))))
-
-                            else:
-                                logging.debug("alignment sucesss - no incoming alignment error")
-                                # no packet, jump to next iteration
-                                continue
-                        # is now aligned
-                        try:
-                            # convert the byte packet to a packet object
-                            read_packet = Packet.from_bytearray(byte_packet)
-                        except:
-                            # packet was malformed, force alignment sequence
-                            logging.error("packet is malformed, maybe misaligned, trying to recover by realigning")
-                            self.__connection.write(ALIGN_BYTEARRAY)
                             continue
-                        # packet is complete and valid
-                        logging.debug("read: "+str(read_packet))
-                        # catch the special case of the uC reporting free input queue spots
-                        if read_packet.header() is Data32bitHeader.OUT_FREE_INSTRUCTION_SPOTS:
-                            # save the free input queue spots in the API
-                            if read_packet.time() > last_sent_time and exec_running > 0:
-                                logging.warning("Timing exec squewed, increase buffer size in firmware, last sent time: "+\
-                                    str(last_sent_time)+" uC time: "+str(read_packet.time())+\
-                                        "\npackets send: "+str(packet_send)+" for free spots: "+str(last_free_spots))    
-                            else:
-                                logging.debug("uC reports "+str(read_packet.value())+" free input queue spots at time "+\
-                                    str(read_packet.time())+"\nwaiting on PC: "+str(self.__write_buffer_timed.qsize())+\
-                                        " with time starting from: "+str(last_sent_time)+\
-                                        "\npackets send: "+str(packet_send)+" for free spots: "+str(last_free_spots))
-                            last_free_spots = read_packet.value()
-                            packet_send = 0
-                            # set one less then availible, because of bug the pc will send to much
-                            free_input_queue_spots_on_uc  = read_packet.value()
-                            if free_input_queue_spots_on_uc == 0:
-                                idle_write_uc = 2
-                            else:
-                                idle_write_uc = 0
-                            request_free_input_queue_spots = False
-                        # catch the special case of the uC reporting an malformed packet from the API
-                        elif read_packet.header() is ErrorHeader.OUT_ERROR_UNKNOWN_INSTRUCTION or read_packet.header() is ErrorHeader.OUT_ERROR_UNKNOWN_CONFIGURATION:
-                            logging.error("uC is reporting that it cant understand a send packet, either API and firmware are a different version or communication is not aligned, trying to recover by realigning")
-                            self.__connection.write(ALIGN_BYTEARRAY)
-                        # keep track of the experiment state, so we know when to issue a warning for execution time squew
-                        elif read_packet.header() == Data32bitHeader.IN_SET_TIME:
-                            exec_running = read_packet.value()
-                            logging.info("Experiment state changed to: "+str(exec_running))
-                            self.__read_buffer.put(read_packet)
-                        # normal packet, send to the read buffer for further processing by the main thread
-                        else:
-                            self.__read_buffer.put(read_packet)
-                    else:
-                        # set read loop slowdown condition flag, as there is nothing to read
-                        idle_read = True
-                        break
-                
-                # slow down the loop if there is nothing to do
-                if idle_read and (idle_write_pc or idle_write_uc > 0):
-                    sleep(0.000003)
-                    idle_read = False
-                    idle_write_pc = False
+                        self.__free_input_queue_spots_on_uc -= 1
+                        to_send += data_packet.to_bytearray()
+                        if data_packet.header() == Data32bitHeader.IN_READ_TIME:
+                            self.__timed_time_requests.append(data_packet.time())
+                        if data_packet.header() == Data32bitHeader.IN_SET_TIME:
+                            self.__sent_run_boundary(data_packet, len(to_send), boundaries)
+                        self.__last_sent_time = data_packet.time()
+                        self.__packet_send += 1
+                        logging.debug("send timed: "+str(data_packet))
+                        self.__write_buffer_timed.task_done()
+                else:
+                    # request the free input queue spots from the uC, 
+                    # first request is send instantly, then every 200th loop run through
+                    # to not overload the uC with requests, uC will also report the free input
+                    # queue spots when it frees up space and the queue was full before
+                    self.__idle_write_uc += 1
+                    if self.__idle_write_uc%200 == 1:
+                        if self.__request_free_input_queue_spots == False:
+                            self.__request_free_input_queue_spots = True
+                            packet_to_send = Data32bitPacket(Data32bitHeader.IN_FREE_INSTRUCTION_SPOTS)
+                            to_send += packet_to_send.to_bytearray()
+                            logging.debug("send request: "+str(packet_to_send))
+            if len(to_send) > 0:
+                write_time = perf_counter_ns()
+                self.__write(bytes(to_send))
+                self.__record_sent_packets(to_send, boundaries)
+                if self.__ack_tracker is not None:
+                    self.__ack_tracker.sent(to_send)
+                for is_probe in time_requests:
+                    self.__time_requests.append((write_time, self.__traffic, is_probe))
+                self.__traffic += len(to_send) // 9
+        else:
+            # set write loop slowdown condition flag
+            self.__idle_write_pc = True
 
-            
-                    
+        # read everything the uC has send (up to _MAX_READ_BYTES, so one uC can not block a DeviceManager)
+        # and process all complete packets, an incomplete packet stays in the receive buffer for the next round
+        waiting = self.__connection.in_waiting
+        if waiting > 0:
+            self.__received += self.__connection.read(size = min(waiting, _MAX_READ_BYTES))
+            read_time = perf_counter_ns()
+        received = self.__received
+        if len(received) < 9:
+            # set read loop slowdown condition flag, as there is nothing to read
+            self.__idle_read = True
+        else:
+            self.__idle_read = False
+            if waiting == 0:
+                # packets left in the receive buffer from the last round
+                read_time = perf_counter_ns()
+            position = 0
+            packets = []
+            while len(received) - position >= 9:
+                # remove alignment bytes
+                if received[position] == 0xff:
+                    logging.debug("alignment byte received from the uC")
+                    position += 1
+                    continue
+                byte_packet = bytes(received[position:position + 9])
+                position += 9
+                packets.append(byte_packet)
+            del received[:position]
+            # react first, the responses are written before anything else is done with the packets
+            reaction_table = self.__reaction_table
+            if len(reaction_table) > 0 and len(packets) > 0:
+                self.__react(reaction_table, packets, read_time)
+            self.__traffic += len(packets)
+            # record the raw packets before decoding them
+            if len(packets) > 0:
+                joined_packets = b"".join(packets)
+                capture = self.__capture
+                if capture is not None:
+                    capture.record(CAPTURE_FROM_UC, joined_packets)
+                for listener in self.__packet_listeners:
+                    try:
+                        listener(joined_packets)
+                    except Exception as error:
+                        logging.error("packet listener failed: "+repr(error))
+            last_stamped = None
+            forwarded = self.__forwarded
+            for byte_packet in packets:
+                if forwarded is not None and byte_packet[0] in _FORWARD_HEADERS:
+                    # decoded by the receiver (the parent of process=True), any 32bit value is valid
+                    forwarded.append(byte_packet)
+                    continue
+                # convert the byte packet to a packet object
+                read_packet = Packet.from_bytearray(byte_packet)
+                if read_packet is None:
+                    # packet was malformed, force alignment sequence
+                    logging.error("packet is malformed, maybe misaligned, trying to recover by realigning")
+                    self.__write(ALIGN_BYTEARRAY)
+                    # the replies can not be assigned to the requests anymore
+                    self.__time_requests.clear()
+                    self.__timed_time_requests.clear()
+                    continue
+                # packet is complete and valid
+                logging.debug("read: "+str(read_packet))
+                if self.__ack_tracker is not None:
+                    self.__ack_tracker.received(byte_packet)
+                # error packets carry no time stamp
+                if not isinstance(read_packet, ErrorPacket):
+                    uc_time = read_packet.time()
+                    self.__unwrap_time(read_packet, read_time)
+                    last_stamped = read_packet
+                # the packets handled by the communication loop itself are not passed on
+                deliver = True
+                # catch the special case of the uC reporting free input queue spots
+                if read_packet.header() is Data32bitHeader.OUT_FREE_INSTRUCTION_SPOTS:
+                    deliver = False
+                    # save the free input queue spots in the API
+                    if uc_time > self.__last_sent_time and self.__exec_running > 0:
+                        logging.warning("Timing exec squewed, increase buffer size in firmware, last sent time: "+\
+                            str(self.__last_sent_time)+" uC time: "+str(read_packet.time())+\
+                                "\npackets send: "+str(self.__packet_send)+" for free spots: "+str(self.__last_free_spots))    
+                    else:
+                        logging.debug("uC reports "+str(read_packet.value())+" free input queue spots at time "+\
+                            str(read_packet.time())+"\nwaiting on PC: "+str(self.__write_buffer_timed.qsize())+\
+                                " with time starting from: "+str(self.__last_sent_time)+\
+                                "\npackets send: "+str(self.__packet_send)+" for free spots: "+str(self.__last_free_spots))
+                    self.__last_free_spots = read_packet.value()
+                    self.__packet_send = 0
+                    # set one less then availible, because of bug the pc will send to much
+                    self.__free_input_queue_spots_on_uc = read_packet.value()
+                    if self.__free_input_queue_spots_on_uc == 0:
+                        self.__idle_write_uc = 2
+                    else:
+                        self.__idle_write_uc = 0
+                    self.__request_free_input_queue_spots = False
+                # catch the special case of the uC reporting an malformed packet from the API
+                elif read_packet.header() is ErrorHeader.OUT_ERROR_UNKNOWN_INSTRUCTION or read_packet.header() is ErrorHeader.OUT_ERROR_UNKNOWN_CONFIGURATION:
+                    logging.error("uC is reporting that it cant understand a send packet, either API and firmware are a different version or communication is not aligned, trying to recover by realigning")
+                    self.__write(ALIGN_BYTEARRAY)
+                    deliver = False
+                # the answer to the oldest open IN_READ_TIME request, the firmware replies with the request header
+                elif read_packet.header() is Data32bitHeader.IN_READ_TIME or read_packet.header() is Data32bitHeader.OUT_TIME:
+                    request = self.__time_request(uc_time, read_time)
+                    if request is not None:
+                        write_time, traffic, is_probe = request
+                        # the time field is on the timeline of all other packets, the value is the raw micros() of the uC
+                        self.__clock_model.add_round_trip(read_packet.time(), write_time, read_time)
+                        # everything exchanged besides the request and this reply is load
+                        loaded = self.__traffic - traffic > 2
+                        probe = self.__latency_probe
+                        if is_probe:
+                            deliver = False
+                            if probe is not None:
+                                probe.record(read_time - write_time, loaded)
+                # keep track of the experiment state, so we know when to issue a warning for execution time squew
+                elif read_packet.header() == Data32bitHeader.IN_SET_TIME:
+                    self.__exec_running = read_packet.value()
+                    if read_packet.value() != 0 and self.__time_unwrapper is None:
+                        # the uC clock was set, a new run starts
+                        self.__clock_model.restart()
+                    if read_packet.value() == 0:
+                        # the stop cleared the input queue of the uC, the timed requests in it are not answered
+                        self.__timed_time_requests.clear()
+                    logging.info("Experiment state changed to: "+str(self.__exec_running))
+                # normal packet, send to the read buffer for further processing by the main thread
+                if deliver:
+                    if forwarded is None:
+                        self.__read_buffer.put(read_packet)
+                    else:
+                        forwarded.append(byte_packet)
+            if last_stamped is not None:
+                # the last stamped packet of the round was stamped by the uC before it was read
+                self.__clock_model.add_arrival(last_stamped.time(), read_time)
+        
+        # report if there is nothing to do, so the loop can slow down
+        if self.__idle_read and (self.__idle_write_pc or self.__idle_write_uc > 0):
+            self.__idle_read = False
+            self.__idle_write_pc = False
+            return IO_IDLE
+        return IO_BUSY
@@ -0,0 +1,316 @@
+#    This file is part of the Firmware project to interface with small Async or Neuromorphic chips
+#    Copyright (C) 2024 Ole Richter - University of Groningen
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import csv
+import logging
+import re
+from time import sleep, monotonic
+from .stimulus import PacketBlock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+test vector files: stimulus from a file, streamed to the uC, and the recorded data compared to expected vectors
+
+a vector file has the columns time (us after the experiment start), interface and value, one row per word:
+ - .csv with a header row naming the columns (in any order), values can be decimal or 0x hex, lines starting with # are skipped
+ - .npy a structured array with the fields time, interface (string) and value, read memory mapped
+
+the interface is named like the interface objects of the uC_api: async_to_chip0, spi1, pin3 for the stimulus,
+async_from_chip1, spi0, pin4 for the expected data (async_to_chip<n> in an expected file is compared to what the uC send).
+a stimulus file has to be sorted by time.
+
+.. code-block:: python
+
+    runner = uC_api.vectors.VectorRunner(uc)
+    report = runner.run("stimulus.csv", expected_path="expected.npy")
+    print(report["passed"], report["interfaces"])
+
+the files are read in chunks of chunk_rows rows, every chunk is compiled into a stimulus.PacketBlock (with numpy, without Packet objects)
+and send with uC_api.send_block, at most max_pending chunks are waiting in the API, so files of any size stream with bounded memory
+at the speed the uC takes them. the comparison of the recorded data with the expected vectors is vectorized with numpy.
+needs numpy.
+"""
+
+_PACKET_DTYPE = None if np is None else np.dtype([("header", "u1"), ("time", "<u4"), ("value", "<u4")])
+
+
+def read_vectors(path, chunk_rows=65536):
+    """read_vectors reads a vector file in chunks
+
+    :param path: the .csv or .npy file
+    :type path: string
+    :param chunk_rows: number of rows per chunk, defaults to 65536
+    :type chunk_rows: int, optional
+    :return: generator of chunks, dicts of numpy arrays with the keys time (int64), interface (str) and value (int64)
+    :rtype: generator
+    """
+    if np is None:
+        raise ImportError("test vectors need numpy")
+    if path.endswith(".npy"):
+        vectors = np.load(path, mmap_mode="r")
+        for start in range(0, len(vectors), chunk_rows):
+            chunk = vectors[start:start + chunk_rows]
+            yield {"time": np.asarray(chunk["time"], dtype=np.int64), "interface": np.asarray(chunk["interface"]).astype(str),
+                "value": np.asarray(chunk["value"], dtype=np.int64)}
+        return
+    with open(path, newline="") as vector_file:
+        rows = csv.reader(line for line in vector_file if not line.startswith("#") and line.strip() != "")
+        names = [name.strip().lower() for name in next(rows)]
+        for column in ("time", "interface", "value"):
+            if column not in names:
+                raise ValueError(path+" has no column "+column+", columns: "+str(names))
+        time_column, interface_column, value_column = names.index("time"), names.index("interface"), names.index("value")
+        times, interfaces, values = [], [], []
+        for row in rows:
+            times.append(int(row[time_column], 0))
+            interfaces.append(row[interface_column].strip())
+            values.append(int(row[value_column], 0))
+            if len(times) == chunk_rows:
+                yield {"time": np.array(times, dtype=np.int64), "interface": np.array(interfaces, dtype=str), "value": np.array(values, dtype=np.int64)}
+                times, interfaces, values = [], [], []
+        if len(times) > 0:
+            yield {"time": np.array(times, dtype=np.int64), "interface": np.array(interfaces, dtype=str), "value": np.array(values, dtype=np.int64)}
+
+
+def interface_by_name(api, name):
+    """interface_by_name returns the interface object of a uC_api for a name like async_from_chip1 or pin3
+
+    :param api: the uC (level 2)
+    :type api: uC_api
+    :param name: the name
+    :type name: string
+    :raises ValueError: if there is no such interface
+    :return: the interface
+    :rtype: Interface_*
+    """
+    match = re.fullmatch(r"(async_to_chip|async_from_chip|spi|i2c|pin)(\d+)", name)
+    if match is None or int(match.group(2)) >= len(getattr(api, match.group(1))):
+        raise ValueError("unknown interface "+str(name))
+    return getattr(api, match.group(1))[int(match.group(2))]
+
+
+class VectorCompiler:
+    """
+    VectorCompiler encodes chunks of stimulus vectors into packet blocks for the interfaces of a uC_api
+    """
+    def __init__(self, api):
+        """__init__ prepares the compiler
+
+        :param api: the uC (level 2)
+        :type api: uC_api
+        """
+        if np is None:
+            raise ImportError("test vectors need numpy")
+        self.__api = api
+        self.__targets = {}
+        self.__last_time = 0
+        self.__rows = 0
+
+    def __target(self, name):
+        """(header, pin id or -1) of a stimulus interface
+        """
+        target = self.__targets.get(name)
+        if target is None:
+            interface = interface_by_name(self.__api, name)
+            if name.startswith("async_to_chip") or name.startswith("spi"):
+                target = (int(interface.header()[1]), -1)
+            elif name.startswith("pin"):
+                target = (int(interface.header()[1]), int(name[len("pin"):]))
+            else:
+                raise ValueError(str(name)+" can not be used in a stimulus (only async_to_chip, spi and pin)")
+            self.__targets[name] = target
+        return target
+
+    def compile(self, chunk):
+        """compile encodes one chunk, the chunks have to be compiled in the order of the file
+
+        :param chunk: chunk from read_vectors
+        :type chunk: dict
+        :raises ValueError: if the vectors are not sorted by time or name an unknown interface
+        :return: the block
+        :rtype: PacketBlock
+        """
+        times = chunk["time"]
+        if len(times) == 0:
+            return PacketBlock(b"")
+        unsorted = np.flatnonzero(np.diff(times, prepend=self.__last_time) < 0)
+        if len(unsorted) > 0:
+            raise ValueError("the stimulus vectors are not sorted by time at row "+str(self.__rows + int(unsorted[0])))
+        if times[0] < 0 or times[-1] >= 2**32:
+            raise ValueError("the stimulus times have to be between 0 and 2**32-1 us")
+        names, inverse = np.unique(chunk["interface"], return_inverse=True)
+        targets = np.array([self.__target(str(name)) for name in names], dtype=np.int64).reshape(len(names), 2)
+        headers = targets[inverse, 0]
+        pin_ids = targets[inverse, 1]
+        values = chunk["value"]
+        # pin packets carry <pin_id><value><0><0> where the 32bit packets carry the value
+        values = np.where(pin_ids >= 0, pin_ids + (values << 8), values)
+        packets = np.empty(len(times), dtype=_PACKET_DTYPE)
+        packets["header"] = headers
+        packets["time"] = times
+        packets["value"] = values
+        self.__last_time = int(times[-1])
+        self.__rows += len(times)
+        return PacketBlock(packets.tobytes())
+
+
+def compare_vectors(api, expected_path, run=None, time_tolerance=None, chunk_rows=65536, max_mismatches=10):
+    """compare_vectors compares the recorded data of a run with the expected vectors, per interface the words are compared in order
+
+    :param api: the uC (level 2)
+    :type api: uC_api
+    :param expected_path: the .csv or .npy file with the expected vectors
+    :type expected_path: string
+    :param run: the run, defaults to None (all recorded data)
+    :type run: int, optional
+    :param time_tolerance: if given the recorded time of every word has to be within this many us of the expected time,
+        defaults to None (times are not compared)
+    :type time_tolerance: int, optional
+    :param chunk_rows: rows read at once, defaults to 65536
+    :type chunk_rows: int, optional
+    :param max_mismatches: number of mismatches listed per interface, defaults to 10
+    :type max_mismatches: int, optional
+    :return: dict with the keys passed and interfaces (per interface name: expected, recorded, mismatches and first_mismatches,
+        a list of dicts with index, expected_value, recorded_value, expected_time, recorded_time)
+    :rtype: dict
+    """
+    if np is None:
+        raise ImportError("test vectors need numpy")
+    expected = {}
+    for chunk in read_vectors(expected_path, chunk_rows):
+        names, inverse = np.unique(chunk["interface"], return_inverse=True)
+        for index, name in enumerate(names):
+            rows = inverse == index
+            values, times = expected.setdefault(str(name), ([], []))
+            values.append(chunk["value"][rows])
+            times.append(chunk["time"][rows])
+    report = {"passed": True, "interfaces": {}}
+    for name, (values, times) in expected.items():
+        interface = interface_by_name(api, name)
+        if name.startswith("async_to_chip"):
+            recorded_values, recorded_times = interface.data_to_chip(run=run)
+        else:
+            recorded_values, recorded_times = interface.data_from_chip(run=run)
+        expected_values, expected_times = np.concatenate(values), np.concatenate(times)
+        recorded_values = np.asarray(recorded_values, dtype=np.int64)
+        recorded_times = np.asarray(recorded_times, dtype=np.int64)
+        length = min(len(expected_values), len(recorded_values))
+        different = recorded_values[:length] != expected_values[:length]
+        if time_tolerance is not None:
+            different |= np.abs(recorded_times[:length] - expected_times[:length]) > time_tolerance
+        mismatches = int(np.count_nonzero(different)) + abs(len(expected_values) - len(recorded_values))
+        first = [{"index": int(index), "expected_value": int(expected_values[index]), "recorded_value": int(recorded_values[index]),
+            "expected_time": int(expected_times[index]), "recorded_time": int(recorded_times[index])}
+            for index in np.flatnonzero(different)[:max_mismatches]]
+        if len(first) < max_mismatches and len(expected_values) != len(recorded_values):
+            # the words missing or recorded in addition
+            for index in range(length, min(max(len(expected_values), len(recorded_values)), length + max_mismatches - len(first))):
+                first.append({"index": index,
+                    "expected_value": int(expected_values[index]) if index < len(expected_values) else None,
+                    "recorded_value": int(recorded_values[index]) if index < len(recorded_values) else None,
+                    "expected_time": int(expected_times[index]) if index < len(expected_times) else None,
+                    "recorded_time": int(recorded_times[index]) if index < len(recorded_times) else None})
+        report["interfaces"][name] = {"expected": len(expected_values), "recorded": len(recorded_values),
+            "mismatches": mismatches, "first_mismatches": first}
+        if mismatches > 0:
+            report["passed"] = False
+    return report
+
+
+class VectorRunner:
+    """
+    VectorRunner streams a stimulus vector file to a uC in one experiment and compares the result with an expected vector file
+    """
+    def __init__(self, api, chunk_rows=65536, max_pending=4, timeout=10.0):
+        """__init__ creates the runner
+
+        :param api: the uC (level 2)
+        :type api: uC_api
+        :param chunk_rows: rows compiled and send at once, defaults to 65536
+        :type chunk_rows: int, optional
+        :param max_pending: maximal number of chunks waiting in the API to be written to the uC, defaults to 4
+        :type max_pending: int, optional
+        :param timeout: time in s the experiment may take longer than the last stimulus, defaults to 10.0
+        :type timeout: float, optional
+        """
+        self.__api = api
+        self.__chunk_rows = chunk_rows
+        self.__max_pending = max_pending
+        self.__timeout = timeout
+
+    def run(self, stimulus_path, expected_path=None, tail=1000, time_tolerance=None):
+        """run starts an experiment, streams the stimulus, stops the experiment tail us after the last stimulus and compares the data
+
+        :param stimulus_path: the .csv or .npy stimulus file
+        :type stimulus_path: string
+        :param expected_path: the .csv or .npy file with the expected vectors, defaults to None (no comparison)
+        :type expected_path: string, optional
+        :param tail: time in us the experiment continues after the last stimulus, defaults to 1000
+        :type tail: int, optional
+        :param time_tolerance: see compare_vectors, defaults to None
+        :type time_tolerance: int, optional
+        :raises TimeoutError: if the uC did not stop the experiment in time
+        :raises ConnectionError: if the connection to the uC is closed
+        :return: dict with the keys run, stimulus (number of vectors send), passed and interfaces (see compare_vectors, passed is None without expected vectors)
+        :rtype: dict
+        """
+        api = self.__api
+        compiler = VectorCompiler(api)
+        states = len(api.experiment_state()[0])
+        api.start_experiment()
+        pending = []
+        last_time = 0
+        sent = 0
+        for chunk in read_vectors(stimulus_path, self.__chunk_rows):
+            block = compiler.compile(chunk)
+            # flow control: wait until the oldest chunk was written to the uC
+            while len(pending) >= self.__max_pending:
+                if pending[0].remaining() == 0:
+                    pending.pop(0)
+                    continue
+                if api.is_closed():
+                    raise ConnectionError("the connection to "+str(api.name())+" was closed while streaming "+stimulus_path)
+                sleep(0.0005)
+            pending.append(api.send_block(block))
+            sent += len(block)
+            if len(chunk["time"]) > 0:
+                last_time = int(chunk["time"][-1])
+        api.stop_experiment(time=last_time + tail)
+        deadline = None
+        while True:
+            api.update_state()
+            new_states = api.experiment_state()[0][states:]
+            if len(new_states) >= 2 and new_states[0] > 0 and new_states[-1] == 0:
+                break
+            if api.is_closed():
+                raise ConnectionError("the connection to "+str(api.name())+" was closed during "+stimulus_path)
+            # the deadline starts when all chunks are written, the uC takes the stimulus as fast as it executes it
+            if all(block.remaining() == 0 for block in pending):
+                deadline = monotonic() + (last_time + tail) * 1e-6 + self.__timeout if deadline is None else deadline
+                if monotonic() > deadline:
+                    raise TimeoutError("the uC "+str(api.name())+" did not stop the experiment in time")
+            sleep(0.001)
+        run = api.current_run()
+        report = {"run": run, "stimulus": sent, "passed": None, "interfaces": {}}
+        if expected_path is not None:
+            report.update(compare_vectors(api, expected_path, run=run, time_tolerance=time_tolerance, chunk_rows=self.__chunk_rows))
+        logging.info("test vectors "+stimulus_path+": "+str(sent)+" send, "+("passed" if report["passed"] else "not compared" if report["passed"] is None else "failed"))
+        return report